@@ -11,13 +11,17 @@ st.set_page_config(
 
 # 2. IMPORT MODULES
 # Đảm bảo các file này tồn tại trong thư mục services/ và tabs/
+from core.metrics import RECORDER, span
 from services.auth import render_auth_interface
-from services.repair_service import get_repair_data
+from services.change_feed import get_change_feed, FEED_TTL
+from services.repair_service import get_repair_data, get_memory_report, REPAIR_TTL
+from services.sync_service import get_sync_stats
 from tabs.dashboard import render_dashboard
 from tabs.admin import render_admin_panel
 from tabs.kpi import render_kpi_dashboard
 from tabs.alerts import render_alerts
 from tabs.ai_intelligence import render_ai_intelligence
+from tabs.diagnostics import render_diagnostics
 
 # 3. CSS CUSTOMIZATION (Tùy chỉnh giao diện cho Apple Style)
 st.markdown("""
@@ -31,6 +35,15 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+# CÁC MỤC CHÍNH (Sử dụng Icon để tăng tính trực quan)
+SECTIONS = {
+    "📊 Dashboard": render_dashboard,
+    "📥 Quản trị & Nhập liệu": render_admin_panel,
+    "🎯 KPI Hiệu suất": render_kpi_dashboard,
+    "🧠 AI Insights": render_ai_intelligence,
+    "🚨 Cảnh báo rủi ro": render_alerts,
+}
+
 # 4. KHỞI TẠO SESSION STATE
 if "is_logged_in" not in st.session_state:
     st.session_state["is_logged_in"] = False
@@ -43,9 +56,14 @@ def main():
         render_auth_interface()
         return  
 
+    # Gom các span (tải dữ liệu, tính toán, render) của lần rerun này cho bảng chẩn đoán
+    RECORDER.begin_rerun()
+
     # --- NẾU ĐÃ ĐĂNG NHẬP, LẤY DỮ LIỆU ---
     # get_repair_data() nên trả về DataFrame đã xử lý cột NĂM, THÁNG
-    df_db = get_repair_data()
+    # Change feed nền giữ dataset luôn mới -> TTL chỉ còn là lưới an toàn khi feed dừng
+    feed = get_change_feed()
+    df_db = get_repair_data(ttl=FEED_TTL if feed.running else REPAIR_TTL)
     user_info = st.session_state["user_info"]
 
     # 5. SIDEBAR (Thiết kế tối giản)
@@ -57,45 +75,65 @@ def main():
         
         # Tiện ích nhanh
         if st.button("🔄 Làm mới dữ liệu", use_container_width=True):
-            st.cache_data.clear()
-            st.toast("Đang cập nhật dữ liệu mới nhất...", icon="⏳")
-            st.rerun()
+            # Chỉ kéo delta ngay lập tức (không xóa cache, không tải lại toàn bộ)
+            try:
+                changed = feed.poll_now()
+                st.toast(f"Đã đồng bộ {changed} dòng thay đổi", icon="✅")
+                st.rerun()
+            except Exception as e:
+                st.error(f"❌ Không đồng bộ được dữ liệu: {e}")
             
         if st.button("🚪 Đăng xuất", type="secondary", use_container_width=True):
             st.session_state["is_logged_in"] = False
             st.session_state["user_info"] = None
             st.rerun()
 
+        # Thống kê đồng bộ delta gần nhất
+        sync_stats = get_sync_stats().get("repair_cases", {})
+        if sync_stats.get("mode"):
+            st.caption(
+                f"🔁 Sync {sync_stats['mode']}: {sync_stats['rows_fetched']} dòng / "
+                f"{sync_stats['elapsed_ms']} ms"
+            )
+        fs = feed.stats
+        if fs["last_poll"]:
+            st.caption(
+                f"📡 Feed {'đang chạy' if feed.running else 'đã dừng'}: "
+                f"{fs['polls']} lần kéo, {fs['rows_changed']} dòng cập nhật"
+                + (f", {fs['errors']} lỗi" if fs['errors'] else "")
+            )
+        mem = get_memory_report()
+        if mem:
+            st.caption(
+                f"💾 Bộ nhớ dataset: {mem['before_bytes'] / 1e6:.1f} MB → "
+                f"{mem['after_bytes'] / 1e6:.1f} MB (-{mem['saved_pct']}%)"
+            )
+
         st.divider()
         st.caption("© 2024 Operation Management System")
 
-    # 6. HỆ THỐNG TABS CHÍNH
-    # Sử dụng Icon để tăng tính trực quan
-    tab_dash, tab_admin, tab_kpi, tab_ai, tab_alert = st.tabs([
-        "📊 Dashboard", 
-        "📥 Quản trị & Nhập liệu", 
-        "🎯 KPI Hiệu suất", 
-        "🧠 AI Insights",
-        "🚨 Cảnh báo rủi ro"
-    ])
+    # 6. HỆ THỐNG TABS CHÍNH (LAZY)
+    # st.tabs chạy code của mọi tab ở mỗi lần rerun dù tab bị ẩn,
+    # nên dùng thanh điều hướng và chỉ render mục đang chọn.
+    # Kết quả nặng của các mục khác được memo theo version dữ liệu (core.dataset_cache).
+    active = st.radio(
+        "Điều hướng",
+        list(SECTIONS),
+        horizontal=True,
+        key="active_section",
+        label_visibility="collapsed"
+    )
+    st.divider()
 
-    with tab_dash:
-        # Truyền df_db vào tab báo cáo
-        render_dashboard(df_db)
+    # Bảo mật: Chỉ Admin hoặc Manager mới thấy nội dung nhạy cảm nếu cần
+    # Ở đây cho phép hiển thị chung, nhưng có thể check trong render_admin_panel
+    render = SECTIONS[active]
+    with span(f"render.{render.__name__}"):
+        render(df_db)
 
-    with tab_admin:
-        # Bảo mật: Chỉ Admin hoặc Manager mới thấy nội dung nhạy cảm nếu cần
-        # Ở đây cho phép hiển thị chung, nhưng có thể check trong render_admin_panel
-        render_admin_panel(df_db)
-
-    with tab_kpi:
-        render_kpi_dashboard(df_db)
-
-    with tab_ai:
-        render_ai_intelligence(df_db)
-
-    with tab_alert:
-        render_alerts(df_db)
+    # Đặt cuối trang để thấy đủ span của lần rerun (chỉ Admin)
+    with st.sidebar:
+        render_diagnostics(user_info)
 
 if __name__ == "__main__":
     main()
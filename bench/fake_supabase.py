@@ -0,0 +1,189 @@
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+
+
+class FakeSupabase:
+    """
+    Bản giả lập client Supabase trong bộ nhớ cho benchmark: table(...).select/eq/in_/gt/gte/or_/order/limit
+    và insert/upsert/update/delete, trả về đối tượng có .data như postgrest.
+    latency_ms giả lập độ trễ mạng mỗi request. Chỉ hỗ trợ đủ các phép lọc mà repo đang dùng.
+    """
+
+    def __init__(self, tables, latency_ms=0.0):
+        self.tables = {name: df.reset_index(drop=True) for name, df in tables.items()}
+        self.latency_ms = latency_ms
+        self.requests = 0
+        self._filtered = {}
+        self._ids = itertools.count(10 ** 9)
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        return _FakeQuery(self, name)
+
+    def from_(self, name):
+        return self.table(name)
+
+    # --- thực thi ---
+    def _run(self, q):
+        with self._lock:
+            self.requests += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        if q.write is not None:
+            return self._write(q)
+        df = self._select(q)
+        return SimpleNamespace(data=df.astype(object).where(df.notna(), None).to_dict("records"))
+
+    def _select(self, q):
+        df = self.tables.get(q.name, pd.DataFrame())
+        # Kết quả lọc (không tính gt phân trang) được giữ lại để các trang kế tiếp chỉ cần tìm nhị phân
+        key = (q.name, id(df), repr(q.filters), q.order_by)
+        with self._lock:
+            base = self._filtered.get(key)
+        if base is None:
+            mask = np.ones(len(df), dtype=bool)
+            for f in q.filters:
+                mask &= _mask(df, f)
+            base = df[mask]
+            if q.order_by:
+                col, desc = q.order_by
+                base = base.sort_values(col, ascending=not desc, kind="mergesort")
+            with self._lock:
+                self._filtered[key] = base
+        if q.page_after is not None:
+            col, value = q.page_after
+            pos = np.searchsorted(base[col].to_numpy(), value, side="right")
+            base = base.iloc[pos:]
+        if q.columns != "*":
+            cols = [c.strip() for c in q.columns.split(",") if c.strip() in base.columns]
+            base = base[cols]
+        return base.iloc[:q.limit_n] if q.limit_n is not None else base
+
+    def _write(self, q):
+        kind, payload = q.write
+        df = self.tables.get(q.name, pd.DataFrame())
+        if kind == "delete":
+            mask = np.ones(len(df), dtype=bool)
+            for f in q.filters:
+                mask &= _mask(df, f)
+            self._set(q.name, df[~mask])
+            return SimpleNamespace(data=df[mask].to_dict("records"))
+        if kind == "update":
+            mask = np.ones(len(df), dtype=bool)
+            for f in q.filters:
+                mask &= _mask(df, f)
+            df = df.copy()
+            for col, value in payload.items():
+                df.loc[mask, col] = value
+            self._set(q.name, df)
+            return SimpleNamespace(data=df[mask].to_dict("records"))
+        rows = pd.DataFrame(payload if isinstance(payload, list) else [payload])
+        if "id" not in rows.columns:
+            rows["id"] = None
+        missing = rows["id"].isna()
+        rows.loc[missing, "id"] = [str(next(self._ids)) for _ in range(int(missing.sum()))]
+        merged = pd.concat([df, rows], ignore_index=True)
+        if kind == "upsert":
+            merged = merged.drop_duplicates("id", keep="last")
+        self._set(q.name, merged)
+        return SimpleNamespace(data=rows.to_dict("records"))
+
+    def _set(self, name, df):
+        with self._lock:
+            self.tables[name] = df.reset_index(drop=True)
+            self._filtered = {k: v for k, v in self._filtered.items() if k[0] != name}
+
+
+def _mask(df, f):
+    op, col, value = f
+    if op == "or":
+        mask = np.zeros(len(df), dtype=bool)
+        for part in value.split(","):
+            c, o, v = part.split(".", 2)
+            mask |= _mask(df, (o, c, v))
+        return mask
+    if col not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    s = df[col]
+    if op == "eq":
+        return (s == value).to_numpy()
+    if op == "in":
+        return s.isin(list(value)).to_numpy()
+    if op in ("gt", "gte", "lt", "lte"):
+        # Cột thời gian lưu dạng chuỗi ISO; so sánh theo thời gian thực
+        left = pd.to_datetime(s, errors="coerce", utc=True)
+        right = pd.Timestamp(value)
+        right = right.tz_localize("UTC") if right.tz is None else right
+        return {"gt": left > right, "gte": left >= right, "lt": left < right, "lte": left <= right}[op].to_numpy()
+    raise NotImplementedError(f"FakeSupabase chưa hỗ trợ phép lọc '{op}'")
+
+
+class _FakeQuery:
+    def __init__(self, owner, name):
+        self.owner = owner
+        self.name = name
+        self.columns = "*"
+        self.filters = []
+        self.order_by = None
+        self.limit_n = None
+        self.page_after = None
+        self.write = None
+
+    def select(self, columns="*", **kwargs):
+        self.columns = columns
+        return self
+
+    def eq(self, col, value):
+        self.filters.append(("eq", col, value))
+        return self
+
+    def in_(self, col, values):
+        self.filters.append(("in", col, tuple(values)))
+        return self
+
+    def gte(self, col, value):
+        self.filters.append(("gte", col, value))
+        return self
+
+    def or_(self, cond):
+        self.filters.append(("or", None, cond))
+        return self
+
+    def gt(self, col, value):
+        # gt trên cột khóa = phân trang keyset -> tìm nhị phân thay vì quét
+        if col == "id":
+            self.page_after = (col, value)
+        else:
+            self.filters.append(("gt", col, value))
+        return self
+
+    def order(self, col, desc=False):
+        self.order_by = (col, desc)
+        return self
+
+    def limit(self, n):
+        self.limit_n = n
+        return self
+
+    def insert(self, rows):
+        self.write = ("insert", rows)
+        return self
+
+    def upsert(self, rows, **kwargs):
+        self.write = ("upsert", rows)
+        return self
+
+    def update(self, values):
+        self.write = ("update", values)
+        return self
+
+    def delete(self):
+        self.write = ("delete", None)
+        return self
+
+    def execute(self):
+        return self.owner._run(self)
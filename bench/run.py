@@ -0,0 +1,178 @@
+"""
+Benchmark tải dữ liệu + các bước tính toán của tab trên dữ liệu giả lập.
+
+    python -m bench.run --sizes 10k,100k --repeat 3
+    python -m bench.run --sizes 1m --repeat 1 --latency 20 --compare bench/results/truoc.json
+    python -m bench.run --backend sqlite     # đọc qua SQLiteBackend in-memory thay cho fake Supabase
+
+Mỗi stage được đo `repeat` lần (lấy median/min) và một lần riêng với tracemalloc để lấy đỉnh bộ nhớ.
+Báo cáo JSON được ghi vào bench/results/ để so sánh giữa các lần chạy (--compare).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+import pandas as pd
+
+from bench.fake_supabase import FakeSupabase
+from bench.synthetic import SIZES, generate
+from core.dataset_cache import get_dataset_cache
+from core.storage import SQLiteBackend
+from services.aggregates import build_cube, rollup
+from services.duckdb_engine import DuckDBEngine, duckdb
+from services.anomaly import GROUP_LEVELS, MIN_GROUP_SIZE, WINDOW_DAYS, AnomalyEngine
+from services.forecast import forecast_branches
+from services.kpi_service import pandas_kpis
+from services.repair_service import REPAIR_DATASET, REPAIR_TABLES, build_repair_frame, compact_repair_frame
+from services.risk import score_machines
+from services.sync_service import SYNC_TABLES, DeltaSync
+from services.time_index import TimeIndex, month_range
+from tabs.alerts import compute_alerts
+from tabs.dashboard import compute_view
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def _measure(name, fn, repeat, report, memory=True):
+    """ Đo fn() `repeat` lần + một lần đo đỉnh bộ nhớ; trả về kết quả lần chạy cuối """
+    times, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    entry = {"median_ms": round(statistics.median(times), 2), "min_ms": round(min(times), 2)}
+    if memory:
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        entry["peak_mb"] = round(peak / 1e6, 2)
+    report[name] = entry
+    print(f"  {name:<24} {entry['median_ms']:>10.1f} ms" + (f"  {entry['peak_mb']:>8.1f} MB" if memory else ""))
+    return result
+
+
+def _sync_all(client):
+    engines = {t: DeltaSync(t, client=client, **SYNC_TABLES[t]) for t in REPAIR_TABLES}
+    return engines, {t: e.sync() for t, e in engines.items()}
+
+
+def _sqlite_client(tables):
+    client = SQLiteBackend(":memory:")
+    for name, df in tables.items():
+        client.load_frame(name, df)
+    return client
+
+
+def run_size(label, n_rows, repeat, latency_ms, memory=True, backend="fake"):
+    print(f"\n== {label} ({n_rows:,} ca, backend {backend}) ==")
+    report = {}
+    tables = _measure("generate", lambda: generate(n_rows), 1, report, memory=False)
+    if backend == "sqlite":
+        client = _measure("load.seed", lambda: _sqlite_client(tables), 1, report, memory=False)
+    else:
+        client = FakeSupabase(tables, latency_ms=latency_ms)
+
+    # 1. Tải: đồng bộ toàn bộ, rồi một vòng delta không có thay đổi
+    engines, snaps = _measure("load.sync_full", lambda: _sync_all(client), repeat, report, memory)
+    _measure("load.sync_delta", lambda: [e.sync() for e in engines.values()], repeat, report, memory)
+    report["load.requests"] = client.stats["calls"] if backend == "sqlite" else client.requests
+
+    # 2. Ghép + chuẩn hóa kiểu (compact sửa tại chỗ nên mỗi lần dùng một bản sao)
+    merged = _measure("load.merge", lambda: build_repair_frame(snaps["repair_cases"], snaps["machines"]),
+                      repeat, report, memory)
+    df, mem = _measure("load.compact", lambda: compact_repair_frame(merged.copy()), repeat, report, memory)
+    report["dataset_mb"] = round(mem["after_bytes"] / 1e6, 2)
+
+    # Dataset mới -> tăng version để các kết quả memo của size trước không bị dùng lại
+    get_dataset_cache().invalidate(REPAIR_DATASET)
+
+    # 3. Các bước tính toán của tab
+    cube = _measure("compute.cube", lambda: build_cube(df), repeat, report, memory)
+    if duckdb is not None:
+        engine = DuckDBEngine()
+        _measure("compute.cube_duckdb", lambda: engine.cube(df), repeat, report, memory)
+        _measure("compute.baselines_duckdb",
+                 lambda: engine.baselines(df, GROUP_LEVELS, WINDOW_DAYS, MIN_GROUP_SIZE), repeat, report, memory)
+    _measure("compute.kpi", lambda: pandas_kpis(df, cube), repeat, report, memory)
+    _measure("compute.risk", lambda: score_machines(rollup(cube, ['machine_display', 'branch'])),
+             repeat, report, memory)
+    _measure("compute.forecast", lambda: forecast_branches(cube), repeat, report, memory)
+    _measure("compute.anomaly", lambda: AnomalyEngine().update(df), repeat, report, memory)
+    _measure("compute.alerts", lambda: compute_alerts.__wrapped__(df), repeat, report, memory)
+    t_index = _measure("compute.time_index", lambda: TimeIndex(df), repeat, report, memory)
+
+    year = int(df['NĂM'].max())
+    t_start, t_end = month_range(year)
+    branches = tuple(t_index.branches[:3])
+    _measure("filter.select", lambda: t_index.select(t_start, t_end, branches=branches), repeat, report, memory)
+    _measure("compute.dashboard_view",
+             lambda: compute_view(cube, t_index, "Tháng / Năm", year, None, t_start, t_end, branches),
+             repeat, report, memory)
+    return report
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline_path):
+    """ In tỉ lệ thời gian (lần này / lần trước) cho các stage có ở cả hai báo cáo """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n== So sánh với {baseline_path} ({baseline['meta'].get('commit')}) ==")
+    for size, stages in current["results"].items():
+        old = baseline["results"].get(size, {})
+        for stage, entry in stages.items():
+            prev = old.get(stage)
+            if isinstance(entry, dict) and isinstance(prev, dict) and prev.get("median_ms"):
+                ratio = entry["median_ms"] / prev["median_ms"]
+                flag = "  ⚠️ chậm hơn" if ratio > 1.1 else ("  ✅ nhanh hơn" if ratio < 0.9 else "")
+                print(f"  {size:<5} {stage:<24} {prev['median_ms']:>10.1f} -> {entry['median_ms']:>10.1f} ms  x{ratio:.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark tải dữ liệu và tính toán các tab")
+    parser.add_argument("--sizes", default="10k,100k", help=f"danh sách kích thước: {', '.join(SIZES)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="độ trễ giả lập mỗi request (ms)")
+    parser.add_argument("--backend", choices=["fake", "sqlite"], default="fake", help="nguồn dữ liệu cho bước tải")
+    parser.add_argument("--no-memory", action="store_true", help="bỏ đo đỉnh bộ nhớ (tracemalloc làm chậm)")
+    parser.add_argument("--out", default=None, help="file JSON kết quả (mặc định bench/results/<thời gian>.json)")
+    parser.add_argument("--compare", default=None, help="file JSON của lần chạy trước để so sánh")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": pd.Timestamp.now(tz="UTC").isoformat(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "repeat": args.repeat,
+            "latency_ms": args.latency,
+            "backend": args.backend,
+        },
+        "results": {},
+    }
+    for label in [s.strip().lower() for s in args.sizes.split(",") if s.strip()]:
+        report["results"][label] = run_size(label, SIZES[label], args.repeat, args.latency, not args.no_memory, args.backend)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nĐã ghi báo cáo: {out}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import uuid
+import numpy as np
+import pandas as pd
+from services.repair_service import STATUS_OPTIONS
+
+# --- CẤU HÌNH DỮ LIỆU GIẢ LẬP ---
+BRANCHES = ["Hà Nội", "Hải Phòng", "Đà Nẵng", "Huế", "Nha Trang", "TP.HCM", "Cần Thơ", "Vinh"]
+BRANCH_WEIGHTS = [0.22, 0.08, 0.18, 0.06, 0.07, 0.25, 0.08, 0.06]
+# Phần lớn ca đã trả chi nhánh, số còn lại rải theo luồng xử lý
+STATUS_WEIGHTS = [0.05, 0.08, 0.10, 0.05, 0.07, 0.65]
+ISSUES = ["Hỏng nguồn", "Lỗi màn hình", "Kẹt giấy", "Hỏng bo mạch", "Rơi vỡ", "Vào nước", "Lỗi phần mềm"]
+CASES_PER_MACHINE = 8     # trung bình số ca mỗi máy
+ZIPF_A = 1.6              # độ lệch: một số ít máy hỏng rất nhiều lần
+HISTORY_DAYS = 3 * 365
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+
+def _uuids(rng, n):
+    # uuid4 từ bộ sinh có seed để các lần chạy so sánh được với nhau
+    raw = rng.integers(0, 2 ** 63, size=(n, 2), dtype=np.int64)
+    return [str(uuid.UUID(int=(int(a) << 64) | int(b), version=4)) for a, b in raw]
+
+
+def generate(n_cases, seed=42, now=None):
+    """
+    Sinh repair_cases / machines / audit_logs giả lập với phân phối gần thực tế:
+    chi nhánh lệch về HN/ĐN/HCM, trạng thái phần lớn đã trả, số ca mỗi máy theo Zipf,
+    chi phí log-normal theo loại lỗi, thời gian rải đều trong HISTORY_DAYS ngày.
+    Trả về dict {tên bảng: DataFrame} với cột giống bảng Supabase.
+    """
+    rng = np.random.default_rng(seed)
+    now = pd.Timestamp(now or "2024-12-31", tz="UTC")
+
+    n_machines = max(1, n_cases // CASES_PER_MACHINE)
+    machine_ids = _uuids(rng, n_machines)
+    machines = pd.DataFrame({
+        "id": machine_ids,
+        "machine_code": [f"MAY{i:07d}" for i in range(n_machines)],
+        "created_at": (now - pd.to_timedelta(rng.integers(HISTORY_DAYS, HISTORY_DAYS + 365, n_machines), unit="D"))
+        .strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+    })
+
+    # Máy hỏng theo Zipf: vài máy chiếm rất nhiều ca
+    machine_pick = (rng.zipf(ZIPF_A, n_cases) - 1) % n_machines
+    machine_branch = rng.choice(BRANCHES, n_machines, p=BRANCH_WEIGHTS)
+    issue = rng.choice(len(ISSUES), n_cases)
+    # Mỗi loại lỗi có mức chi phí riêng, làm tròn nghìn đồng
+    cost = np.round(rng.lognormal(13.2 + 0.25 * issue, 0.6) / 1000) * 1000
+    cost[rng.random(n_cases) < 0.1] = 0
+
+    created = now - pd.to_timedelta(rng.integers(0, HISTORY_DAYS * 86400, n_cases), unit="s")
+    confirmed = created + pd.to_timedelta(rng.integers(0, 3, n_cases), unit="D")
+    updated = created + pd.to_timedelta(rng.integers(0, 30 * 86400, n_cases), unit="s")
+    updated = updated.where(updated <= now, now)
+    status = rng.choice(STATUS_OPTIONS, n_cases, p=STATUS_WEIGHTS)
+    branch = machine_branch[machine_pick]
+
+    repairs = pd.DataFrame({
+        "id": _uuids(rng, n_cases),
+        "machine_id": np.asarray(machine_ids, dtype=object)[machine_pick],
+        "branch": branch,
+        "origin_branch": branch,
+        "status": status,
+        "customer_name": [f"KH {i % 5000:04d}" for i in range(n_cases)],
+        "issue_reason": np.asarray(ISSUES, dtype=object)[issue],
+        "compensation": cost,
+        "note": "",
+        "confirmed_date": confirmed.strftime("%Y-%m-%d"),
+        "created_at": created.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "updated_at": updated.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        # Trạng thái có tiền tố số thứ tự nên so sánh chuỗi = so sánh bước trong luồng
+        "receiver_name": np.where(status >= STATUS_OPTIONS[1], "NV Kho", None),
+        "returner_name": np.where(status == STATUS_OPTIONS[-1], "NV Giao nhận", None),
+        "received_at_warehouse": None,
+        "returned_at_branch": None,
+    })
+
+    n_audit = max(1, n_cases // 10)
+    audit_logs = pd.DataFrame({
+        "id": np.arange(1, n_audit + 1),
+        "action": rng.choice(["INSERT", "UPDATE_STATUS", "IMPORT_CSV"], n_audit, p=[0.5, 0.45, 0.05]),
+        "table_name": "repair_cases",
+        "actor": rng.choice(["admin@system", "kho@system", "cn@system"], n_audit),
+        "payload": "{}",
+        "created_at": (now - pd.to_timedelta(rng.integers(0, HISTORY_DAYS * 86400, n_audit), unit="s"))
+        .strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+    })
+
+    users = pd.DataFrame({
+        "username": ["admin"], "full_name": ["Quản trị"], "password": [""], "role": ["Admin"],
+    })
+    return {"repair_cases": repairs, "machines": machines, "audit_logs": audit_logs, "users": users}
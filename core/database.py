@@ -1,13 +1,311 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+import pandas as pd
 import streamlit as st
 from supabase import create_client, Client
+from core.metrics import span
+from core.storage import STORAGE_BACKENDS, SQLITE_PATH, SQLiteBackend
+
+try:
+    # Lớp options cho client đồng bộ (supabase >= 2.x); supabase.lib.client_options.ClientOptions
+    # là lớp gốc, thiếu thuộc tính `storage` nên create_client báo AttributeError
+    from supabase import ClientOptions
+except ImportError:
+    ClientOptions = None
+
+logger = logging.getLogger("kho.database")
+
+# Số dòng mỗi trang, khớp giới hạn max-rows mặc định của PostgREST trên Supabase
+PAGE_SIZE = 1000
+
+# --- CẤU HÌNH KẾT NỐI BỀN VỮNG ---
+REQUEST_TIMEOUT = 10      # giây cho mỗi request HTTP tới PostgREST
+RETRIES = 2               # số lần thử lại khi lỗi tạm thời (mạng, timeout, 5xx)
+BACKOFF = 0.3             # giây, nhân đôi sau mỗi lần thử lại
+FAILURE_THRESHOLD = 5     # số lần lỗi tạm thời liên tiếp trước khi ngắt mạch
+RESET_TIMEOUT = 30        # giây ngắt mạch trước khi cho một request thử lại
+STALE_MAX_ENTRIES = 128   # số kết quả đọc gần nhất được giữ để phục vụ khi backend sập
+STALE_MAX_ROWS = 200      # chỉ giữ kết quả nhỏ (danh sách, nhật ký...); dataset lớn đã có snapshot riêng
+STALE_EXCLUDE = {"users"} # không bao giờ phục vụ dữ liệu cũ cho đăng nhập
+
+WRITE_METHODS = {"insert", "update", "upsert", "delete"}
+# Ghi lặp lại cho cùng kết quả -> được thử lại; insert/rpc thì không (server có thể đã commit trước khi timeout)
+IDEMPOTENT_WRITES = {"update", "upsert", "delete"}
+FILTER_METHODS = {"eq", "neq", "gt", "gte", "lt", "lte", "is_", "in_", "or_", "match", "filter", "like", "ilike"}
+TRANSIENT_STATUS = {"408", "429", "500", "502", "503", "504"}
+
+
+class BackendUnavailable(Exception):
+    """ Supabase chưa được cấu hình, đang ngắt mạch hoặc lỗi sau khi đã thử lại """
+
+
+def _is_transient(e):
+    """ Lỗi mạng/timeout/5xx -> đáng thử lại; lỗi cú pháp, quyền, ràng buộc dữ liệu thì không """
+    if isinstance(e, OSError):
+        return True
+    if type(e).__module__.split(".")[0] in ("httpx", "httpcore"):
+        return True
+    return str(getattr(e, "code", "")) in TRANSIENT_STATUS
+
+
+def _is_paged(chain):
+    """ Trang của stream_rows / delta sync (limit cỡ PAGE_SIZE hoặc range): không giữ làm dữ liệu cũ dự phòng """
+    for name, args, kwargs in chain:
+        if name == "range":
+            return True
+        if name == "limit" and (args or kwargs) and (args[0] if args else next(iter(kwargs.values()))) >= PAGE_SIZE:
+            return True
+    return False
+
+
+def _is_retryable(root, chain):
+    """ Chỉ thử lại lệnh đọc và lệnh ghi idempotent (upsert; update/delete có điều kiện lọc) """
+    if root[0] == "rpc":
+        return False
+    methods = {name for name, _, _ in chain}
+    if "insert" in methods:
+        return False
+    if methods & {"update", "delete"} and not methods & FILTER_METHODS:
+        return False
+    return True
+
+
+class CircuitBreaker:
+    """ Ngắt mạch: sau FAILURE_THRESHOLD lỗi liên tiếp thì từ chối ngay trong RESET_TIMEOUT giây """
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "half-open":
+                # Cho đúng một request thử; các request khác vẫn bị chặn tới khi có kết quả
+                self.opened_at = time.monotonic()
+                return True
+            return state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class ResilientClient:
+    """
+    Bọc Supabase Client với cùng giao diện table(...)/rpc(...).execute():
+    - Một client (một httpx connection pool keep-alive) cho cả process, timeout theo từng request.
+    - Thử lại với backoff cho lỗi tạm thời (chỉ lệnh đọc và ghi idempotent, không insert/rpc); ngắt mạch khi backend liên tục lỗi để session không bị treo.
+    - Kết quả đọc nhỏ gần nhất được giữ lại và trả về khi backend không phản hồi (đếm trong stats).
+    """
+
+    kind = "supabase"
+
+    def __init__(self, client, retries=RETRIES, backoff=BACKOFF, breaker=None, init_error=None):
+        self.client = client
+        # Lỗi khi tạo client (khác với thiếu cấu hình) để báo đúng nguyên nhân
+        self.init_error = init_error
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._stale = OrderedDict()
+        self._stale_lock = threading.Lock()
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "stale_served": 0, "rejected": 0}
+
+    @property
+    def available(self):
+        return self.client is not None
+
+    def table(self, name):
+        return _Query(self, ("table", name))
+
+    def from_(self, name):
+        return self.table(name)
+
+    def rpc(self, fn, params=None):
+        return _Query(self, ("rpc", fn, params or {}))
+
+    def _remember(self, key, response):
+        data = getattr(response, "data", None)
+        if isinstance(data, list) and len(data) >= STALE_MAX_ROWS:
+            return
+        with self._stale_lock:
+            self._stale[key] = response
+            self._stale.move_to_end(key)
+            while len(self._stale) > STALE_MAX_ENTRIES:
+                self._stale.popitem(last=False)
+
+    def _serve_stale(self, key, error):
+        with self._stale_lock:
+            response = self._stale.get(key)
+        if response is None:
+            raise BackendUnavailable(str(error)) from error
+        self.stats["stale_served"] += 1
+        return response
+
+    def execute(self, root, chain):
+        with span(f"supabase.{root[1]}", method=root[0]):
+            return self._execute(root, chain)
+
+    def _execute(self, root, chain):
+        if self.client is None:
+            if self.init_error is not None:
+                raise BackendUnavailable(f"Không khởi tạo được client Supabase: {self.init_error}")
+            raise BackendUnavailable("Chưa cấu hình SUPABASE_URL / SUPABASE_KEY")
+        is_write = root[0] == "rpc" or any(name in WRITE_METHODS for name, _, _ in chain)
+        cacheable = not is_write and root[1] not in STALE_EXCLUDE and not _is_paged(chain)
+        key = (root[0], root[1], repr(root[2:]), repr(chain)) if cacheable else None
+
+        self.stats["calls"] += 1
+        if not self.breaker.allow():
+            self.stats["rejected"] += 1
+            error = BackendUnavailable("Supabase đang tạm ngắt mạch do lỗi liên tiếp")
+            if cacheable:
+                return self._serve_stale(key, error)
+            raise error
+
+        retries = self.retries if _is_retryable(root, chain) else 0
+        for attempt in range(retries + 1):
+            try:
+                if root[0] == "rpc":
+                    query = self.client.rpc(root[1], root[2])
+                else:
+                    query = self.client.table(root[1])
+                # Dựng lại builder cho mỗi lần thử (builder của postgrest không dùng lại được sau execute)
+                for name, args, kwargs in chain:
+                    query = getattr(query, name)(*args, **kwargs)
+                response = query.execute()
+            except Exception as e:
+                if not _is_transient(e):
+                    # Lỗi nghiệp vụ (quyền, ràng buộc...): backend vẫn phản hồi -> không tính vào ngắt mạch
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                self.stats["failures"] += 1
+                if attempt == retries or not self.breaker.allow():
+                    if cacheable:
+                        return self._serve_stale(key, e)
+                    raise BackendUnavailable(str(e)) from e
+                self.stats["retries"] += 1
+                time.sleep(self.backoff * (2 ** attempt))
+                continue
+            self.breaker.record_success()
+            if cacheable:
+                self._remember(key, response)
+            return response
+
+
+class _Query:
+    """ Ghi lại chuỗi lệnh builder (select, eq, order...) để phát lại ở mỗi lần thử """
+
+    def __init__(self, owner, root, chain=()):
+        self._owner = owner
+        self._root = root
+        self._chain = chain
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def step(*args, **kwargs):
+            return _Query(self._owner, self._root, self._chain + ((name, args, kwargs),))
+        return step
+
+    def execute(self):
+        return self._owner.execute(self._root, self._chain)
+
+
+def storage_backend():
+    """ Backend lưu trữ theo secrets STORAGE_BACKEND (mặc định supabase) """
+    try:
+        backend = st.secrets.get("STORAGE_BACKEND", "supabase")
+    except Exception:
+        backend = "supabase"
+    return backend if backend in STORAGE_BACKENDS else "supabase"
+
 
 @st.cache_resource
-def init_connection() -> Client:
+def init_connection():
+    """
+    Backend dùng chung cho cả process, cùng giao diện table(...).execute() cho mọi service:
+    - "sqlite": SQLiteBackend trên file cục bộ (SQLITE_PATH trong secrets), không cần mạng.
+    - "supabase": client bền vững; thiếu cấu hình hoặc tạo client lỗi -> vẫn trả về wrapper
+      (available = False), mọi lệnh gọi sẽ báo BackendUnavailable nêu rõ nguyên nhân thay vì AttributeError trên None.
+    """
+    if storage_backend() == "sqlite":
+        try:
+            path = st.secrets.get("SQLITE_PATH", SQLITE_PATH)
+        except Exception:
+            path = SQLITE_PATH
+        return SQLiteBackend(path)
     try:
         url = st.secrets["SUPABASE_URL"]
         key = st.secrets["SUPABASE_KEY"]
-        return create_client(url, key)
+    except (KeyError, FileNotFoundError):
+        # Thiếu file secrets hoặc thiếu khóa -> chưa cấu hình
+        return ResilientClient(None)
+    try:
+        if ClientOptions is not None:
+            client: Client = create_client(url, key, options=ClientOptions(postgrest_client_timeout=REQUEST_TIMEOUT))
+        else:
+            client = create_client(url, key)
     except Exception as e:
-        return None
+        # Đã cấu hình nhưng tạo client lỗi (URL sai, phiên bản thư viện...) -> ghi log và báo rõ ở mỗi lệnh gọi
+        logger.exception("Không khởi tạo được client Supabase")
+        return ResilientClient(None, init_error=e)
+    return ResilientClient(client)
 
+# Giữ tên `supabase` cho các service; với STORAGE_BACKEND = "sqlite" đây là SQLiteBackend
 supabase = init_connection()
+
+def stream_rows(table, columns="*", key="id", page_size=PAGE_SIZE, apply_filters=None, client=None):
+    """
+    Đọc bảng theo từng trang bằng keyset pagination (order theo key, lấy key > key cuối trang trước).
+    Mỗi lần yield một list dict, không bao giờ giữ cả bảng trong một response JSON.
+    apply_filters: hàm nhận query và trả về query đã thêm điều kiện lọc (eq, or_, ...).
+    """
+    client = client or supabase
+    last_key = None
+    while True:
+        query = client.table(table).select(columns)
+        if apply_filters is not None:
+            query = apply_filters(query)
+        if last_key is not None:
+            query = query.gt(key, last_key)
+        rows = query.order(key).limit(page_size).execute().data or []
+        if not rows:
+            break
+        yield rows
+        if len(rows) < page_size:
+            break
+        last_key = rows[-1][key]
+
+def fetch_dataframe(table, columns="*", key="id", page_size=PAGE_SIZE, apply_filters=None, client=None):
+    """ Dựng DataFrame từng chunk một từ stream_rows, chỉ giữ một trang JSON trong bộ nhớ tại một thời điểm """
+    frames = [
+        pd.DataFrame(rows)
+        for rows in stream_rows(table, columns, key, page_size, apply_filters, client)
+    ]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,170 @@
+import functools
+import threading
+import time
+import streamlit as st
+
+# TTL mặc định (giây) cho một dataset đã materialize
+DEFAULT_TTL = 30
+
+
+class DatasetCache:
+    """
+    Cache dataset dùng chung cho cả process, mỗi bảng một khóa.
+    - TTL theo từng khóa.
+    - Mỗi khóa có version: tăng khi nạp được dữ liệu mới và mỗi lần invalidate().
+      invalidate() chỉ loại bỏ đúng khóa đó, các khóa khác không bị ảnh hưởng (khác với st.cache_data.clear()).
+    - derived(): kết quả tính từ một dataset (cube, risk, forecast...) được giữ cho đúng frame đã dùng để tính.
+    - Khi nhiều session cùng hết hạn, chỉ một session gọi loader, các session khác chờ và dùng chung kết quả.
+    - put(): nguồn bên ngoài (change feed) đẩy giá trị mới vào mà không cần session nào phải nạp lại.
+    """
+
+    def __init__(self, default_ttl=DEFAULT_TTL):
+        self.default_ttl = default_ttl
+        self._entries = {}
+        self._versions = {}
+        self._locks = {}
+        self._derived = {}
+        self._guard = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _fresh(self, key, ttl):
+        entry = self._entries.get(key)
+        if entry is None or entry["version"] != self._versions.get(key, 0):
+            return None
+        if time.monotonic() - entry["loaded_at"] > ttl:
+            return None
+        return entry
+
+    def get(self, key, loader, ttl=None):
+        """ Trả về dataset của khóa; gọi loader() nếu chưa có, hết hạn hoặc đã bị invalidate """
+        ttl = self.default_ttl if ttl is None else ttl
+        entry = self._fresh(key, ttl)
+        if entry is not None:
+            return entry["value"]
+
+        with self._key_lock(key):
+            # Kiểm tra lại: có thể session khác vừa nạp xong trong lúc chờ lock
+            entry = self._fresh(key, ttl)
+            if entry is not None:
+                return entry["value"]
+            version = self._versions.get(key, 0)
+            previous = self._entries.get(key)
+            value = loader()
+            with self._guard:
+                # Bị invalidate trong lúc đang nạp -> trả kết quả nhưng không lưu, lần sau nạp lại
+                if self._versions.get(key, 0) != version:
+                    return value
+                # Loader trả lại đúng object cũ (dữ liệu không đổi) -> chỉ gia hạn TTL, giữ nguyên version
+                if previous is not None and previous["value"] is value and previous["version"] == version:
+                    previous["loaded_at"] = time.monotonic()
+                    return value
+                version += 1
+                self._versions[key] = version
+                self._entries[key] = {"value": value, "version": version, "loaded_at": time.monotonic()}
+            return value
+
+    def put(self, key, value):
+        """
+        Đẩy trực tiếp một giá trị mới cho khóa (vd. từ change feed) và tăng version.
+        Cùng object với giá trị đang giữ -> chỉ gia hạn TTL. Trả về version hiện tại.
+        """
+        with self._key_lock(key):
+            with self._guard:
+                version = self._versions.get(key, 0)
+                entry = self._entries.get(key)
+                if entry is not None and entry["value"] is value and entry["version"] == version:
+                    entry["loaded_at"] = time.monotonic()
+                    return version
+                version += 1
+                self._versions[key] = version
+                self._entries[key] = {"value": value, "version": version, "loaded_at": time.monotonic()}
+                return version
+
+    def derived(self, name, key, builder, source=None, args=None):
+        """
+        Kết quả builder() tính từ dataset `key`.
+        source: đúng DataFrame mà builder dùng; memo gắn với chính object đó (không theo version hiện tại),
+        nên session còn giữ frame cũ không nhận kết quả của frame mới và ngược lại.
+        Frame cũ (cache đã giữ frame khác) vẫn được tính nhưng không ghi đè memo dùng chung.
+        Không có source -> chỉ tính lại khi version của dataset thay đổi.
+        args: tham số phụ của kết quả (vd. mốc thời gian tính SLA); khác args -> tính lại và thay kết quả cũ,
+        mỗi name chỉ giữ một kết quả nên tham số đổi theo thời gian không làm phình cache.
+        """
+        if source is None:
+            version = self.version(key)
+            matches = lambda hit: hit[2] is None and hit[0] == version and hit[3] == args
+        else:
+            version = self.version_of(key, source)
+            matches = lambda hit: hit[2] is source and hit[3] == args
+        hit = self._derived.get(name)
+        if hit is not None and matches(hit):
+            return hit[1]
+        with self._key_lock(("derived", name)):
+            hit = self._derived.get(name)
+            if hit is not None and matches(hit):
+                return hit[1]
+            value = builder()
+            entry = self._entries.get(key)
+            if source is None or entry is None or entry["value"] is source:
+                self._derived[name] = (version, value, source, args)
+            return value
+
+    def version(self, key):
+        return self._versions.get(key, 0)
+
+    def version_of(self, key, value):
+        """ Version của đúng object `value` nếu cache đang giữ nó cho khóa; None nếu là bản cũ hoặc lạ """
+        entry = self._entries.get(key)
+        if entry is not None and entry["value"] is value:
+            return entry["version"]
+        return None
+
+    def invalidate(self, *keys):
+        """ Loại bỏ có chủ đích các khóa chỉ định và tăng version của chúng """
+        with self._guard:
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._guard:
+            for key in list(self._entries):
+                self._versions[key] = self._versions.get(key, 0) + 1
+            self._entries.clear()
+
+
+@st.cache_resource
+def get_dataset_cache():
+    """ Một DatasetCache duy nhất cho cả process, dùng chung giữa các session """
+    return DatasetCache()
+
+
+def invalidate_dataset(*keys):
+    get_dataset_cache().invalidate(*keys)
+
+
+def dataset_version(key, value=None):
+    """ Version hiện tại của khóa; truyền value -> version của đúng frame đó (None nếu frame đã cũ) """
+    cache = get_dataset_cache()
+    return cache.version(key) if value is None else cache.version_of(key, value)
+
+
+def derived_dataset(name, key, builder, source=None, args=None):
+    return get_dataset_cache().derived(name, key, builder, source, args)
+
+
+def memoize_by_version(key):
+    """
+    Decorator cho các hàm tính toán nặng của tab: fn(df, *args) chỉ chạy lại khi nhận frame khác hoặc args khác.
+    df phải là dataset dùng chung tương ứng với `key`; mỗi hàm giữ một kết quả (của lần gọi gần nhất).
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(df, *args):
+            name = f"{fn.__module__}.{fn.__qualname__}"
+            return derived_dataset(name, key, lambda: fn(df, *args), source=df, args=args)
+        return wrapper
+    return decorator
@@ -0,0 +1,117 @@
+import functools
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+import numpy as np
+import pandas as pd
+
+# --- CẤU HÌNH ĐO HIỆU NĂNG ---
+MAX_SAMPLES = 500       # số mẫu gần nhất giữ cho mỗi stage (đủ cho p95 ổn định, bộ nhớ cố định)
+SLOW_SPAN_MS = 1000     # span chậm hơn ngưỡng này được ghi log mức WARNING
+
+# Log có cấu trúc: mỗi span là một dòng JSON trên logger "kho.perf"
+logger = logging.getLogger("kho.perf")
+
+
+class Recorder:
+    """
+    Thu thập thời gian thực thi theo stage (tải dữ liệu, ghép bảng, groupby, render, lệnh gọi Supabase).
+    - Mỗi stage giữ MAX_SAMPLES mẫu gần nhất để tính p50/p95.
+    - Span của lần rerun hiện tại được gom theo thread (mỗi lần chạy script Streamlit là một thread).
+    """
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self._samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self._errors = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, stage, elapsed_ms, error=None, **fields):
+        with self._lock:
+            self._samples[stage].append(elapsed_ms)
+            if error is not None:
+                self._errors[stage] += 1
+        spans = getattr(self._local, "spans", None)
+        if spans is not None:
+            spans.append({"stage": stage, "ms": round(elapsed_ms, 1), "depth": self._local.depth})
+        level = logging.WARNING if elapsed_ms >= SLOW_SPAN_MS or error else logging.DEBUG
+        # Không bật log ở mức này -> bỏ qua việc dựng JSON (record nằm trên mọi lệnh gọi Supabase / trang dữ liệu)
+        if not logger.isEnabledFor(level):
+            return
+        event = {"stage": stage, "ms": round(elapsed_ms, 1), "thread": threading.current_thread().name, **fields}
+        if error is not None:
+            event["error"] = error
+        logger.log(level, json.dumps(event, ensure_ascii=False, default=str))
+
+    def begin_rerun(self):
+        """ Bắt đầu gom span cho lần rerun của thread hiện tại """
+        self._local.spans = []
+        self._local.depth = 0
+
+    def rerun_spans(self):
+        return list(getattr(self._local, "spans", None) or [])
+
+    def summary(self):
+        """ Bảng p50/p95/max theo stage, stage chậm nhất (p95) lên đầu """
+        with self._lock:
+            snapshot = {k: np.fromiter(v, dtype="float64") for k, v in self._samples.items() if v}
+            errors = dict(self._errors)
+        if not snapshot:
+            return pd.DataFrame(columns=["stage", "count", "p50_ms", "p95_ms", "max_ms", "errors"])
+        rows = [{
+            "stage": stage,
+            "count": len(arr),
+            "p50_ms": round(float(np.percentile(arr, 50)), 1),
+            "p95_ms": round(float(np.percentile(arr, 95)), 1),
+            "max_ms": round(float(arr.max()), 1),
+            "errors": errors.get(stage, 0),
+        } for stage, arr in snapshot.items()]
+        return pd.DataFrame(rows).sort_values("p95_ms", ascending=False).reset_index(drop=True)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._errors.clear()
+
+
+# Một recorder cho cả process (không phụ thuộc Streamlit để dùng được trong thread nền và benchmark)
+RECORDER = Recorder()
+
+
+class span:
+    """ Context manager đo một đoạn code: with span("load.repair_data"): ... """
+
+    def __init__(self, stage, recorder=None, **fields):
+        self.stage = stage
+        self.recorder = recorder or RECORDER
+        self.fields = fields
+
+    def __enter__(self):
+        local = self.recorder._local
+        if getattr(local, "spans", None) is not None:
+            local.depth += 1
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = (time.perf_counter() - self.t0) * 1000
+        local = self.recorder._local
+        if getattr(local, "spans", None) is not None:
+            local.depth -= 1
+        error = None if exc_type is None else f"{exc_type.__name__}: {exc}"
+        self.recorder.record(self.stage, elapsed, error=error, **self.fields)
+        return False
+
+
+def timed(stage):
+    """ Decorator: đo mỗi lần gọi hàm dưới tên stage """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
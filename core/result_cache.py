@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+import pandas as pd
+import streamlit as st
+
+# --- GIỚI HẠN CACHE KẾT QUẢ TRUY VẤN ---
+MAX_ENTRIES = 256
+MAX_BYTES = 64 * 1024 * 1024   # ~64MB cho toàn process
+
+
+def _sizeof(value):
+    """ Ước lượng dung lượng một kết quả (DataFrame/Series tính theo memory_usage, còn lại tính cố định) """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, dict):
+        return sum(_sizeof(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_sizeof(v) for v in value)
+    return 64
+
+
+class LRUResultCache:
+    """
+    Cache kết quả theo khóa (version dữ liệu, bộ lọc), loại bỏ mục ít dùng nhất khi vượt
+    số mục hoặc dung lượng cho phép. Khóa chứa version nên dữ liệu đổi thì mục cũ tự hết hiệu lực
+    và dần bị đẩy ra. Có bộ đếm hit/miss/evict để theo dõi.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, builder):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+        # Tính ngoài lock để các khóa khác không phải chờ; hai session cùng miss một khóa thì tính hai lần
+        value = builder()
+        size = _sizeof(value)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, size)
+                self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total * 100, 1) if total else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+@st.cache_resource
+def get_result_cache(name="default"):
+    """ Một cache LRU theo tên, dùng chung cho mọi session trong process """
+    return LRUResultCache()
@@ -0,0 +1,432 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from types import SimpleNamespace
+import pandas as pd
+from core.metrics import span
+
+# --- CẤU HÌNH BACKEND LƯU TRỮ ---
+# "supabase": Postgres qua PostgREST (mặc định); "sqlite": file SQLite nhúng, chạy hoàn toàn cục bộ
+STORAGE_BACKENDS = ("supabase", "sqlite")
+SQLITE_PATH = os.path.join(".cache", "kho.db")
+
+# Lược đồ các bảng mà app đọc/ghi (khớp bảng trên Supabase)
+SCHEMA = {
+    "machines": {
+        "id": "TEXT PRIMARY KEY",
+        "machine_code": "TEXT UNIQUE",
+        "created_at": "TEXT",
+    },
+    "repair_cases": {
+        "id": "TEXT PRIMARY KEY",
+        "machine_id": "TEXT",
+        "branch": "TEXT",
+        "origin_branch": "TEXT",
+        "status": "TEXT",
+        "customer_name": "TEXT",
+        "issue_reason": "TEXT",
+        "compensation": "REAL",
+        "note": "TEXT",
+        "confirmed_date": "TEXT",
+        "received_date": "TEXT",
+        "is_unrepairable": "INTEGER",
+        "source": "TEXT",
+        "created_by": "TEXT",
+        "receiver_name": "TEXT",
+        "returner_name": "TEXT",
+        "received_at_warehouse": "TEXT",
+        "returned_at_branch": "TEXT",
+        "created_at": "TEXT",
+        "updated_at": "TEXT",
+    },
+    "users": {
+        "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+        "username": "TEXT UNIQUE",
+        "full_name": "TEXT",
+        "password": "TEXT",
+        "role": "TEXT",
+        "created_at": "TEXT",
+    },
+    "audit_logs": {
+        "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+        "action": "TEXT",
+        "table_name": "TEXT",
+        "actor": "TEXT",
+        "source": "TEXT",
+        "payload": "TEXT",
+        "created_at": "TEXT",
+    },
+}
+STORAGE_TABLES = tuple(SCHEMA)
+# Cột dùng cho watermark / sắp xếp mới nhất
+INDEXES = [
+    ("repair_cases", "updated_at"), ("repair_cases", "created_at"), ("repair_cases", "machine_id"),
+    ("machines", "created_at"), ("audit_logs", "created_at"),
+]
+TIMESTAMP_COLUMNS = {"created_at", "updated_at", "received_at_warehouse", "returned_at_branch"}
+BOOLEAN_COLUMNS = {"is_unrepairable"}
+# Giống DEFAULT now() của Postgres khi bản ghi mới không có giá trị
+DEFAULT_NOW = ("created_at", "updated_at")
+
+# Toán tử lọc kiểu PostgREST -> SQL
+OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class StorageError(Exception):
+    """ Lỗi truy vấn ở backend cục bộ; có `code` giống lỗi PostgREST (không phải lỗi tạm thời) """
+
+    def __init__(self, message, code="PGRST000"):
+        super().__init__(message)
+        self.code = code
+
+
+def _now():
+    return pd.Timestamp.now(tz="UTC").strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+
+def _iso(value):
+    """ Chuẩn hóa thời điểm về chuỗi ISO UTC cố định độ dài -> so sánh chuỗi = so sánh thời gian """
+    if isinstance(value, str) and value.strip().lower() in ("now()", "now"):
+        return _now()
+    ts = pd.Timestamp(value)
+    ts = ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+    return ts.strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+
+def _to_db(column, value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if hasattr(value, "item"):  # số numpy -> số Python
+        value = value.item()
+    if column in TIMESTAMP_COLUMNS:
+        return _iso(value)
+    if column in BOOLEAN_COLUMNS:
+        return int(value in (True, 1, "true", "True")) if isinstance(value, str) else int(bool(value))
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value
+
+
+def _from_db(row):
+    return {k: (bool(v) if k in BOOLEAN_COLUMNS and v is not None else v) for k, v in row.items()}
+
+
+class SQLiteBackend:
+    """
+    Backend lưu trữ nhúng trên SQLite với cùng giao diện builder như client Supabase:
+    table(name).select(...).eq(...).order(...).limit(...).execute() -> .data là list dict.
+    Hỗ trợ select / insert / upsert / update / delete và các bộ lọc eq, neq, gt, gte, lt, lte, in_, or_
+    mà các service đang dùng, nên repair_service, auth, sync và các tab chạy nguyên vẹn.
+    Dùng cho chi nhánh mạng yếu (STORAGE_BACKEND = "sqlite") và làm backend tất định cho benchmark.
+    """
+
+    kind = "sqlite"
+    available = True
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        # Một connection dùng chung giữa các session Streamlit -> khóa quanh mỗi lệnh
+        self._lock = threading.RLock()
+        self._views = set()
+        self.stats = {"calls": 0, "failures": 0, "rows_read": 0, "rows_written": 0}
+        with self._lock:
+            if path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+                self.conn.execute("PRAGMA synchronous=NORMAL")
+            for table, columns in SCHEMA.items():
+                cols = ", ".join(f"{c} {t}" for c, t in columns.items())
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({cols})")
+            for table, col in INDEXES:
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{col} ON {table} ({col})")
+
+    def table(self, name):
+        return _SQLiteQuery(self, name)
+
+    def from_(self, name):
+        return self.table(name)
+
+    def rpc(self, fn, params=None):
+        raise StorageError(f"Backend SQLite không hỗ trợ rpc('{fn}')", code="PGRST202")
+
+    def ensure_views(self, statements):
+        """ Tạo các view (vd. kpi_*) một lần cho mỗi connection """
+        key = tuple(statements)
+        with self._lock:
+            if key in self._views:
+                return
+            for stmt in statements:
+                self.conn.execute(stmt)
+            self._views.add(key)
+
+    def load_frame(self, table, df, chunk_size=50_000):
+        """ Nạp nhanh một DataFrame (vd. dữ liệu giả lập, bản sao từ Supabase) vào bảng, ghi đè theo khóa """
+        columns = [c for c in df.columns if c in SCHEMA[table]]
+        data = df[columns].copy()
+        for col in columns:
+            if col in TIMESTAMP_COLUMNS:
+                ts = pd.to_datetime(data[col], utc=True, errors="coerce", format="ISO8601")
+                data[col] = ts.dt.strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+            elif col in BOOLEAN_COLUMNS:
+                data[col] = data[col].astype("boolean").astype("Int64")
+        data = data.astype(object).where(data.notna(), None)
+        sql = (
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})"
+        )
+        rows = list(data.itertuples(index=False, name=None))
+        with span(f"sqlite.{table}", method="load"), self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                for i in range(0, len(rows), chunk_size):
+                    self.conn.executemany(sql, rows[i:i + chunk_size])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        self.stats["rows_written"] += len(rows)
+        return len(rows)
+
+    def execute(self, query):
+        with span(f"sqlite.{query.name}", method=query.op):
+            self.stats["calls"] += 1
+            try:
+                with self._lock:
+                    data = query.run(self.conn)
+            except sqlite3.IntegrityError as e:
+                self.stats["failures"] += 1
+                raise StorageError(str(e), code="23505") from e
+            except sqlite3.Error as e:
+                self.stats["failures"] += 1
+                raise StorageError(str(e)) from e
+            key = "rows_read" if query.op == "select" else "rows_written"
+            self.stats[key] += len(data)
+            return SimpleNamespace(data=data, count=None)
+
+
+class _SQLiteQuery:
+    """ Builder một truy vấn; các hàm lọc trả về chính nó giống postgrest-py """
+
+    def __init__(self, backend, name):
+        if not IDENTIFIER.match(name):
+            raise StorageError(f"Tên bảng không hợp lệ: {name}", code="42P01")
+        self.backend = backend
+        self.name = name
+        self.op = "select"
+        self.columns = "*"
+        self.where = []
+        self.params = []
+        self.orders = []
+        self.limit_n = None
+        self.rows = None
+        self.values = None
+        self.on_conflict = "id"
+
+    def _column(self, col):
+        schema = SCHEMA.get(self.name)
+        if not IDENTIFIER.match(col) or (schema is not None and col not in schema):
+            raise StorageError(f"Không có cột '{col}' trong bảng '{self.name}'", code="PGRST204")
+        return col
+
+    # --- Đọc ---
+    def select(self, columns="*", count=None):
+        self.columns = columns
+        return self
+
+    def order(self, column, desc=False, nullsfirst=None):
+        # Mặc định như Postgres: NULL đứng cuối khi tăng dần, đứng đầu khi giảm dần
+        nulls_first = desc if nullsfirst is None else nullsfirst
+        self.orders.append(
+            f"{self._column(column)} {'DESC' if desc else 'ASC'} NULLS {'FIRST' if nulls_first else 'LAST'}"
+        )
+        return self
+
+    def limit(self, size):
+        self.limit_n = int(size)
+        return self
+
+    # --- Lọc ---
+    def _condition(self, column, op, value):
+        col = self._column(column)
+        if op == "is":
+            lowered = str(value).lower()
+            if lowered == "null":
+                return f"{col} IS NULL", []
+            return f"{col} = ?", [_to_db(col, lowered == "true")]
+        if op not in OPERATORS:
+            raise StorageError(f"Toán tử không hỗ trợ: {op}", code="PGRST100")
+        return f"{col} {OPERATORS[op]} ?", [_to_db(col, value)]
+
+    def _filter(self, column, op, value):
+        sql, params = self._condition(column, op, value)
+        self.where.append(sql)
+        self.params.extend(params)
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "eq", value)
+
+    def neq(self, column, value):
+        return self._filter(column, "neq", value)
+
+    def gt(self, column, value):
+        return self._filter(column, "gt", value)
+
+    def gte(self, column, value):
+        return self._filter(column, "gte", value)
+
+    def lt(self, column, value):
+        return self._filter(column, "lt", value)
+
+    def lte(self, column, value):
+        return self._filter(column, "lte", value)
+
+    def is_(self, column, value):
+        return self._filter(column, "is", value)
+
+    def in_(self, column, values):
+        col = self._column(column)
+        values = list(values)
+        if not values:
+            self.where.append("0")
+            return self
+        self.where.append(f"{col} IN ({', '.join('?' * len(values))})")
+        self.params.extend(_to_db(col, v) for v in values)
+        return self
+
+    def or_(self, filters):
+        """ Cú pháp PostgREST: "updated_at.gte.X,created_at.gte.X" """
+        parts, params = [], []
+        for cond in filters.split(","):
+            column, op, value = cond.strip().split(".", 2)
+            sql, p = self._condition(column, op, value)
+            parts.append(sql)
+            params.extend(p)
+        self.where.append(f"({' OR '.join(parts)})")
+        self.params.extend(params)
+        return self
+
+    # --- Ghi ---
+    def _prepare(self, rows):
+        rows = [rows] if isinstance(rows, dict) else list(rows)
+        schema = SCHEMA.get(self.name)
+        if schema is None:
+            raise StorageError(f"Không ghi được vào '{self.name}'", code="42809")
+        return rows, schema
+
+    def insert(self, rows, **kwargs):
+        self.rows, _ = self._prepare(rows)
+        self.op = "insert"
+        return self
+
+    def upsert(self, rows, on_conflict="id", **kwargs):
+        self.rows, _ = self._prepare(rows)
+        self.op = "upsert"
+        self.on_conflict = on_conflict
+        return self
+
+    def update(self, values, **kwargs):
+        self._prepare(values)
+        self.op, self.values = "update", dict(values)
+        return self
+
+    def delete(self, **kwargs):
+        self._prepare([])
+        self.op = "delete"
+        return self
+
+    def execute(self):
+        return self.backend.execute(self)
+
+    # --- Thực thi (gọi trong khóa của backend) ---
+    def _where_sql(self):
+        return f" WHERE {' AND '.join(self.where)}" if self.where else ""
+
+    def _fetch(self, cur):
+        return [_from_db(dict(r)) for r in cur.fetchall()]
+
+    def run(self, conn):
+        if self.op == "select":
+            cols = "*" if self.columns.strip() == "*" else ", ".join(
+                self._column(c.strip()) for c in self.columns.split(",")
+            )
+            sql = f"SELECT {cols} FROM {self.name}{self._where_sql()}"
+            if self.orders:
+                sql += " ORDER BY " + ", ".join(self.orders)
+            if self.limit_n is not None:
+                sql += f" LIMIT {self.limit_n}"
+            return self._fetch(conn.execute(sql, self.params))
+        if self.op == "update":
+            sets = [f"{self._column(c)} = ?" for c in self.values]
+            params = [_to_db(c, v) for c, v in self.values.items()] + self.params
+            sql = f"UPDATE {self.name} SET {', '.join(sets)}{self._where_sql()} RETURNING *"
+            return self._fetch(conn.execute(sql, params))
+        if self.op == "delete":
+            return self._fetch(conn.execute(f"DELETE FROM {self.name}{self._where_sql()} RETURNING *", self.params))
+        return self._write_rows(conn)
+
+    def _write_rows(self, conn):
+        schema = SCHEMA[self.name]
+        out = []
+        conn.execute("BEGIN")
+        try:
+            for row in self.rows:
+                given = [self._column(c) for c in row]
+                values = {c: _to_db(c, v) for c, v in row.items()}
+                if "id" not in values and schema["id"].startswith("TEXT"):
+                    values["id"] = str(uuid.uuid4())
+                for col in DEFAULT_NOW:
+                    if col in schema and values.get(col) is None:
+                        values[col] = _now()
+                cols = list(values)
+                sql = f"INSERT INTO {self.name} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+                if self.op == "upsert":
+                    key = self._column(self.on_conflict)
+                    # Chỉ ghi đè các cột có trong payload (merge-duplicates của PostgREST)
+                    updates = [c for c in given if c != key] or [key]
+                    sql += f" ON CONFLICT({key}) DO UPDATE SET " + ", ".join(f"{c} = excluded.{c}" for c in updates)
+                out.extend(self._fetch(conn.execute(sql + " RETURNING *", [values[c] for c in cols])))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return out
+
+
+def copy_tables(source, target, tables=STORAGE_TABLES):
+    """
+    Sao chép toàn bộ các bảng từ `source` (client Supabase) sang `target` (SQLiteBackend) theo từng trang
+    (keyset qua core.database.stream_rows), dùng để khởi tạo dữ liệu cho chi nhánh chạy cục bộ.
+    Trả về {bảng: số dòng}.
+    """
+    from core.database import stream_rows  # import vòng: core.database dùng SQLiteBackend của module này
+
+    copied = {}
+    for table in tables:
+        copied[table] = sum(
+            target.load_frame(table, pd.DataFrame(rows)) for rows in stream_rows(table, client=source)
+        )
+    return copied
+
+
+if __name__ == "__main__":
+    # Tạo/cập nhật file SQLite cục bộ từ Supabase: python -m core.storage [đường_dẫn]
+    import sys
+    import streamlit as st
+    from supabase import create_client
+    from core.database import ResilientClient
+
+    target = SQLiteBackend(sys.argv[1] if len(sys.argv) > 1 else SQLITE_PATH)
+    # Cùng chính sách thử lại / ngắt mạch với app khi đọc từng trang
+    source = ResilientClient(create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"]))
+    for name, n in copy_tables(source, target).items():
+        print(f"{name}: {n} dòng")
@@ -13,6 +13,17 @@ URL = "https://cigbnbaanpebwrufzxfg.supabase.co"
 KEY = st.secrets["SUPABASE_KEY"]
 supabase = create_client(URL, KEY)
 
+from services.sync_service import DeltaSync, SYNC_TABLES
+from services.import_service import import_repairs
+from services.machine_index import MachineIndex
+from services.loader import load_parallel
+from services.audit_writer import AuditWriter
+from core.dataset_cache import get_dataset_cache, invalidate_dataset
+
+# Khóa dataset của dashboard cũ trong cache dùng chung (TTL + version, xóa đúng khóa khi ghi)
+DASHBOARD_DATASET = "dashboard:repair_cases"
+DASHBOARD_TTL = 30
+
 # 2. HÀM BẢO MẬT
 def hash_password(password):
     return hashlib.sha256(str.encode(password)).hexdigest()
@@ -69,57 +80,74 @@ def login_form():
                 st.error("Tài khoản không tồn tại!")
 
 # 5. TẢI DỮ LIỆU (Đã fix mất dòng và lấy machine_code)
-@st.cache_data(ttl=30)
-def load_repair_data_final():
-    try:
-        res_repair = supabase.table("repair_cases").select("*").order("created_at", desc=True).execute()
-        res_machines = supabase.table("machines").select("id, machine_code").execute()
-        
-        # Tạo danh sách các cột bắt buộc phải có để Dashboard không bị sập
-        required_cols = ['branch', 'compensation', 'machine_id', 'machine_code', 'confirmed_date', 'id']
-        
-        if not res_repair.data: 
-            return pd.DataFrame(columns=required_cols + ['NĂM', 'THÁNG', 'CHI_PHÍ'])
-        
-        df_repair = pd.DataFrame(res_repair.data)
-        df_m = pd.DataFrame(res_machines.data)
-
-        # Đảm bảo các cột tối thiểu tồn tại trong df_repair trước khi xử lý
-        for col in required_cols:
-            if col not in df_repair.columns:
-                df_repair[col] = None
-
-        # Merge lấy machine_code
-        if not df_m.empty:
-            df_repair['machine_id'] = df_repair['machine_id'].astype(str)
-            df_m['id'] = df_m['id'].astype(str)
-            df = pd.merge(df_repair, df_m[['id', 'machine_code']], left_on='machine_id', right_on='id', how='left')
-            # Ưu tiên lấy machine_code, nếu không có thì giữ lại machine_id (UUID)
-            df['machine_display'] = df['machine_code'].fillna(df['machine_id'])
-        else:
-            df = df_repair
-            df['machine_display'] = df['machine_id']
+@st.cache_resource
+def get_sync_engines():
+    # Snapshot cục bộ + watermark: mỗi lần tải chỉ kéo các dòng mới/cập nhật
+    return {t: DeltaSync(t, client=supabase, **cfg) for t, cfg in SYNC_TABLES.items()}
 
-        # Xử lý ngày tháng
-        df['created_dt'] = pd.to_datetime(df['created_at'], errors='coerce')
-        df['confirmed_dt_raw'] = pd.to_datetime(df['confirmed_date'], errors='coerce')
-        df['confirmed_dt'] = df['confirmed_dt_raw'].fillna(df['created_dt'])
-        
-        # Loại bỏ dòng không có ngày (để tránh lỗi dt.year)
-        df = df.dropna(subset=['confirmed_dt'])
+@st.cache_resource
+def get_machine_index():
+    # Chỉ mục mã máy <-> UUID dùng chung, cập nhật theo delta của engine machines
+    return MachineIndex(get_sync_engines()["machines"])
 
-        df['NĂM'] = df['confirmed_dt'].dt.year.astype(int)
-        df['THÁNG'] = df['confirmed_dt'].dt.month.astype(int)
-        
-        # Ép kiểu chi phí an toàn
-        df['CHI_PHÍ'] = pd.to_numeric(df['compensation'], errors='coerce').fillna(0)
-        
-        return df.sort_values(by='confirmed_dt', ascending=False)
-        
+@st.cache_resource
+def get_audit_writer():
+    # Ghi audit nền theo lô, tràn xuống đĩa khi Supabase không phản hồi
+    return AuditWriter(client=supabase).start()
+
+def load_repair_data_final():
+    # Một bản ghép dùng chung cho mọi session; lỗi thì không lưu vào cache để lần sau nạp lại
+    try:
+        return get_dataset_cache().get(DASHBOARD_DATASET, _build_repair_data_final, ttl=DASHBOARD_TTL)
     except Exception as e:
         st.error(f"Lỗi hệ thống tải data: {e}")
         return pd.DataFrame()
 
+def _build_repair_data_final():
+    engines = get_sync_engines()
+    # Hai truy vấn độc lập chạy song song; copy() để các bước xử lý bên dưới không làm bẩn snapshot dùng chung
+    synced = load_parallel({t: e.sync for t, e in engines.items()})
+    df_repair = synced["repair_cases"].copy()
+    df_m = synced["machines"].copy()
+    
+    # Tạo danh sách các cột bắt buộc phải có để Dashboard không bị sập
+    required_cols = ['branch', 'compensation', 'machine_id', 'machine_code', 'confirmed_date', 'id']
+    
+    if df_repair.empty: 
+        return pd.DataFrame(columns=required_cols + ['NĂM', 'THÁNG', 'CHI_PHÍ'])
+
+    # Đảm bảo các cột tối thiểu tồn tại trong df_repair trước khi xử lý
+    for col in required_cols:
+        if col not in df_repair.columns:
+            df_repair[col] = None
+
+    # Merge lấy machine_code
+    if not df_m.empty:
+        df_repair['machine_id'] = df_repair['machine_id'].astype(str)
+        df_m['id'] = df_m['id'].astype(str)
+        df = pd.merge(df_repair, df_m[['id', 'machine_code']], left_on='machine_id', right_on='id', how='left')
+        # Ưu tiên lấy machine_code, nếu không có thì giữ lại machine_id (UUID)
+        df['machine_display'] = df['machine_code'].fillna(df['machine_id'])
+    else:
+        df = df_repair
+        df['machine_display'] = df['machine_id']
+
+    # Xử lý ngày tháng
+    df['created_dt'] = pd.to_datetime(df['created_at'], errors='coerce')
+    df['confirmed_dt_raw'] = pd.to_datetime(df['confirmed_date'], errors='coerce')
+    df['confirmed_dt'] = df['confirmed_dt_raw'].fillna(df['created_dt'])
+    
+    # Loại bỏ dòng không có ngày (để tránh lỗi dt.year)
+    df = df.dropna(subset=['confirmed_dt'])
+
+    df['NĂM'] = df['confirmed_dt'].dt.year.astype(int)
+    df['THÁNG'] = df['confirmed_dt'].dt.month.astype(int)
+    
+    # Ép kiểu chi phí an toàn
+    df['CHI_PHÍ'] = pd.to_numeric(df['compensation'], errors='coerce').fillna(0)
+    
+    return df.sort_values(by='confirmed_dt', ascending=False)
+
 # 6. ĐIỀU HƯỚNG CHÍNH
 def main():
     # 1. Khởi tạo trạng thái đăng nhập
@@ -169,7 +197,7 @@ def main():
                 st.header("⚙️ BỘ LỌC BÁO CÁO")
 
                 if st.button("🔄 Làm mới dữ liệu", use_container_width=True):
-                    st.cache_data.clear()
+                    invalidate_dataset(DASHBOARD_DATASET)
                     st.rerun()
 
                 f_mode = st.radio("Chế độ lọc thời gian", ["Tháng / Năm", "Khoảng ngày"])
@@ -331,42 +359,30 @@ def main():
                             st.dataframe(df_up.head(5), use_container_width=True)
 
                             if st.button(f"🚀 Xác nhận import {len(df_up)} dòng", use_container_width=True, type="primary"):
-                                records = []
-                                audits = []
-                                
-                                for _, r in df_up.iterrows():
-                                    # Chuẩn bị dữ liệu để insert vào repair_cases
-                                    record = {
-                                        "machine_id": str(r["machine_id"]).strip().upper(),
-                                        "branch": r["branch"],
-                                        "customer_name": r["customer_name"],
-                                        "confirmed_date": pd.to_datetime(r["confirmed_date"]).isoformat(),
-                                        "issue_reason": r["issue_reason"],
-                                        "compensation": float(r["compensation"]),
-                                        "received_date": datetime.now().isoformat(),
-                                        "note": "",
-                                        "is_unrepairable": False,
-                                        "source": "csv",
-                                        "created_by": "admin@system"
-                                    }
-                                    records.append(record)
-
-                                    # Chuẩn bị dữ liệu log cho audit_logs
-                                    audits.append({
-                                        "action": "IMPORT_CSV",
-                                        "table_name": "repair_cases",
-                                        "actor": "admin@system",
-                                        "source": "csv",
-                                        "payload": str(record), # Convert dict sang string để lưu
-                                        "created_at": datetime.now().isoformat()
-                                    })
-
+                                progress = st.progress(0.0, text="Đang import...")
                                 try:
-                                    supabase.table("repair_cases").insert(records).execute()
-                                    supabase.table("audit_logs").insert(audits).execute()
-                                    st.success("✅ Import & Audit thành công")
-                                    st.cache_data.clear()
-                                    st.rerun()
+                                    # Kiểm tra vector hóa + đổi mã máy sang UUID hàng loạt + ghi theo lô song song
+                                    report = import_repairs(
+                                        df_up,
+                                        client=supabase,
+                                        machine_index=get_machine_index(),
+                                        audit=get_audit_writer(),
+                                        on_progress=lambda done, total: progress.progress(
+                                            done / total if total else 1.0, text=f"Đã ghi {done}/{total} dòng"
+                                        ),
+                                    )
+                                    invalidate_dataset(DASHBOARD_DATASET)
+                                    if report['invalid_rows']:
+                                        st.warning(f"⚠️ Bỏ qua {report['invalid_rows']} dòng không hợp lệ")
+                                        st.dataframe(report['errors'], use_container_width=True)
+                                    if report['failed_chunks']:
+                                        st.error(f"❌ Lỗi import {len(report['failed_chunks'])}/{report['chunks']} lô")
+                                        st.dataframe(pd.DataFrame(report['failed_chunks']), use_container_width=True)
+                                    else:
+                                        st.success(
+                                            f"✅ Import & Audit thành công {report['inserted']} dòng "
+                                            f"({report['rows_per_s']} dòng/s)"
+                                        )
                                 except Exception as e:
                                     st.error(f"❌ Lỗi import: {e}")
 
@@ -400,21 +416,11 @@ def main():
                         try:
                             # 1. Kiểm tra mã máy trong bảng 'machines'
                             # Lưu ý: 'machine_code' là cột chứa mã như 1641, 'id' là UUID
-                            res_machine = supabase.table("machines") \
-                                .select("id") \
-                                .eq("machine_code", f_m_code.strip().upper()) \
-                                .execute()
-                            
-                            if res_machine.data:
-                                # Nếu tìm thấy máy đã tồn tại
-                                real_uuid = res_machine.data[0]['id']
-                            else:
+                            # Tra chỉ mục mã máy trong bộ nhớ, chỉ gọi DB khi mã chưa có
+                            created_codes = []
+                            real_uuid = get_machine_index().get_or_create(f_m_code, created=created_codes)
+                            if created_codes:
                                 # 💡 TỰ ĐỘNG TẠO MÁY MỚI nếụ chưa có trong hệ thống
-                                # Điều này giúp bạn không bị lỗi "không tồn tại"
-                                new_machine = supabase.table("machines") \
-                                    .insert({"machine_code": f_m_code.strip().upper()}) \
-                                    .execute()
-                                real_uuid = new_machine.data[0]['id']
                                 st.info(f"💡 Đã tự động thêm máy '{f_m_code}' vào danh mục thiết bị.")
 
                             # 2. Chuẩn bị bản ghi cho bảng 'repair_cases'
@@ -433,22 +439,16 @@ def main():
                             # 3. Thực hiện lưu ca sửa chữa
                             supabase.table("repair_cases").insert(record).execute()
                             
-                            # 4. Ghi log vào bảng 'audit_logs' (nếu có)
-                            try:
-                                audit_data = {
-                                    "action": "INSERT_REPAIR",
-                                    "table_name": "repair_cases",
-                                    "actor": "admin",
-                                    "payload": str(record)
-                                }
-                                supabase.table("audit_logs").insert(audit_data).execute()
-                            except:
-                                pass # Bỏ qua nếu bảng audit chưa sẵn sàng
+                            # 4. Ghi log vào bảng 'audit_logs' (đưa vào hàng đợi, thread nền ghi theo lô)
+                            get_audit_writer().log(
+                                "INSERT_REPAIR", "repair_cases", actor="admin",
+                                payload={**record, "machine_code": f_m_code}, source="manual",
+                            )
 
                             st.success(f"✅ Đã lưu thành công ca sửa chữa cho máy {f_m_code}!")
                             
                             # Làm mới cache và giao diện
-                            st.cache_data.clear()
+                            invalidate_dataset(DASHBOARD_DATASET)
                             st.rerun()
 
                         except Exception as e:
@@ -521,12 +521,12 @@ def main():
         else:
             # Chuẩn bị dữ liệu thời gian
             today = pd.Timestamp.now()
-            df_db['week'] = df_db['confirmed_dt'].dt.isocalendar().week
-            df_db['year'] = df_db['confirmed_dt'].dt.year
+            # df_db dùng chung giữa các session -> tính tuần ra biến riêng, không thêm cột vào frame
+            week = df_db['confirmed_dt'].dt.isocalendar().week
 
             # Tách dữ liệu tuần này và tuần trước
-            this_week = df_db[df_db['week'] == today.isocalendar().week]
-            last_week = df_db[df_db['week'] == today.isocalendar().week - 1]
+            this_week = df_db[week == today.isocalendar().week]
+            last_week = df_db[week == today.isocalendar().week - 1]
 
             # 1️⃣ KPI TỔNG QUAN
             c1, c2, c3, c4 = st.columns(4)
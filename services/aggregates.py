@@ -0,0 +1,83 @@
+import pandas as pd
+from core.dataset_cache import derived_dataset
+from core.metrics import timed
+from services.repair_service import REPAIR_DATASET
+
+# Độ mịn của cube: mỗi dòng là một tổ hợp (năm, tháng, chi nhánh, máy, trạng thái)
+CUBE_DIMS = ['NĂM', 'THÁNG', 'branch', 'machine_display', 'status']
+
+CUBE_COLUMNS = CUBE_DIMS + ['cases', 'cost', 'cost_max', 'last_case']
+
+
+@timed("compute.cube")
+def build_cube(df):
+    """
+    Gom dữ liệu chi tiết thành cube tổng hợp: số ca, tổng chi phí, chi phí lớn nhất, ngày ca gần nhất.
+    dropna=False để các ca thiếu chi nhánh/trạng thái vẫn được tính vào tổng.
+    """
+    if df is None or df.empty:
+        return pd.DataFrame(columns=CUBE_COLUMNS)
+
+    return (
+        df.groupby(CUBE_DIMS, observed=True, dropna=False)
+        .agg(
+            cases=('id', 'count'),
+            cost=('CHI_PHÍ', 'sum'),
+            cost_max=('CHI_PHÍ', 'max'),
+            last_case=('confirmed_dt', 'max'),
+        )
+        .reset_index()
+    )
+
+
+def get_cube(df):
+    """ Cube của dataset dùng chung (pandas hoặc DuckDB theo ANALYTICS_ENGINE), chỉ dựng lại khi version dữ liệu thay đổi """
+    from services.duckdb_engine import engine_cube  # import vòng: duckdb_engine dùng build_cube của module này
+    return derived_dataset("repair_cube", REPAIR_DATASET, lambda: engine_cube(df), source=df)
+
+
+def filter_cube(cube, year=None, month=None, branches=None):
+    """ Lọc cube theo năm / tháng / danh sách chi nhánh (thao tác trên cube nhỏ, không đụng dữ liệu gốc) """
+    mask = pd.Series(True, index=cube.index)
+    if year is not None:
+        mask &= cube['NĂM'] == year
+    if month is not None:
+        mask &= cube['THÁNG'] == month
+    if branches is not None:
+        mask &= cube['branch'].isin(branches)
+    return cube[mask]
+
+
+def rollup(cube, by):
+    """
+    Cuộn cube lên theo các chiều `by`: cases/cost cộng dồn, cost_max/last_case lấy max,
+    avg_cost = cost / cases (tương đương mean trên dữ liệu chi tiết).
+    """
+    out = (
+        cube.groupby(by, observed=True)
+        .agg(
+            cases=('cases', 'sum'),
+            cost=('cost', 'sum'),
+            cost_max=('cost_max', 'max'),
+            last_case=('last_case', 'max'),
+        )
+        .reset_index()
+    )
+    out['avg_cost'] = out['cost'] / out['cases'].where(out['cases'] > 0)
+    return out
+
+
+def machine_rollup(cube):
+    """
+    Tổng hợp theo thiết bị; chi nhánh của máy là chi nhánh có ca gần nhất
+    (tương ứng 'first' trên dữ liệu đã sắp xếp mới nhất lên đầu).
+    """
+    if cube.empty:
+        return pd.DataFrame(columns=['machine_display', 'branch', 'cases', 'cost', 'cost_max', 'last_case', 'avg_cost'])
+    by_mb = rollup(cube, ['machine_display', 'branch'])
+    latest_branch = (
+        by_mb.sort_values('last_case', ascending=False)
+        .drop_duplicates('machine_display')[['machine_display', 'branch']]
+    )
+    out = rollup(cube, 'machine_display')
+    return out.merge(latest_branch, on='machine_display', how='left')
@@ -0,0 +1,156 @@
+import threading
+import time
+import numpy as np
+import pandas as pd
+import streamlit as st
+from core.dataset_cache import derived_dataset
+from core.metrics import timed
+from services.duckdb_engine import analytics_engine, get_duckdb_engine
+from services.repair_service import REPAIR_DATASET
+
+# --- CẤU HÌNH PHÁT HIỆN CHI PHÍ BẤT THƯỜNG ---
+# Baseline theo thứ tự ưu tiên: (máy, chi nhánh) -> chi nhánh -> toàn hệ thống
+GROUP_LEVELS = [("machine", ["machine_display", "branch"]), ("branch", ["branch"])]
+MIN_GROUP_SIZE = 5        # nhóm ít ca hơn thì dùng baseline của cấp trên
+WINDOW_DAYS = 365         # baseline tính trên cửa sổ gần nhất để theo kịp giá phụ tùng
+Z_THRESHOLD = 3.5         # robust z-score (Iglewicz & Hoaglin)
+MAD_SCALE = 1.4826        # MAD -> độ lệch chuẩn tương đương với phân phối chuẩn
+MIN_SCALE_FRAC = 0.1      # sàn của độ lệch = 10% trung vị (tránh chia cho MAD = 0)
+REFIT_EVERY = 500         # số ca mới/đổi trước khi fit lại baseline
+REFIT_INTERVAL = 3600     # giây, fit lại baseline tối thiểu mỗi giờ
+
+SCORE_COLUMNS = ["baseline", "baseline_level", "z_score", "ratio", "is_anomaly"]
+
+
+def _keys(df, cols):
+    # Chuẩn về chuỗi để khớp khóa giữa dataset (category) và bảng baseline
+    if len(cols) == 1:
+        return pd.Index(df[cols[0]].astype(str))
+    return pd.MultiIndex.from_arrays([df[c].astype(str) for c in cols])
+
+
+def fit_baselines(df):
+    """
+    Trung vị và MAD của chi phí theo từng cấp nhóm, trên cửa sổ WINDOW_DAYS gần nhất (vector hóa).
+    Trả về {"machine": DataFrame, "branch": DataFrame, "global": (median, mad)}.
+    """
+    if df.empty:
+        return {"global": (0.0, 0.0)}
+    recent = df[df["confirmed_dt"] >= df["confirmed_dt"].max() - pd.Timedelta(days=WINDOW_DAYS)]
+    cost = recent["CHI_PHÍ"].astype("float64")
+    baselines = {}
+    for level, cols in GROUP_LEVELS:
+        keys = _keys(recent, cols)
+        med = cost.groupby(keys).transform("median")
+        stats = pd.DataFrame({"cost": cost.to_numpy(), "dev": (cost - med).abs().to_numpy()}, index=keys)
+        grouped = stats.groupby(level=list(range(keys.nlevels)))
+        base = pd.DataFrame({
+            "median": grouped["cost"].median(),
+            "mad": grouped["dev"].median(),
+            "n": grouped.size(),
+        })
+        baselines[level] = base[base["n"] >= MIN_GROUP_SIZE]
+    g_med = float(cost.median()) if len(cost) else 0.0
+    baselines["global"] = (g_med, float((cost - g_med).abs().median()) if len(cost) else 0.0)
+    return baselines
+
+
+def engine_baselines(df):
+    """ Baseline theo engine cấu hình: median/MAD bằng SQL trên DuckDB hoặc groupby pandas """
+    if analytics_engine() == "duckdb":
+        try:
+            return get_duckdb_engine().baselines(df, GROUP_LEVELS, WINDOW_DAYS, MIN_GROUP_SIZE)
+        except Exception as e:
+            st.warning(f"⚠️ DuckDB lỗi, chuyển sang pandas: {e}")
+    return fit_baselines(df)
+
+
+def score_cases(df, baselines):
+    """ Robust z-score của từng ca so với baseline cấp chi tiết nhất có đủ dữ liệu """
+    n = len(df)
+    g_med, g_mad = baselines["global"]
+    median = np.full(n, g_med)
+    mad = np.full(n, g_mad)
+    level = np.full(n, "global", dtype=object)
+    # Duyệt từ cấp thô tới cấp mịn: cấp mịn hơn ghi đè khi có baseline
+    for name, cols in reversed(GROUP_LEVELS):
+        base = baselines.get(name)
+        if base is None or base.empty or not n:
+            continue
+        hit = base.reindex(_keys(df, cols))
+        found = hit["median"].notna().to_numpy()
+        median = np.where(found, hit["median"].to_numpy(), median)
+        mad = np.where(found, hit["mad"].to_numpy(), mad)
+        level = np.where(found, name, level)
+
+    cost = df["CHI_PHÍ"].to_numpy(dtype="float64")
+    scale = np.maximum.reduce([MAD_SCALE * mad, MIN_SCALE_FRAC * median, np.ones(n)])
+    z = (cost - median) / scale
+    return pd.DataFrame({
+        "baseline": median,
+        "baseline_level": level,
+        "z_score": z,
+        "ratio": np.divide(cost, median, out=np.full(n, np.nan), where=median > 0),
+        "is_anomaly": (z > Z_THRESHOLD) & (cost > 0),
+        "updated_at": df["updated_at"].astype(str).to_numpy() if "updated_at" in df.columns else "",
+    }, index=pd.Index(df["id"].to_numpy(), name="id"))
+
+
+class AnomalyEngine:
+    """
+    Giữ baseline và điểm của mọi ca trong bộ nhớ process.
+    Mỗi version dữ liệu mới chỉ chấm điểm các ca mới hoặc vừa cập nhật (so theo id + updated_at);
+    baseline được fit lại sau REFIT_EVERY ca thay đổi hoặc sau REFIT_INTERVAL giây.
+    """
+
+    def __init__(self):
+        self.baselines = None
+        self.scores = pd.DataFrame(columns=SCORE_COLUMNS + ["updated_at"])
+        self.fitted_at = 0.0
+        self.pending = 0
+        self.stats = {"mode": None, "scored_rows": 0, "elapsed_ms": 0.0}
+        self._lock = threading.Lock()
+
+    @timed("compute.anomaly")
+    def update(self, df):
+        """ Cập nhật điểm theo dataset hiện tại, trả về dataset kèm cột điểm (cùng thứ tự dòng) """
+        with self._lock:
+            t0 = time.perf_counter()
+            stale = (
+                self.baselines is None
+                or self.pending >= REFIT_EVERY
+                or time.monotonic() - self.fitted_at > REFIT_INTERVAL
+            )
+            if stale:
+                self.baselines = engine_baselines(df)
+                self.fitted_at = time.monotonic()
+                self.pending = 0
+                self.scores = score_cases(df, self.baselines)
+                scored, mode = len(df), "full"
+            else:
+                ids = pd.Index(df["id"].to_numpy())
+                upd = df["updated_at"].astype(str).to_numpy() if "updated_at" in df.columns else np.full(len(df), "")
+                prev = self.scores["updated_at"].reindex(ids).to_numpy()
+                changed = pd.isna(prev) | (prev != upd)
+                kept = self.scores[self.scores.index.isin(ids[~changed])]
+                self.scores = pd.concat([kept, score_cases(df[changed], self.baselines)])
+                scored, mode = int(changed.sum()), "incremental"
+                self.pending += scored
+            self.stats = {"mode": mode, "scored_rows": scored,
+                          "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)}
+            cols = self.scores[SCORE_COLUMNS].reindex(df["id"].to_numpy())
+            return df.assign(**{c: cols[c].to_numpy() for c in SCORE_COLUMNS})
+
+
+@st.cache_resource
+def get_anomaly_engine():
+    """ Một engine dùng chung cho cả process """
+    return AnomalyEngine()
+
+
+def get_anomalies(df):
+    """ Danh sách ca bất thường xếp theo z-score giảm dần; chỉ chấm lại khi version dữ liệu đổi """
+    def _build():
+        scored = get_anomaly_engine().update(df)
+        return scored[scored["is_anomaly"].astype(bool)].sort_values("z_score", ascending=False)
+    return derived_dataset("cost_anomalies", REPAIR_DATASET, _build, source=df)
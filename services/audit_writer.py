@@ -0,0 +1,226 @@
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+import pandas as pd
+import streamlit as st
+from core.database import BackendUnavailable, _is_transient, supabase
+from core.metrics import span
+
+# --- CẤU HÌNH GHI AUDIT NỀN ---
+FLUSH_SIZE = 100          # số sự kiện tối đa mỗi request insert
+FLUSH_INTERVAL = 2.0      # giây, sự kiện chờ tối đa trong hàng đợi trước khi được ghi
+MAX_QUEUE = 10_000        # hàng đợi đầy -> ghi thẳng xuống đĩa thay vì chặn người dùng
+REPLAY_INTERVAL = 30      # giây giữa hai lần thử ghi lại các file tràn khi backend vẫn lỗi
+SPILL_DIR = os.environ.get("KHO_AUDIT_SPILL_DIR", os.path.join(".cache", "audit_spill"))
+DEAD_LETTER_SUBDIR = "dead"  # lô bị backend từ chối hẳn (4xx: sai cột, payload quá lớn...) -> cách ly, không gửi lại
+
+
+def _retryable(e):
+    """ Backend không phản hồi / đang ngắt mạch -> gửi lại sau; lỗi còn lại là backend từ chối lô """
+    return isinstance(e, BackendUnavailable) or _is_transient(e)
+
+
+def _write_jsonl(path, rows):
+    """ Ghi file tạm rồi đổi tên: không bao giờ đọc phải file ghi dở """
+    tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+
+
+class AuditWriter:
+    """
+    Ghi audit_logs bất đồng bộ: log() chỉ đưa sự kiện JSON vào hàng đợi trong process và trả về ngay,
+    một thread nền gom thành lô (đủ FLUSH_SIZE hoặc sau FLUSH_INTERVAL giây) rồi insert một request.
+    Lô ghi lỗi (backend không phản hồi, đang ngắt mạch...) được ghi ra file JSONL trong spill_dir
+    và được gửi lại theo thứ tự cũ -> mới khi backend hoạt động trở lại, kể cả sau khi khởi động lại.
+    Lô bị từ chối vì lỗi không tạm thời được chuyển sang thư mục dead letter để không chặn các lô sau.
+    """
+
+    def __init__(self, client=None, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 max_queue=MAX_QUEUE, spill_dir=SPILL_DIR):
+        self.client = client
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.spill_dir = spill_dir
+        self.dead_dir = os.path.join(spill_dir, DEAD_LETTER_SUBDIR)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spill_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_replay = 0.0
+        self.stats = {
+            "enqueued": 0, "written": 0, "flushes": 0, "failed_flushes": 0,
+            "spilled": 0, "replayed": 0, "dead_lettered": 0, "last_flush_ms": 0.0, "last_error": None,
+        }
+
+    def _db(self):
+        return self.client or supabase
+
+    @property
+    def depth(self):
+        """ Số sự kiện đang chờ trong hàng đợi """
+        return self._queue.qsize()
+
+    @property
+    def spill_files(self):
+        return sorted(glob.glob(os.path.join(self.spill_dir, "audit-*.jsonl")))
+
+    @property
+    def dead_letter_files(self):
+        return sorted(glob.glob(os.path.join(self.dead_dir, "audit-*.jsonl")))
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def log(self, action, table_name, actor, payload=None, source=None):
+        """ Đưa một sự kiện vào hàng đợi (không chờ mạng). payload là dict, được lưu dạng JSON """
+        event = {
+            "action": action,
+            "table_name": table_name,
+            "actor": actor,
+            "source": source,
+            # event_id giúp nhận ra bản ghi trùng nếu một lô được gửi lại sau khi đã ghi thành công
+            "payload": json.dumps({"event_id": str(uuid.uuid4()), **(payload or {})}, ensure_ascii=False, default=str),
+            "created_at": pd.Timestamp.now(tz="UTC").isoformat(),
+        }
+        self.start()
+        try:
+            self._queue.put_nowait(event)
+            self.stats["enqueued"] += 1
+        except queue.Full:
+            self._spill([event])
+
+    def _take_batch(self):
+        """ Chờ sự kiện đầu tiên tối đa FLUSH_INTERVAL giây, rồi gom thêm tới FLUSH_SIZE """
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size:
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+            elif self.spill_files and time.monotonic() - self._last_replay > REPLAY_INTERVAL:
+                self.replay()
+
+    def _insert(self, rows):
+        self._db().table("audit_logs").insert(rows).execute()
+
+    def _flush(self, batch):
+        t0 = time.perf_counter()
+        try:
+            with self._flush_lock, span("audit.flush", rows=len(batch), depth=self.depth):
+                self._insert(batch)
+        except Exception as e:
+            self.stats["failed_flushes"] += 1
+            self.stats["last_error"] = str(e)
+            if not _retryable(e):
+                self._spill(batch, dead=True)
+                return False
+            self._spill(batch)
+            # Vừa lỗi -> đợi REPLAY_INTERVAL rồi mới thử gửi lại các file tràn
+            self._last_replay = time.monotonic()
+            return False
+        self.stats["flushes"] += 1
+        self.stats["written"] += len(batch)
+        self.stats["last_flush_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        # Backend đã hoạt động lại -> đẩy nốt các lô đã tràn xuống đĩa
+        if self.spill_files:
+            self.replay()
+        return True
+
+    def _spill(self, rows, dead=False):
+        """
+        Ghi lô chưa gửi được ra một file JSONL mới trong spill_dir.
+        dead=True: lô bị từ chối hẳn -> ghi vào thư mục dead letter để xem xét thủ công.
+        """
+        directory = self.dead_dir if dead else self.spill_dir
+        with self._spill_lock:
+            os.makedirs(directory, exist_ok=True)
+            _write_jsonl(os.path.join(directory, f"audit-{time.time_ns()}-{uuid.uuid4().hex[:8]}.jsonl"), rows)
+        self.stats["dead_lettered" if dead else "spilled"] += len(rows)
+
+    def replay(self):
+        """
+        Gửi lại các file tràn theo thứ tự thời gian.
+        Backend chưa phản hồi -> dừng ở file lỗi đầu tiên để giữ thứ tự, lần sau thử lại.
+        Backend từ chối lô -> phần chưa gửi được của file chuyển sang dead letter, tiếp tục các file sau.
+        """
+        self._last_replay = time.monotonic()
+        sent = 0
+        for path in self.spill_files:
+            with open(path, encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            done = 0
+            try:
+                for i in range(0, len(rows), self.flush_size):
+                    with span("audit.replay", rows=len(rows[i:i + self.flush_size])):
+                        self._insert(rows[i:i + self.flush_size])
+                    done = i + self.flush_size
+            except Exception as e:
+                self.stats["last_error"] = str(e)
+                sent += done
+                if _retryable(e):
+                    # Giữ lại đúng phần chưa gửi trong file để lần sau không ghi trùng các lô đầu
+                    if done:
+                        _write_jsonl(path, rows[done:])
+                    break
+                # Chỉ cách ly các dòng chưa được ghi, các lô đầu file đã vào audit_logs
+                self._spill(rows[done:], dead=True)
+                os.remove(path)
+                continue
+            os.remove(path)
+            sent += len(rows)
+        self.stats["replayed"] += sent
+        return sent
+
+    def flush(self):
+        """ Ghi ngay mọi sự kiện đang chờ (dùng khi tắt process) """
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(batch), self.flush_size):
+            self._flush(batch[i:i + self.flush_size])
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+    def snapshot(self):
+        return {**self.stats, "depth": self.depth, "spill_files": len(self.spill_files),
+                "dead_letter_files": len(self.dead_letter_files),
+                "running": self._thread is not None and self._thread.is_alive()}
+
+
+@st.cache_resource
+def get_audit_writer():
+    """ Một writer nền cho cả process; sự kiện còn trong hàng đợi được ghi khi process thoát """
+    writer = AuditWriter().start()
+    atexit.register(writer.close)
+    return writer
@@ -0,0 +1,114 @@
+import threading
+import time
+import pandas as pd
+import streamlit as st
+from core.dataset_cache import get_dataset_cache
+from services.repair_service import (
+    REPAIR_DATASET, REPAIR_TABLES, _load_repair_data, materialize_repair_frame
+)
+from services.sync_service import get_sync_engine
+
+# --- CẤU HÌNH CHANGE FEED ---
+POLL_INTERVAL = 5     # giây giữa hai lần kéo delta nền
+FEED_TTL = 300        # TTL dự phòng của dataset khi feed đang chạy (feed đã giữ dữ liệu luôn mới)
+
+
+class ChangeFeed:
+    """
+    Nguồn thay đổi của repair_cases/machines cho dataset dùng chung.
+    - Chế độ polling: một thread nền kéo delta (watermark) mỗi POLL_INTERVAL giây; có thay đổi thì
+      ghép lại bảng và đẩy vào DatasetCache (version tăng), các session chỉ việc đọc ở lần rerun kế tiếp.
+    - apply_change(): điểm nhận sự kiện dạng Supabase Realtime ({"eventType", "new", "old"}) cho một
+      subscriber realtime chạy ngoài (client sync của supabase-py chưa hỗ trợ realtime).
+    Sự kiện DELETE chưa được áp dụng, giống giới hạn của DeltaSync.
+    """
+
+    def __init__(self, engines, cache, interval=POLL_INTERVAL):
+        self.engines = engines
+        self.cache = cache
+        self.interval = interval
+        self.stats = {
+            "running": False,
+            "polls": 0,
+            "events": 0,
+            "rows_changed": 0,
+            "errors": 0,
+            "last_poll": None,
+            "last_change": None,
+            "last_error": None,
+            "elapsed_ms": 0.0,
+        }
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+            self._thread.start()
+            self.stats["running"] = True
+
+    def stop(self):
+        self._stop.set()
+        self.stats["running"] = False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll_now()
+            except Exception as e:
+                # Lỗi mạng tạm thời: ghi nhận rồi thử lại ở chu kỳ sau, không để thread chết
+                self.stats["errors"] += 1
+                self.stats["last_error"] = str(e)
+
+    def _publish(self, df, changed):
+        now = pd.Timestamp.now(tz="UTC").isoformat()
+        self.stats["last_poll"] = now
+        if changed:
+            self.cache.put(REPAIR_DATASET, df)
+            self.stats["rows_changed"] += changed
+            self.stats["last_change"] = now
+
+    def poll_now(self):
+        """ Kéo delta ngay lập tức; có dòng thay đổi thì đẩy dataset mới vào cache. Trả về số dòng thay đổi """
+        with self._lock:
+            t0 = time.perf_counter()
+            df = _load_repair_data(self.engines)
+            changed = sum(e.stats.get("rows_changed") or 0 for e in self.engines.values())
+            self._publish(df, changed)
+            self.stats["polls"] += 1
+            self.stats["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            return changed
+
+    def apply_change(self, payload, table="repair_cases"):
+        """ Áp dụng một sự kiện INSERT/UPDATE vào snapshot của bảng rồi đẩy dataset mới vào cache """
+        event = payload.get("eventType") or payload.get("type")
+        row = payload.get("new") or payload.get("record")
+        if event not in ("INSERT", "UPDATE") or not row or table not in self.engines:
+            return 0
+        with self._lock:
+            # Không đẩy watermark: lần poll sau vẫn kéo đủ các dòng của nơi khác quanh thời điểm này
+            changed = self.engines[table].apply_rows([row], advance_watermark=False)
+            self.stats["events"] += 1
+            if changed:
+                df = materialize_repair_frame(
+                    self.engines["repair_cases"].snapshot, self.engines["machines"].snapshot
+                )
+                self._publish(df, changed)
+            return changed
+
+
+@st.cache_resource
+def get_change_feed():
+    """ Feed dùng chung cho cả process, khởi động thread polling ở lần gọi đầu tiên """
+    engines = {t: get_sync_engine(t) for t in REPAIR_TABLES}
+    feed = ChangeFeed(engines, get_dataset_cache())
+    feed.start()
+    return feed
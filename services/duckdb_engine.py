@@ -0,0 +1,189 @@
+import os
+import numpy as np
+import pandas as pd
+import streamlit as st
+from core.metrics import timed
+from services.aggregates import CUBE_COLUMNS, CUBE_DIMS, build_cube
+
+# DuckDB là tùy chọn: không cài thì mọi phép tổng hợp vẫn chạy bằng pandas
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# --- CẤU HÌNH ENGINE PHÂN TÍCH ---
+# "pandas": groupby trên DataFrame (mặc định); "duckdb": SQL trong DuckDB in-process, song song nhiều lõi
+ANALYTICS_ENGINES = ("pandas", "duckdb")
+DUCKDB_THREADS = os.cpu_count() or 1
+
+# id là khóa chính (không NULL) nên COUNT(*) = COUNT(id) mà không phải quét cột chuỗi id
+CUBE_SQL = """
+SELECT "NĂM", "THÁNG", branch, machine_display, status,
+       COUNT(*) AS cases,
+       SUM("CHI_PHÍ") AS cost,
+       MAX("CHI_PHÍ") AS cost_max,
+       MAX(confirmed_dt) AS last_case
+FROM repairs
+GROUP BY ALL
+ORDER BY ALL NULLS LAST"""
+
+# Khóa nhóm ép về chuỗi giống services.anomaly._keys (NaN của category -> 'nan')
+BASELINE_SQL = """
+WITH recent AS (
+    SELECT {keys}, CAST("CHI_PHÍ" AS DOUBLE) AS cost
+    FROM repairs
+    WHERE confirmed_dt >= (SELECT MAX(confirmed_dt) FROM repairs) - INTERVAL {window} DAY
+)
+SELECT {names}, MEDIAN(cost) AS median, MAD(cost) AS mad, COUNT(*) AS n
+FROM recent
+GROUP BY ALL
+HAVING COUNT(*) >= {min_size}"""
+
+GLOBAL_BASELINE_SQL = """
+SELECT MEDIAN(cost), MAD(cost) FROM (
+    SELECT CAST("CHI_PHÍ" AS DOUBLE) AS cost
+    FROM repairs
+    WHERE confirmed_dt >= (SELECT MAX(confirmed_dt) FROM repairs) - INTERVAL {window} DAY
+)"""
+
+
+def analytics_engine():
+    """ Engine tính toán theo secrets ANALYTICS_ENGINE; chọn duckdb mà chưa cài thì dùng pandas """
+    try:
+        engine = st.secrets.get("ANALYTICS_ENGINE", "pandas")
+    except Exception:
+        engine = "pandas"
+    if engine not in ANALYTICS_ENGINES or (engine == "duckdb" and duckdb is None):
+        return "pandas"
+    return engine
+
+
+class DuckDBEngine:
+    """
+    Chạy các phép tổng hợp của tab bằng SQL trên DuckDB in-process.
+    Mỗi phép tính tách các cột cần dùng của dataset dùng chung (df[cols] là một bản sao, vài ms ở 300k ca)
+    rồi đăng ký làm bảng `repairs`; đăng ký nguyên dataset còn chậm hơn vì DuckDB phải dò kiểu các cột object.
+    DuckDB đọc bộ đệm numpy của bản chiếu đó không sao chép thêm, chia việc cho DUCKDB_THREADS lõi.
+    Mỗi lệnh dùng một cursor riêng nên an toàn khi nhiều session chạy song song.
+    """
+
+    def __init__(self, threads=DUCKDB_THREADS):
+        if duckdb is None:
+            raise RuntimeError("Chưa cài duckdb (pip install duckdb)")
+        self.con = duckdb.connect(":memory:")
+        self.con.execute(f"SET threads = {int(threads)}")
+
+    def _run(self, df, sql, fetch):
+        cur = self.con.cursor()
+        try:
+            cur.register("repairs", df)
+            return fetch(cur.execute(sql))
+        finally:
+            cur.close()
+
+    def query(self, df, sql):
+        return self._run(df, sql, lambda r: r.df())
+
+    def scalar_row(self, df, sql):
+        return self._run(df, sql, lambda r: r.fetchone())
+
+    @timed("compute.cube_duckdb")
+    def cube(self, df):
+        """ Tương đương services.aggregates.build_cube (cùng cột, thứ tự dòng và kiểu dữ liệu) """
+        if df is None or df.empty:
+            return pd.DataFrame(columns=CUBE_COLUMNS)
+        # Chỉ đăng ký các cột cần dùng (bản sao nhỏ): DuckDB khỏi phải dò kiểu các cột object không liên quan
+        out = self.query(df[CUBE_DIMS + ['CHI_PHÍ', 'confirmed_dt']], CUBE_SQL)
+        dtypes = {c: df[c].dtype for c in CUBE_DIMS}
+        dtypes.update(cases='int64', cost=df['CHI_PHÍ'].dtype, cost_max=df['CHI_PHÍ'].dtype,
+                      last_case=df['confirmed_dt'].dtype)
+        return out.astype(dtypes)[CUBE_COLUMNS]
+
+    @timed("compute.anomaly_baselines_duckdb")
+    def baselines(self, df, levels, window_days, min_size):
+        """ Tương đương services.anomaly.fit_baselines: trung vị + MAD theo từng cấp nhóm """
+        if df.empty:
+            return {"global": (0.0, 0.0)}
+        data = df[list(dict.fromkeys(c for _, cols in levels for c in cols)) + ['CHI_PHÍ', 'confirmed_dt']]
+        out = {}
+        for level, cols in levels:
+            names = [f"k{i}" for i in range(len(cols))]
+            keys = ", ".join(
+                f"COALESCE(CAST(\"{c}\" AS VARCHAR), 'nan') AS {n}" for c, n in zip(cols, names)
+            )
+            base = self.query(data, BASELINE_SQL.format(
+                keys=keys, names=", ".join(names), window=int(window_days), min_size=int(min_size)
+            ))
+            if len(cols) == 1:
+                index = pd.Index(base[names[0]])
+            else:
+                index = pd.MultiIndex.from_arrays([base[n] for n in names])
+            out[level] = pd.DataFrame({
+                "median": base["median"].to_numpy(dtype="float64"),
+                "mad": base["mad"].to_numpy(dtype="float64"),
+                "n": base["n"].to_numpy(dtype="int64"),
+            }, index=index).sort_index()
+        med, mad = self.scalar_row(data, GLOBAL_BASELINE_SQL.format(window=int(window_days)))
+        out["global"] = (float(med or 0.0), float(mad or 0.0))
+        return out
+
+
+@st.cache_resource
+def get_duckdb_engine():
+    """ Một connection DuckDB cho cả process """
+    return DuckDBEngine()
+
+
+def engine_cube(df):
+    """ Cube theo engine cấu hình; DuckDB lỗi thì quay về pandas """
+    if analytics_engine() == "duckdb":
+        try:
+            return get_duckdb_engine().cube(df)
+        except Exception as e:
+            st.warning(f"⚠️ DuckDB lỗi, chuyển sang pandas: {e}")
+    return build_cube(df)
+
+
+def check_parity(df, rtol=1e-6):
+    """
+    Đối chiếu kết quả DuckDB với pandas trên cùng dataset: cube, KPI và baseline chi phí bất thường.
+    Trả về danh sách khác biệt (rỗng = khớp).
+    """
+    from services.anomaly import GROUP_LEVELS, MIN_GROUP_SIZE, WINDOW_DAYS, fit_baselines
+    from services.kpi_service import compare_kpis, pandas_kpis
+
+    engine = DuckDBEngine()
+    diffs = []
+    cube_pd, cube_db = build_cube(df), engine.cube(df)
+    try:
+        pd.testing.assert_frame_equal(cube_pd, cube_db, check_dtype=False, rtol=rtol)
+    except AssertionError as e:
+        diffs.append(f"cube: {e}")
+    diffs += [f"kpi.{d}" for d in compare_kpis(pandas_kpis(df, cube_pd), pandas_kpis(df, cube_db), rtol)]
+
+    base_pd = fit_baselines(df)
+    base_db = engine.baselines(df, GROUP_LEVELS, WINDOW_DAYS, MIN_GROUP_SIZE)
+    if not np.allclose(base_pd["global"], base_db["global"], rtol=rtol):
+        diffs.append(f"baseline.global: {base_pd['global']} != {base_db['global']}")
+    for level, _ in GROUP_LEVELS:
+        try:
+            pd.testing.assert_frame_equal(base_pd[level].sort_index(), base_db[level],
+                                          check_dtype=False, check_names=False, rtol=rtol)
+        except AssertionError as e:
+            diffs.append(f"baseline.{level}: {e}")
+    return diffs
+
+
+if __name__ == "__main__":
+    # Kiểm tra khớp kết quả trên dữ liệu giả lập: python -m services.duckdb_engine [số_ca ...]
+    import sys
+    from bench.synthetic import generate
+    from services.repair_service import build_repair_frame, compact_repair_frame
+
+    for n in [int(a) for a in sys.argv[1:]] or [10_000, 100_000]:
+        tables = generate(n)
+        df, _ = compact_repair_frame(build_repair_frame(tables["repair_cases"], tables["machines"]))
+        diffs = check_parity(df)
+        print(f"{n:>9,} ca: {'khớp' if not diffs else f'{len(diffs)} khác biệt'}")
+        for d in diffs:
+            print("   ", d)
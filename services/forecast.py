@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+from core.dataset_cache import derived_dataset
+from core.metrics import timed
+from services.repair_service import REPAIR_DATASET
+from services.aggregates import get_cube
+
+# --- CẤU HÌNH DỰ BÁO CHI PHÍ ---
+MIN_HISTORY = 2           # số tháng tối thiểu (tính từ tháng có ca đầu tiên) để dự báo một chi nhánh
+SEASON = 12               # chu kỳ mùa vụ theo tháng
+DEFAULT_HORIZON = 3       # số tháng dự báo
+CONFIDENCE_Z = 1.96       # ~ khoảng tin cậy 95%
+
+# Lưới tham số làm trơn (Holt): mỗi chi nhánh chọn cặp (alpha, beta) có sai số một bước nhỏ nhất
+ALPHAS = np.linspace(0.1, 0.9, 9)
+BETAS = np.array([0.0, 0.1, 0.3])
+
+FORECAST_COLUMNS = ['branch', 'method', 'step', 'NĂM', 'THÁNG', 'forecast', 'lower', 'upper', 'last_actual', 'history_months']
+
+
+def monthly_matrix(cube):
+    """
+    Chuỗi chi phí theo tháng của mọi chi nhánh dưới dạng ma trận (chi nhánh x tháng liên tục).
+    Tháng không có ca = 0. Trả về (branches, months, Y, start) với start là cột của tháng có ca đầu tiên.
+    """
+    data = cube[cube['branch'].notna()]
+    if data.empty:
+        return [], np.array([], dtype=int), np.zeros((0, 0)), np.array([], dtype=int)
+    month_idx = data['NĂM'].astype(int) * 12 + data['THÁNG'].astype(int) - 1
+    series = data.assign(m=month_idx).groupby(['branch', 'm'], observed=True)['cost'].sum()
+    wide = series.unstack('m', fill_value=0)
+    months = np.arange(month_idx.min(), month_idx.max() + 1)
+    wide = wide.reindex(columns=months, fill_value=0)
+    Y = wide.to_numpy(dtype='float64')
+    start = (Y != 0).argmax(axis=1)
+    return list(wide.index.astype(str)), months, Y, start
+
+
+def _fit_holt(Y, start):
+    """
+    Làm trơn hàm mũ kép (Holt) cho mọi chi nhánh và mọi cặp tham số trong một vòng lặp theo thời gian
+    (mảng numpy kích thước lưới x chi nhánh). Trả về level, trend, sai số một bước và số bước đã đo.
+    """
+    alpha = np.repeat(ALPHAS, len(BETAS))[:, None]
+    beta = np.tile(BETAS, len(ALPHAS))[:, None]
+    G, (B, T) = len(alpha), Y.shape
+    level = np.zeros((G, B))
+    trend = np.zeros((G, B))
+    sse = np.zeros((G, B))
+    for t in range(T):
+        y = Y[:, t]
+        active = t > start
+        pred = level + trend
+        sse += np.where(active, (y - pred) ** 2, 0.0)
+        new_level = alpha * y + (1 - alpha) * pred
+        new_trend = beta * (new_level - level) + (1 - beta) * trend
+        # Tháng đầu tiên của chi nhánh: khởi tạo level = giá trị quan sát, trend = 0
+        level = np.where(active, new_level, np.where(t == start, y, level))
+        trend = np.where(active, new_trend, np.where(t == start, 0.0, trend))
+    best = sse.argmin(axis=0)
+    cols = np.arange(B)
+    n = np.maximum(T - 1 - start, 1)
+    return level[best, cols], trend[best, cols], np.sqrt(sse[best, cols] / n)
+
+
+def _fit_seasonal_naive(Y, start):
+    """ Dự báo = cùng kỳ năm trước; sai số đo trên các tháng đã có cùng kỳ """
+    B, T = Y.shape
+    if T <= SEASON:
+        return np.full(B, np.inf)
+    err = Y[:, SEASON:] - Y[:, :-SEASON]
+    valid = np.arange(SEASON, T)[None, :] >= (start + SEASON)[:, None]
+    n = valid.sum(axis=1)
+    rmse = np.sqrt(np.where(valid, err ** 2, 0.0).sum(axis=1) / np.maximum(n, 1))
+    # Cần ít nhất một chu kỳ đủ dữ liệu để so sánh với Holt
+    return np.where(n >= SEASON, rmse, np.inf)
+
+
+@timed("compute.forecast")
+def forecast_branches(cube, horizon=DEFAULT_HORIZON):
+    """
+    Dự báo chi phí `horizon` tháng tới cho mọi chi nhánh (vector hóa).
+    Mỗi chi nhánh chọn Holt hoặc seasonal naive theo sai số một bước nhỏ hơn; khoảng tin cậy
+    = dự báo ± z * độ lệch sai số * sqrt(bước), cận dưới không âm.
+    """
+    branches, months, Y, start = monthly_matrix(cube)
+    history = len(months) - start if len(branches) else start
+    keep = history >= MIN_HISTORY
+    if not len(branches) or not keep.any():
+        return pd.DataFrame(columns=FORECAST_COLUMNS)
+
+    Y, start, history = Y[keep], start[keep], history[keep]
+    branches = [b for b, k in zip(branches, keep) if k]
+    level, trend, holt_rmse = _fit_holt(Y, start)
+    seasonal_rmse = _fit_seasonal_naive(Y, start)
+    use_seasonal = seasonal_rmse < holt_rmse
+
+    steps = np.arange(1, horizon + 1)
+    holt = level[:, None] + trend[:, None] * steps[None, :]
+    if Y.shape[1] >= SEASON:
+        # Bước h lấy cùng tháng năm trước (lặp lại chu kỳ nếu h > SEASON)
+        seasonal = Y[:, Y.shape[1] - SEASON + (steps - 1) % SEASON]
+    else:
+        seasonal = holt
+    point = np.where(use_seasonal[:, None], seasonal, holt)
+    sigma = np.where(use_seasonal, seasonal_rmse, holt_rmse)[:, None] * np.sqrt(steps)[None, :]
+    point = np.maximum(point, 0.0)
+
+    target = months[-1] + steps
+    B, H = point.shape
+    return pd.DataFrame({
+        'branch': np.repeat(branches, H),
+        'method': np.repeat(np.where(use_seasonal, "seasonal_naive", "holt"), H),
+        'step': np.tile(steps, B),
+        'NĂM': np.tile(target // 12, B),
+        'THÁNG': np.tile(target % 12 + 1, B),
+        'forecast': point.ravel(),
+        'lower': np.maximum(point - CONFIDENCE_Z * sigma, 0.0).ravel(),
+        'upper': (point + CONFIDENCE_Z * sigma).ravel(),
+        'last_actual': np.repeat(Y[:, -1], H),
+        'history_months': np.repeat(history, H),
+    })
+
+
+def get_branch_forecasts(df, horizon=DEFAULT_HORIZON):
+    """ Dự báo của dataset dùng chung, chỉ tính lại khi version dữ liệu thay đổi """
+    return derived_dataset(f"branch_forecast:{horizon}", REPAIR_DATASET,
+                           lambda: forecast_branches(get_cube(df), horizon), source=df)
@@ -0,0 +1,136 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import pandas as pd
+from core.database import supabase
+from services.audit_writer import get_audit_writer
+from services.machine_index import get_machine_index
+
+# --- CẤU HÌNH IMPORT ---
+REQUIRED_COLUMNS = ["machine_code", "branch", "customer_name", "confirmed_date", "issue_reason", "compensation"]
+CHUNK_SIZE = 500
+MAX_WORKERS = 4
+
+
+def _client(client):
+    return client or supabase
+
+
+def validate_import(df_up):
+    """
+    Kiểm tra & chuẩn hóa file CSV theo cột (vector hóa, không duyệt từng dòng).
+    Chấp nhận cột 'machine_id' (mẫu cũ, chứa mã máy) thay cho 'machine_code'.
+    Trả về (df_valid, df_errors); df_errors có cột 'row' (số dòng trong file) và 'error'.
+    """
+    df = df_up.copy()
+    if "machine_code" not in df.columns and "machine_id" in df.columns:
+        df = df.rename(columns={"machine_id": "machine_code"})
+
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"Thiếu cột bắt buộc: {', '.join(missing)}")
+
+    # Giữ cột id nếu file có (nhập lại bản ghi cũ -> upsert theo id)
+    df = df[REQUIRED_COLUMNS + (["id"] if "id" in df.columns else [])].copy()
+    df["machine_code"] = df["machine_code"].astype("string").str.strip().str.upper()
+    df["branch"] = df["branch"].astype("string").str.strip()
+    df["customer_name"] = df["customer_name"].astype("string").str.strip().fillna("")
+    df["issue_reason"] = df["issue_reason"].astype("string").str.strip().fillna("")
+    confirmed = pd.to_datetime(df["confirmed_date"], errors="coerce")
+    compensation = pd.to_numeric(df["compensation"], errors="coerce")
+
+    # Mỗi điều kiện lỗi là một mask trên toàn cột
+    checks = [
+        (df["machine_code"].isna() | (df["machine_code"] == ""), "Thiếu mã máy"),
+        (df["branch"].isna() | (df["branch"] == ""), "Thiếu chi nhánh"),
+        (confirmed.isna(), "Ngày xác nhận không hợp lệ"),
+        (compensation.isna() | (compensation < 0), "Chi phí không hợp lệ"),
+    ]
+    checks = [(mask.fillna(False).astype(bool), msg) for mask, msg in checks]
+    errors = [
+        pd.DataFrame({"row": df.index[mask.to_numpy()] + 2, "error": msg})  # +2: dòng tiêu đề + đánh số từ 1
+        for mask, msg in checks if mask.any()
+    ]
+    bad = pd.Series(False, index=df.index)
+    for mask, _ in checks:
+        bad |= mask
+
+    df["confirmed_date"] = confirmed.dt.strftime("%Y-%m-%d")
+    df["compensation"] = compensation.astype(float)
+    df_errors = pd.concat(errors, ignore_index=True) if errors else pd.DataFrame(columns=["row", "error"])
+    return df[~bad], df_errors
+
+
+def build_records(df_valid, machine_ids, actor="admin@system"):
+    """ Dựng danh sách bản ghi repair_cases từ các cột đã chuẩn hóa """
+    out = df_valid.assign(
+        machine_id=df_valid["machine_code"].map(machine_ids),
+        origin_branch=df_valid["branch"],
+        received_date=datetime.now().isoformat(),
+        note="",
+        is_unrepairable=False,
+        source="csv",
+        created_by=actor,
+    ).drop(columns=["machine_code"])
+    out = out.astype(object).where(out.notna(), None)
+    return out.to_dict("records")
+
+
+def _write_chunk(records, actor, client, audit):
+    db = _client(client)
+    # Dòng có id -> upsert (nhập lại không tạo trùng), dòng không có id -> insert; một chunk có thể lẫn cả hai
+    with_id = [r for r in records if r.get("id")]
+    without_id = [{k: v for k, v in r.items() if k != "id"} for r in records if not r.get("id")]
+    saved = []
+    for rows, write in ((with_id, "upsert"), (without_id, "insert")):
+        if rows:
+            res = getattr(db.table("repair_cases"), write)(rows).execute()
+            saved.extend(getattr(res, "data", None) or rows)
+    # Mỗi bản ghi một dòng audit như importer cũ (payload = bản ghi đã lưu, có id do server cấp);
+    # đi qua hàng đợi nền nên chunk không phải chờ thêm round trip, writer tự gom lô khi insert
+    for row in saved:
+        audit.log("IMPORT_CSV", "repair_cases", actor, payload=row, source="csv")
+    return len(records)
+
+
+def import_repairs(df_up, chunk_size=CHUNK_SIZE, max_workers=MAX_WORKERS, actor="admin@system",
+                   on_progress=None, client=None, machine_index=None, audit=None):
+    """
+    Import hàng loạt: kiểm tra -> đổi mã máy sang UUID qua chỉ mục máy (bulk) -> ghi theo chunk qua pool có giới hạn.
+    on_progress(done_rows, total_rows) được gọi ở luồng chính sau mỗi chunk.
+    audit: AuditWriter ghi nhật ký từng bản ghi (mặc định writer nền dùng chung của process).
+    Trả về báo cáo: số dòng hợp lệ/lỗi, số dòng đã ghi, chunk lỗi, thời gian và tốc độ.
+    """
+    t0 = time.perf_counter()
+    df_valid, df_errors = validate_import(df_up)
+    machine_index = machine_index or get_machine_index()
+    audit = audit or get_audit_writer()
+    machine_ids = machine_index.get_or_create_many(df_valid["machine_code"].unique().tolist())
+    records = build_records(df_valid, machine_ids, actor=actor)
+
+    chunks = [records[i:i + chunk_size] for i in range(0, len(records), chunk_size)]
+    inserted, done, failed = 0, 0, []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(_write_chunk, chunk, actor, client, audit): (i, len(chunk)) for i, chunk in enumerate(chunks)}
+        for fut in as_completed(futures):
+            idx, size = futures[fut]
+            try:
+                inserted += fut.result()
+            except Exception as e:
+                failed.append({"chunk": idx, "rows": size, "error": str(e)})
+            done += size
+            if on_progress is not None:
+                on_progress(done, len(records))
+
+    elapsed = time.perf_counter() - t0
+    return {
+        "total_rows": len(df_up),
+        "valid_rows": len(df_valid),
+        "invalid_rows": len(df_up) - len(df_valid),
+        "errors": df_errors,
+        "inserted": inserted,
+        "chunks": len(chunks),
+        "failed_chunks": failed,
+        "elapsed_s": round(elapsed, 2),
+        "rows_per_s": round(inserted / elapsed, 1) if elapsed > 0 else 0.0,
+    }
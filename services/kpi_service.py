@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+from core.database import fetch_dataframe, supabase
+from core.storage import SQLiteBackend
+from core.dataset_cache import derived_dataset
+from core.metrics import timed
+from services.repair_service import REPAIR_DATASET
+from services.aggregates import build_cube, get_cube, rollup
+from services.risk import recency_as_of, score_machines
+
+# --- CHẾ ĐỘ TÍNH KPI ---
+# "pandas": tính trên dataset đã tải về; "sql": đọc kết quả đã gom sẵn từ các view kpi_* trong Postgres
+KPI_MODES = ("pandas", "sql")
+
+# Hàm SQL khác nhau giữa Postgres (Supabase) và SQLite (bản giả lập cục bộ)
+DIALECTS = {
+    "postgres": {
+        "ts": "CAST({} AS timestamp)",
+        "num": "CAST({} AS numeric)",
+        "year": "CAST(EXTRACT(YEAR FROM {}) AS integer)",
+        "month": "CAST(EXTRACT(MONTH FROM {}) AS integer)",
+    },
+    "sqlite": {
+        "ts": "datetime({})",
+        "num": "CAST({} AS REAL)",
+        "year": "CAST(strftime('%Y', {}) AS INTEGER)",
+        "month": "CAST(strftime('%m', {}) AS INTEGER)",
+    },
+}
+
+# Các view tái hiện đúng logic của get_repair_data + tab KPI (ghép máy, chọn ngày, ép chi phí, bỏ dòng thiếu ngày).
+# Các view nhiều dòng có cột row_key duy nhất để đọc theo trang (keyset) qua stream_rows,
+# không bị giới hạn max-rows của PostgREST cắt cụt (kpi_machine_branch ~ số máy x số chi nhánh).
+VIEW_TEMPLATES = {
+    "kpi_repair_base": """
+SELECT r.id,
+       r.branch,
+       COALESCE(m.machine_code, 'N/A') AS machine_display,
+       COALESCE({ts_confirmed}, {ts_created}) AS confirmed_dt,
+       COALESCE({num_cost}, 0) AS cost
+FROM repair_cases r
+LEFT JOIN machines m ON m.id = r.machine_id
+WHERE COALESCE({ts_confirmed}, {ts_created}) IS NOT NULL""",
+    "kpi_overview": """
+SELECT COUNT(*) AS total_cases,
+       COALESCE(SUM(cost), 0) AS total_cost,
+       COUNT(DISTINCT machine_display) AS unique_machines,
+       (SELECT COUNT(*) FROM (
+            SELECT machine_display FROM kpi_repair_base GROUP BY machine_display HAVING COUNT(*) > 1
+        ) t) AS repeat_machines,
+       COUNT(DISTINCT branch) AS branch_count
+FROM kpi_repair_base""",
+    "kpi_monthly_trend": """
+SELECT {year} AS nam, {month} AS thang, COUNT(*) AS cases, SUM(cost) AS cost,
+       {year} * 100 + {month} AS row_key
+FROM kpi_repair_base
+GROUP BY {year}, {month}""",
+    "kpi_branch_summary": """
+SELECT branch, COUNT(*) AS total_cases, SUM(cost) AS total_cost, AVG(cost) AS avg_cost
+FROM kpi_repair_base
+WHERE branch IS NOT NULL
+GROUP BY branch""",
+    "kpi_machine_branch": """
+SELECT machine_display, branch, COUNT(*) AS cases, SUM(cost) AS cost, MAX(confirmed_dt) AS last_case,
+       machine_display || '|' || branch AS row_key
+FROM kpi_repair_base
+WHERE branch IS NOT NULL
+GROUP BY machine_display, branch""",
+}
+# Khóa phân trang của từng view (kpi_overview chỉ có một dòng)
+VIEW_KEYS = {
+    "kpi_monthly_trend": "row_key",
+    "kpi_branch_summary": "branch",
+    "kpi_machine_branch": "row_key",
+}
+
+
+def render_views(dialect="postgres"):
+    """ Sinh câu lệnh CREATE VIEW cho từng view KPI theo dialect """
+    fn = DIALECTS[dialect]
+    params = {
+        "ts_confirmed": fn["ts"].format("r.confirmed_date"),
+        "ts_created": fn["ts"].format("r.created_at"),
+        "num_cost": fn["num"].format("r.compensation"),
+        "year": fn["year"].format("confirmed_dt"),
+        "month": fn["month"].format("confirmed_dt"),
+    }
+    if dialect == "postgres":
+        return [f"CREATE OR REPLACE VIEW {name} AS{tpl.format(**params)};" for name, tpl in VIEW_TEMPLATES.items()]
+    # SQLite không có CREATE OR REPLACE VIEW: xóa rồi tạo lại để file .db cũ nhận định nghĩa mới
+    return [f"DROP VIEW IF EXISTS {name};" for name in VIEW_TEMPLATES] + [
+        f"CREATE VIEW {name} AS{tpl.format(**params)};" for name, tpl in VIEW_TEMPLATES.items()
+    ]
+
+
+class LocalPostgrest(SQLiteBackend):
+    """
+    Backend SQLite in-memory nạp sẵn dữ liệu thô + các view KPI, để chạy chế độ SQL khi không có Supabase
+    (đối chiếu với chế độ pandas).
+    """
+
+    def __init__(self, repair_cases, machines):
+        super().__init__(":memory:")
+        self.load_frame("repair_cases", repair_cases)
+        self.load_frame("machines", machines)
+        self.ensure_views(render_views("sqlite"))
+
+
+def kpi_mode():
+    try:
+        mode = st.secrets.get("KPI_MODE", "pandas")
+    except Exception:
+        mode = "pandas"
+    return mode if mode in KPI_MODES else "pandas"
+
+
+@timed("compute.kpi_pandas")
+def pandas_kpis(df, cube=None, now=None):
+    """ KPI tính trên dataset đã tải (qua cube tổng hợp); không truyền cube thì dựng trực tiếp từ df """
+    cube = build_cube(df) if cube is None else cube
+    total_cases = int(cube['cases'].sum())
+    cases_by_machine = cube.groupby('machine_display', observed=True)['cases'].sum()
+    unique_m = len(cases_by_machine)
+    repeat_m = int((cases_by_machine > 1).sum())
+    overview = {
+        "total_cases": total_cases,
+        "avg_cost": cube['cost'].sum() / total_cases if total_cases else 0,
+        "repeat_rate": (repeat_m / unique_m) * 100 if unique_m > 0 else 0,
+        "branch_count": int(cube['branch'].nunique()),
+    }
+    trend = rollup(cube, ['NĂM', 'THÁNG'])[['NĂM', 'THÁNG', 'cases', 'cost']]
+    branch = rollup(cube, 'branch').rename(
+        columns={'cases': 'total_cases', 'cost': 'total_cost'}
+    )[['branch', 'total_cases', 'total_cost', 'avg_cost']]
+    machine = rollup(cube, ['machine_display', 'branch'])[['machine_display', 'branch', 'cases', 'cost', 'last_case']]
+    return _finalize(overview, trend, branch, machine, now)
+
+
+@timed("compute.kpi_sql")
+def sql_kpis(client=None, now=None):
+    """
+    KPI đọc từ các view kpi_* phía server: chỉ kết quả đã gom đi qua mạng.
+    Các view nhiều dòng được đọc theo trang, thứ tự tất định theo VIEW_KEYS.
+    """
+    db = client or supabase
+    if getattr(db, "kind", None) == "sqlite":
+        # Backend cục bộ: view kpi_* được tạo ngay trong file SQLite
+        db.ensure_views(render_views("sqlite"))
+    def read(name):
+        if name not in VIEW_KEYS:
+            return pd.DataFrame(db.table(name).select("*").execute().data or [])
+        return fetch_dataframe(name, key=VIEW_KEYS[name], client=db)
+    ov = read("kpi_overview").iloc[0]
+    total_cases = int(ov['total_cases'] or 0)
+    unique_m = int(ov['unique_machines'] or 0)
+    overview = {
+        "total_cases": total_cases,
+        "avg_cost": float(ov['total_cost'] or 0) / total_cases if total_cases else 0,
+        "repeat_rate": (int(ov['repeat_machines'] or 0) / unique_m) * 100 if unique_m > 0 else 0,
+        "branch_count": int(ov['branch_count'] or 0),
+    }
+    trend = read("kpi_monthly_trend").rename(columns={'nam': 'NĂM', 'thang': 'THÁNG'})
+    trend = trend.reindex(columns=['NĂM', 'THÁNG', 'cases', 'cost'])
+    branch = read("kpi_branch_summary").reindex(columns=['branch', 'total_cases', 'total_cost', 'avg_cost'])
+    machine = read("kpi_machine_branch").reindex(columns=['machine_display', 'branch', 'cases', 'cost', 'last_case'])
+    machine['last_case'] = pd.to_datetime(machine['last_case'], errors='coerce')
+    return _finalize(overview, trend, branch, machine, now)
+
+
+def _finalize(overview, trend, branch, machine, now=None):
+    """ Đưa hai nguồn về cùng kiểu/thứ tự để hiển thị và so sánh được với nhau """
+    trend = trend.astype({'NĂM': int, 'THÁNG': int, 'cases': int, 'cost': float})
+    trend = trend.sort_values(['NĂM', 'THÁNG']).reset_index(drop=True)
+    branch = branch.astype({'branch': str, 'total_cases': int, 'total_cost': float, 'avg_cost': float})
+    branch = branch.sort_values('branch').reset_index(drop=True)
+    machine = machine.astype({'machine_display': str, 'branch': str, 'cases': int, 'cost': float})
+    machine = machine.sort_values(['machine_display', 'branch']).reset_index(drop=True)
+    return {
+        "overview": overview,
+        "trend": trend,
+        "branch": branch,
+        "machine": machine,
+        "machine_risk": score_machines(machine, now=now),
+    }
+
+
+def compare_kpis(a, b, rtol=1e-6):
+    """ So khớp kết quả hai chế độ; trả về danh sách khác biệt (rỗng nghĩa là trùng khớp) """
+    diffs = []
+    for k, v in a["overview"].items():
+        if not np.isclose(v, b["overview"].get(k, np.nan), rtol=rtol):
+            diffs.append(f"overview.{k}: {v} != {b['overview'].get(k)}")
+    for name in ("trend", "branch", "machine"):
+        left, right = a[name].drop(columns=['last_case'], errors='ignore'), b[name].drop(columns=['last_case'], errors='ignore')
+        try:
+            pd.testing.assert_frame_equal(left, right, check_dtype=False, rtol=rtol)
+        except AssertionError as e:
+            diffs.append(f"{name}: {e}")
+    return diffs
+
+
+def get_kpis(df):
+    """ KPI theo chế độ cấu hình, memo theo dữ liệu + mốc giờ của recent_score; lỗi ở chế độ SQL thì quay về pandas """
+    mode = kpi_mode()
+    # recent_score của bảng rủi ro phụ thuộc thời điểm tính -> mốc giờ nằm trong khóa memo (như get_machine_risk)
+    now = recency_as_of()
+    if mode == "sql":
+        try:
+            return derived_dataset("kpis:sql", REPAIR_DATASET, lambda: sql_kpis(now=now), args=now), "sql"
+        except Exception as e:
+            st.warning(f"⚠️ Không đọc được view KPI phía server, chuyển sang tính cục bộ: {e}")
+    return derived_dataset("kpis:pandas", REPAIR_DATASET, lambda: pandas_kpis(df, get_cube(df), now=now),
+                           source=df, args=now), "pandas"
+
+
+def check_parity(df_repair, df_machines, df):
+    """
+    Đối chiếu chế độ SQL (chạy trên LocalPostgrest với cùng dữ liệu thô) với chế độ pandas.
+    df là bảng đã ghép từ build_repair_frame(df_repair, df_machines).
+    """
+    local = LocalPostgrest(df_repair, df_machines)
+    return compare_kpis(pandas_kpis(df), sql_kpis(local))
+
+
+if __name__ == "__main__":
+    # Xuất file SQL để chạy trong Supabase SQL Editor: python -m services.kpi_service > sql/kpi_views.sql
+    print("-- Sinh tự động bởi services/kpi_service.py (render_views('postgres')). Không sửa tay.")
+    print("\n\n".join(render_views("postgres")))
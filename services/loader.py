@@ -0,0 +1,47 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from core.database import _is_transient
+
+# --- CẤU HÌNH TẢI SONG SONG ---
+DEFAULT_TIMEOUT = 20      # giây, cho cả nhóm truy vấn
+DEFAULT_RETRIES = 2       # số lần thử lại khi lỗi
+DEFAULT_BACKOFF = 0.5     # giây, nhân đôi sau mỗi lần thử lại
+MAX_WORKERS = 4
+
+# Pool dùng chung cho cả process để không tạo thread mới mỗi lần rerun
+_POOL = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="loader")
+
+
+class LoaderTimeout(Exception):
+    """ Truy vấn không hoàn thành trong thời gian cho phép """
+
+
+def with_retry(fn, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    """
+    Gọi fn(), thử lại tối đa `retries` lần với thời gian chờ tăng dần, chỉ với lỗi tạm thời (mạng, timeout, 5xx).
+    BackendUnavailable (client đã tự thử lại hoặc đang ngắt mạch) và lỗi nghiệp vụ được ném ra ngay.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries or not _is_transient(e):
+                raise
+            time.sleep(backoff * (2 ** attempt))
+
+
+def load_parallel(tasks, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    """
+    Chạy đồng thời các truy vấn độc lập {tên: hàm}, mỗi hàm có retry riêng.
+    Thời gian chờ ~ truy vấn chậm nhất thay vì tổng các truy vấn.
+    Trả về {tên: kết quả}; truy vấn lỗi hoặc quá hạn sẽ ném lỗi (LoaderTimeout cho quá hạn).
+    """
+    futures = {name: _POOL.submit(with_retry, fn, retries, backoff) for name, fn in tasks.items()}
+    done, not_done = wait(futures.values(), timeout=timeout)
+    results = {}
+    for name, fut in futures.items():
+        if fut in not_done:
+            fut.cancel()
+            raise LoaderTimeout(f"Truy vấn '{name}' quá {timeout}s")
+        results[name] = fut.result()
+    return results
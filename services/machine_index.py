@@ -0,0 +1,82 @@
+import threading
+import streamlit as st
+from core.database import supabase
+from services.sync_service import get_sync_engine
+
+
+def normalize_code(code):
+    return str(code).strip().upper()
+
+
+class MachineIndex:
+    """
+    Chỉ mục mã máy <-> UUID trong bộ nhớ process.
+    Nạp một lần từ snapshot của engine đồng bộ bảng machines, sau đó chỉ cập nhật theo delta.
+    get_or_create_many() xử lý nhiều mã trong tối đa một lần đồng bộ + một lần upsert.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.code_to_id = {}
+        self.id_to_code = {}
+        self._lock = threading.Lock()
+
+    def _db(self):
+        return self.engine.client or supabase
+
+    def _index_rows(self, rows):
+        for r in rows:
+            code = r.get("machine_code")
+            if code is None or r.get("id") is None:
+                continue
+            self.code_to_id[normalize_code(code)] = r["id"]
+            self.id_to_code[r["id"]] = code
+
+    def refresh(self):
+        """ Đồng bộ delta bảng machines và cập nhật chỉ mục khi có dòng mới """
+        with self._lock:
+            snapshot = self.engine.sync()
+            if self.engine.stats.get("rows_fetched") or len(self.code_to_id) != len(snapshot):
+                self.code_to_id.clear()
+                self.id_to_code.clear()
+                if not snapshot.empty:
+                    self._index_rows(snapshot[["id", "machine_code"]].to_dict("records"))
+
+    def get(self, code):
+        return self.code_to_id.get(normalize_code(code))
+
+    def code_of(self, machine_id):
+        return self.id_to_code.get(machine_id)
+
+    def get_or_create_many(self, codes, created=None):
+        """
+        Trả về {mã máy: UUID}; mã chưa có trong chỉ mục -> đồng bộ delta, còn thiếu -> tạo mới trong một lần upsert.
+        Nếu truyền list `created`, các mã vừa được tạo mới sẽ được thêm vào đó.
+        """
+        codes = sorted({normalize_code(c) for c in codes if c is not None and str(c).strip()})
+        missing = [c for c in codes if c not in self.code_to_id]
+        if missing:
+            # Chỉ mục chưa nạp hoặc máy vừa được tạo ở session/process khác -> đồng bộ delta rồi kiểm tra lại
+            self.refresh()
+            missing = [c for c in codes if c not in self.code_to_id]
+        if missing:
+            # upsert theo machine_code: session khác vừa tạo cùng mã thì nhận lại dòng đã có thay vì lỗi unique (23505)
+            rows = self._db().table("machines").upsert(
+                [{"machine_code": c} for c in missing], on_conflict="machine_code"
+            ).execute().data or []
+            with self._lock:
+                self._index_rows(rows)
+                # Đưa luôn vào snapshot để dataset ghép thấy máy mới mà không cần kéo lại
+                self.engine.apply_rows(rows, advance_watermark=False)
+            if created is not None:
+                created.extend(missing)
+        return {c: self.code_to_id.get(c) for c in codes}
+
+    def get_or_create(self, code, created=None):
+        return self.get_or_create_many([code], created=created).get(normalize_code(code))
+
+
+@st.cache_resource
+def get_machine_index():
+    """ Chỉ mục dùng chung cho cả process, dựa trên engine đồng bộ bảng machines """
+    return MachineIndex(get_sync_engine("machines"))
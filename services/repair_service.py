@@ -1,6 +1,12 @@
+import uuid
 import pandas as pd
 import streamlit as st
 from core.database import supabase
+from core.dataset_cache import get_dataset_cache, invalidate_dataset
+from core.metrics import span
+from services.sync_service import get_sync_engine
+from services.loader import load_parallel, with_retry
+from services.audit_writer import get_audit_writer
 
 # --- CẤU HÌNH HẰNG SỐ ---
 STATUS_OPTIONS = [
@@ -12,61 +18,172 @@ STATUS_OPTIONS = [
     "6. Đã trả chi nhánh"
 ]
 
-def get_repair_data():
+# Khóa của dataset đã ghép (repair_cases + machines) trong cache dùng chung
+REPAIR_DATASET = "repair_cases"
+REPAIR_TABLES = ("repair_cases", "machines")
+REPAIR_TTL = 30
+AUDIT_DATASET = "audit_logs"
+AUDIT_TTL = 15
+# Số ca tối đa trong một request cập nhật hàng loạt (giữ URL lọc id=in.(...) đủ ngắn cho PostgREST)
+BATCH_CHUNK = 200
+
+# Các cột lặp giá trị nhiều -> chuyển sang category để giảm bộ nhớ
+CATEGORY_COLUMNS = ['status', 'branch', 'origin_branch', 'machine_display']
+
+# Báo cáo bộ nhớ của lần chuẩn hóa gần nhất (bytes)
+LAST_MEMORY_REPORT = {}
+
+# Bảng ghép gần nhất: dùng lại nguyên object khi lần đồng bộ không có dòng nào thay đổi
+_LAST_FRAME = {}
+
+EMPTY_COLUMNS = [
+    'id', 'machine_id', 'machine_display', 'NĂM', 'THÁNG',
+    'CHI_PHÍ', 'branch', 'status', 'origin_branch',
+    'receiver_name', 'returner_name', 'confirmed_dt'
+]
+
+def build_repair_frame(df_repair, df_machines):
     """
-    Lấy dữ liệu từ bảng repair_cases, mapping với bảng machines.
-    Đảm bảo cột 'id' của ca sửa chữa luôn tồn tại để đối soát.
+    Ghép snapshot repair_cases với danh mục machines và tạo các cột phái sinh
+    (machine_display, confirmed_dt, NĂM, THÁNG, CHI_PHÍ).
     """
-    try:
-        # 1. Lấy dữ liệu sửa chữa
-        res_repair = supabase.table("repair_cases").select("*").order("created_at", desc=True).execute()
-        df_repair = pd.DataFrame(res_repair.data)
-
-        # 2. Lấy danh mục máy để mapping
-        res_machines = supabase.table("machines").select("id, machine_code").execute()
-        df_machines = pd.DataFrame(res_machines.data)
-
-        # XỬ LÝ KHI DỮ LIỆU TRỐNG: Trả về DF có sẵn cấu trúc cột để tránh lỗi KeyError: 'id'
-        if df_repair.empty:
-            return pd.DataFrame(columns=[
-                'id', 'machine_id', 'machine_display', 'NĂM', 'THÁNG', 
-                'CHI_PHÍ', 'branch', 'status', 'origin_branch', 
-                'receiver_name', 'returner_name', 'confirmed_dt'
-            ])
-
-        # 3. MAPPING & BẢO VỆ CỘT ID
-        # Chúng ta dùng suffixes để tránh việc cột id của repair_cases bị đổi tên thành id_x
-        df = df_repair.merge(
-            df_machines, 
-            left_on='machine_id', 
-            right_on='id', 
-            how='left', 
-            suffixes=('', '_machine') 
-        )
+    # XỬ LÝ KHI DỮ LIỆU TRỐNG: Trả về DF có sẵn cấu trúc cột để tránh lỗi KeyError: 'id'
+    if df_repair.empty:
+        return pd.DataFrame(columns=EMPTY_COLUMNS)
 
-        # 4. TẠO CỘT HIỂN THỊ
-        df['machine_display'] = df['machine_code'].fillna('N/A')
+    if df_machines.empty:
+        df_machines = pd.DataFrame(columns=['id', 'machine_code'])
 
-        # 5. XỬ LÝ THỜI GIAN
-        df['confirmed_dt'] = pd.to_datetime(df['confirmed_date'], errors='coerce')
-        df['confirmed_dt'] = df['confirmed_dt'].fillna(pd.to_datetime(df['created_at'], errors='coerce'))
-        
-        # Chỉ giữ lại các dòng có thời gian hợp lệ
-        df = df.dropna(subset=['confirmed_dt'])
+    # Giữ thứ tự mới nhất lên đầu như truy vấn cũ (order created_at desc)
+    if 'created_at' in df_repair.columns:
+        df_repair = df_repair.sort_values('created_at', ascending=False)
 
-        # Trích xuất Năm/Tháng
-        df['NĂM'] = df['confirmed_dt'].dt.year.astype(int)
-        df['THÁNG'] = df['confirmed_dt'].dt.month.astype(int)
-        
-        # 6. CHI PHÍ
-        # compensation có thể là None hoặc chuỗi, chuyển về numeric an toàn
-        df['CHI_PHÍ'] = pd.to_numeric(df.get('compensation', 0), errors='coerce').fillna(0)
+    # 3. MAPPING & BẢO VỆ CỘT ID
+    # Chúng ta dùng suffixes để tránh việc cột id của repair_cases bị đổi tên thành id_x
+    df = df_repair.merge(
+        df_machines[['id', 'machine_code']],
+        left_on='machine_id',
+        right_on='id',
+        how='left',
+        suffixes=('', '_machine')
+    )
+
+    # 4. TẠO CỘT HIỂN THỊ
+    df['machine_display'] = df['machine_code'].fillna('N/A')
+
+    # 5. XỬ LÝ THỜI GIAN
+    df['confirmed_dt'] = pd.to_datetime(df['confirmed_date'], errors='coerce')
+    df['confirmed_dt'] = df['confirmed_dt'].fillna(pd.to_datetime(df['created_at'], errors='coerce'))
+
+    # Chỉ giữ lại các dòng có thời gian hợp lệ
+    df = df.dropna(subset=['confirmed_dt'])
+
+    # Sắp xếp theo confirmed_dt giảm dần (ổn định -> cùng ngày vẫn giữ created_at desc)
+    # để services.time_index lọc khoảng thời gian bằng tìm nhị phân + cắt lát liên tục
+    df = df.sort_values('confirmed_dt', ascending=False, kind='mergesort').reset_index(drop=True)
+
+    # Trích xuất Năm/Tháng
+    df['NĂM'] = df['confirmed_dt'].dt.year.astype(int)
+    df['THÁNG'] = df['confirmed_dt'].dt.month.astype(int)
 
-        return df
+    # 6. CHI PHÍ
+    # compensation có thể là None hoặc chuỗi, chuyển về numeric an toàn
+    df['CHI_PHÍ'] = pd.to_numeric(df.get('compensation', 0), errors='coerce').fillna(0)
+
+    return df
+
+def compact_repair_frame(df):
+    """
+    Chuẩn hóa kiểu dữ liệu cho bảng đã ghép để giảm bộ nhớ:
+    category cho các cột lặp, NĂM/THÁNG dạng số nguyên nhỏ, CHI_PHÍ int64 (hoặc float32 nếu có số lẻ).
+    Trả về (df, report) với report là dung lượng trước/sau tính bằng bytes.
+    """
+    before = int(df.memory_usage(deep=True).sum())
+
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    if 'NĂM' in df.columns:
+        df['NĂM'] = df['NĂM'].astype('int16')
+    if 'THÁNG' in df.columns:
+        df['THÁNG'] = df['THÁNG'].astype('int8')
+
+    if 'CHI_PHÍ' in df.columns:
+        cost = df['CHI_PHÍ']
+        # Tiền VNĐ thường là số nguyên -> int64 giữ chính xác; chỉ dùng float32 khi có phần lẻ
+        if (cost % 1 == 0).all():
+            df['CHI_PHÍ'] = cost.astype('int64')
+        else:
+            df['CHI_PHÍ'] = cost.astype('float32')
+
+    after = int(df.memory_usage(deep=True).sum())
+    report = {
+        "rows": len(df),
+        "before_bytes": before,
+        "after_bytes": after,
+        "saved_pct": round((1 - after / before) * 100, 1) if before else 0.0,
+    }
+    return df, report
+
+def materialize_repair_frame(df_repair, df_machines):
+    """ Ghép + chuẩn hóa kiểu từ hai snapshot, ghi nhận báo cáo bộ nhớ và giữ làm bảng ghép gần nhất """
+    with span("load.merge"):
+        df = build_repair_frame(df_repair, df_machines)
+
+    # 3. Chuẩn hóa kiểu dữ liệu: một bản gọn duy nhất dùng chung cho mọi tab
+    with span("load.compact"):
+        df, report = compact_repair_frame(df)
+    LAST_MEMORY_REPORT.clear()
+    LAST_MEMORY_REPORT.update(report)
+    _LAST_FRAME["df"] = df
+    return df
+
+def _load_repair_data(engines=None):
+    # 1-2. Đồng bộ delta repair_cases và machines song song (hai truy vấn độc lập)
+    engines = engines or {t: get_sync_engine(t) for t in REPAIR_TABLES}
+    with span("load.sync"):
+        synced = load_parallel({t: e.sync for t, e in engines.items()})
+
+    # Không có thay đổi -> trả lại đúng DataFrame cũ, version dataset giữ nguyên, các kết quả memo vẫn dùng được
+    unchanged = not any(e.stats.get("rows_changed") for e in engines.values())
+    if unchanged and _LAST_FRAME.get("df") is not None:
+        return _LAST_FRAME["df"]
+
+    return materialize_repair_frame(synced["repair_cases"], synced["machines"])
+
+def get_memory_report():
+    """ Dung lượng bộ nhớ trước/sau chuẩn hóa của dataset dùng chung """
+    return dict(LAST_MEMORY_REPORT)
+
+def get_repair_data(ttl=REPAIR_TTL):
+    """
+    Lấy dữ liệu từ bảng repair_cases, mapping với bảng machines.
+    Đảm bảo cột 'id' của ca sửa chữa luôn tồn tại để đối soát.
+    Dữ liệu được đồng bộ tăng dần (delta theo watermark) qua services.sync_service
+    và materialize một lần trong cache dùng chung cho mọi session (TTL + version).
+    Các tab chỉ được đọc, không được sửa trực tiếp DataFrame trả về.
+    """
+    try:
+        with span("load.repair_data"):
+            return get_dataset_cache().get(REPAIR_DATASET, _load_repair_data, ttl=ttl)
     except Exception as e:
+        # Backend lỗi/ngắt mạch nhưng đã có bảng ghép trước đó -> vẫn phục vụ dữ liệu cũ
+        if _LAST_FRAME.get("df") is not None:
+            st.warning(f"⚠️ Không kết nối được máy chủ, đang hiển thị dữ liệu đã lưu gần nhất: {e}")
+            return _LAST_FRAME["df"]
         st.error(f"❌ Lỗi truy xuất dữ liệu: {e}")
         return pd.DataFrame()
 
+def get_audit_logs(limit=30):
+    """ Nhật ký audit mới nhất; dùng chung cache giữa các session, có retry khi lỗi mạng """
+    def _load():
+        res = with_retry(
+            lambda: supabase.table("audit_logs").select("*").order("created_at", desc=True).limit(limit).execute()
+        )
+        return pd.DataFrame(res.data or [])
+    return get_dataset_cache().get(f"{AUDIT_DATASET}:{limit}", _load, ttl=AUDIT_TTL)
+
 def insert_new_repair(data_dict):
     """ Thêm mới ca sửa chữa """
     try:
@@ -80,37 +197,100 @@ def insert_new_repair(data_dict):
             clean_data['status'] = "1. Chờ nhận"
             
         response = supabase.table("repair_cases").insert(clean_data).execute()
-        st.cache_data.clear()
+        invalidate_dataset(REPAIR_DATASET)
         return response
     except Exception as e:
         st.error(f"❌ Lỗi lưu dữ liệu: {str(e)}")
         return None
 
-def update_repair_tracking(case_id, new_status, staff_name, note=""):
-    """ Cập nhật trạng thái và nhân viên đối soát """
-    if not case_id:
-        st.error("❌ Không tìm thấy ID của ca sửa chữa để cập nhật!")
-        return None
-
+def _tracking_fields(new_status, staff_name, note, ts):
+    """ Các cột cần ghi khi chuyển trạng thái: người nhận/trả + mốc thời gian theo bước trong luồng """
     update_data = {
         "status": new_status,
         "note": note,
-        "updated_at": "now()"
+        "updated_at": ts
     }
-    
+
     # Logic xác nhận theo từ khóa trạng thái
     if "Đã nhận" in new_status or "2." in new_status:
         update_data["receiver_name"] = staff_name
-        update_data["received_at_warehouse"] = "now()" # Khớp với cột trong SQL mới của bạn
-        
+        update_data["received_at_warehouse"] = ts # Khớp với cột trong SQL mới của bạn
+
     elif "Đã trả" in new_status or "6." in new_status:
         update_data["returner_name"] = staff_name
-        update_data["returned_at_branch"] = "now()" # Khớp với cột trong SQL mới của bạn
+        update_data["returned_at_branch"] = ts # Khớp với cột trong SQL mới của bạn
+    return update_data
+
+def update_repair_tracking(case_id, new_status, staff_name, note=""):
+    """ Cập nhật trạng thái và nhân viên đối soát """
+    if not case_id:
+        st.error("❌ Không tìm thấy ID của ca sửa chữa để cập nhật!")
+        return None
+
+    update_data = _tracking_fields(new_status, staff_name, note, "now()")
 
     try:
         response = supabase.table("repair_cases").update(update_data).eq("id", case_id).execute()
-        st.cache_data.clear()
+        invalidate_dataset(REPAIR_DATASET)
         return response
     except Exception as e:
         st.error(f"❌ Lỗi cập nhật đối soát: {str(e)}")
         return None
+
+def update_repair_tracking_batch(case_ids, new_status, staff_name, note="", actor="admin@system", previous=None,
+                                 audit=None):
+    """
+    Chuyển trạng thái cho nhiều ca cùng lúc (vd. cả xe máy về kho tổng):
+    mỗi lô BATCH_CHUNK ca là một request update ... id=in.(...); thời điểm cập nhật lấy theo giờ server ("now()")
+    như update_repair_tracking để delta sync (watermark theo giờ server) không bỏ sót,
+    sau đó mỗi ca một sự kiện audit qua writer nền (cùng định dạng payload với các nguồn ghi khác).
+    previous: {case_id: trạng thái cũ} để lưu vào audit (không bắt buộc).
+    audit: AuditWriter (mặc định writer nền dùng chung của process); "audited" là số sự kiện đã đưa vào hàng đợi.
+    Trả về báo cáo {"requested", "updated", "missing", "audited", "batch_id", "error"},
+    hoặc None nếu không cập nhật được ca nào.
+    """
+    ids = list(dict.fromkeys(str(i) for i in case_ids if i))
+    if not ids:
+        st.error("❌ Chưa chọn ca sửa chữa nào để cập nhật!")
+        return None
+
+    update_data = _tracking_fields(new_status, staff_name, note, "now()")
+    batch_id = str(uuid.uuid4())
+    updated, updated_at, error = [], {}, None
+    try:
+        with span("write.status_batch", cases=len(ids)):
+            for i in range(0, len(ids), BATCH_CHUNK):
+                res = supabase.table("repair_cases").update(update_data).in_("id", ids[i:i + BATCH_CHUNK]).execute()
+                for row in res.data or []:
+                    updated.append(str(row["id"]))
+                    updated_at[str(row["id"])] = row.get("updated_at")
+    except Exception as e:
+        # Các lô trước đó đã được ghi -> vẫn ghi audit cho chúng bên dưới
+        error = str(e)
+        st.error(f"❌ Lỗi cập nhật hàng loạt (đã cập nhật {len(updated)}/{len(ids)} ca): {error}")
+    if not updated:
+        return None
+    invalidate_dataset(REPAIR_DATASET)
+
+    previous = previous or {}
+    audit = audit or get_audit_writer()
+    for case_id in updated:
+        audit.log("UPDATE_STATUS", "repair_cases", actor, payload={
+            "id": case_id,
+            "batch_id": batch_id,
+            "from": previous.get(case_id),
+            "to": new_status,
+            "staff": staff_name,
+            "note": note,
+            "at": updated_at.get(case_id),
+        }, source="batch")
+    audited = len(updated)
+
+    return {
+        "requested": len(ids),
+        "updated": len(updated),
+        "missing": sorted(set(ids) - set(updated)),
+        "audited": audited,
+        "batch_id": batch_id,
+        "error": error,
+    }
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+from core.dataset_cache import derived_dataset
+from services.repair_service import REPAIR_DATASET
+from services.aggregates import get_cube, rollup
+
+# --- CẤU HÌNH CHẤM ĐIỂM RỦI RO (dùng chung cho mọi tab) ---
+DEFAULT_WEIGHTS = {"freq": 0.5, "cost": 0.4, "recency": 0.1}
+RECENT_DAYS = 30          # Có ca trong 30 ngày gần nhất -> recent_score = 1
+HIGH_RISK = 0.75
+MEDIUM_RISK = 0.5
+EXPLAIN_THRESHOLD = 0.7   # Ngưỡng freq/cost score để đưa ra giải thích nguyên nhân
+RECENCY_REFRESH = "h"     # Mốc "hiện tại" của recent_score làm tròn theo giờ, nằm trong khóa cache
+
+RISK_LABELS = ["🔴 Cao", "🟠 Trung bình"]
+RISK_LABEL_LOW = "🟢 Thấp"
+
+EXPLANATIONS = [
+    "⚠️ Thiết bị lỗi lặp lại + chi phí cao",
+    "🔄 Tần suất hỏng bất thường",
+    "💰 Chi phí thay thế phụ tùng đắt đỏ",
+]
+EXPLANATION_OK = "✅ Vận hành ổn định"
+
+
+def _normalize(values):
+    """ Chia cho giá trị lớn nhất (tránh chia cho 0) """
+    arr = np.asarray(values, dtype="float64")
+    top = arr.max() if arr.size else 0.0
+    return arr / top if top > 0 else np.zeros_like(arr)
+
+
+def score_machines(stats, weights=None, now=None, cases_col='cases', cost_col='cost', last_col='last_case'):
+    """
+    Chấm điểm rủi ro dạng vector (NumPy) cho bảng thống kê thiết bị.
+    Thêm các cột: freq_score, cost_score, recent_score, risk_score, risk_label, explanation.
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    out = stats.copy()
+    if out.empty:
+        for col in ['freq_score', 'cost_score', 'recent_score', 'risk_score', 'risk_label', 'explanation']:
+            out[col] = pd.Series(dtype='object')
+        return out
+
+    freq = _normalize(out[cases_col])
+    cost = _normalize(out[cost_col])
+
+    if last_col in out.columns:
+        last = pd.to_datetime(out[last_col], errors='coerce', utc=True)
+        if now is None:
+            now = pd.Timestamp.now(tz='UTC')
+        recent = ((now - last).dt.days <= RECENT_DAYS).to_numpy(dtype='float64')
+    else:
+        recent = np.zeros(len(out))
+
+    score = np.round(weights["freq"] * freq + weights["cost"] * cost + weights["recency"] * recent, 2)
+
+    out['freq_score'] = freq
+    out['cost_score'] = cost
+    out['recent_score'] = recent.astype(int)
+    out['risk_score'] = score
+    out['risk_label'] = np.select([score >= HIGH_RISK, score >= MEDIUM_RISK], RISK_LABELS, RISK_LABEL_LOW)
+
+    hi_freq = freq > EXPLAIN_THRESHOLD
+    hi_cost = cost > EXPLAIN_THRESHOLD
+    out['explanation'] = np.select([hi_freq & hi_cost, hi_freq, hi_cost], EXPLANATIONS, EXPLANATION_OK)
+    return out
+
+
+def recency_as_of():
+    """ Mốc "hiện tại" cho recent_score, làm tròn theo RECENCY_REFRESH để dùng được làm khóa cache """
+    return pd.Timestamp.now(tz='UTC').floor(RECENCY_REFRESH)
+
+
+def get_machine_risk(df, by=('machine_display', 'branch'), weights=None):
+    """
+    Bảng rủi ro của toàn bộ dataset theo chiều `by`, cache theo dataset, bộ trọng số và mốc giờ hiện tại
+    (recent_score phụ thuộc thời điểm tính nên dữ liệu không đổi vẫn được chấm lại mỗi giờ).
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    name = f"machine_risk:{'|'.join(by)}:{sorted(weights.items())}"
+    now = recency_as_of()
+    return derived_dataset(
+        name,
+        REPAIR_DATASET,
+        lambda: score_machines(rollup(get_cube(df), list(by)), weights, now=now),
+        source=df,
+        args=now,
+    )
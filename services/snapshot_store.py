@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+import time
+import pandas as pd
+
+# Feather (Arrow IPC) cần pyarrow; không có thì vẫn chạy được, chỉ là không lưu snapshot xuống đĩa
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    pyarrow = None
+
+# --- CẤU HÌNH SNAPSHOT TRÊN ĐĨA ---
+SNAPSHOT_DIR = os.environ.get("KHO_SNAPSHOT_DIR", os.path.join(".cache", "snapshots"))
+SAVE_INTERVAL = 60      # giây, khoảng cách tối thiểu giữa hai lần ghi snapshot của cùng một bảng
+FORMAT_VERSION = 1      # tăng khi đổi cấu trúc file để bỏ qua snapshot cũ
+
+
+class SnapshotStore:
+    """
+    Lưu snapshot của một bảng xuống đĩa dạng Feather (Arrow IPC, không nén -> đọc bằng memory-map)
+    kèm file meta JSON chứa watermark. Snapshot và watermark luôn được ghi cùng nhau (ghi file tạm rồi
+    os.replace), nên khi khởi động lại chỉ cần kéo delta từ watermark đã lưu.
+    """
+
+    def __init__(self, table, directory=SNAPSHOT_DIR, save_interval=SAVE_INTERVAL):
+        self.table = table
+        self.directory = directory
+        self.save_interval = save_interval
+        self.data_path = os.path.join(directory, f"{table}.feather")
+        self.meta_path = os.path.join(directory, f"{table}.json")
+        self.last_saved = 0.0
+        self.stats = {"table": table, "loaded_rows": 0, "load_ms": 0.0, "saved_rows": 0, "save_ms": 0.0, "error": None}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return pyarrow is not None
+
+    def load(self):
+        """ Trả về (snapshot, watermark) đã lưu, hoặc (None, None) nếu chưa có / không đọc được """
+        if not self.enabled or not os.path.exists(self.meta_path) or not os.path.exists(self.data_path):
+            return None, None
+        t0 = time.perf_counter()
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("format_version") != FORMAT_VERSION:
+                return None, None
+            df = pd.read_feather(self.data_path, memory_map=True)
+        except Exception as e:
+            # File hỏng -> bỏ qua, lần sync tới kéo lại toàn bộ
+            self.stats["error"] = str(e)
+            return None, None
+        self.stats.update(loaded_rows=len(df), load_ms=round((time.perf_counter() - t0) * 1000, 1))
+        return df, meta.get("watermark")
+
+    def save(self, df, watermark, force=False):
+        """ Ghi snapshot + watermark; bỏ qua nếu vừa ghi trong save_interval giây (trừ khi force) """
+        if not self.enabled or df is None or df.empty:
+            return False
+        if not force and time.monotonic() - self.last_saved < self.save_interval:
+            return False
+        with self._lock:
+            t0 = time.perf_counter()
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                tmp_data, tmp_meta = f"{self.data_path}.tmp", f"{self.meta_path}.tmp"
+                # Cột object lẫn kiểu (chuỗi/None/số) -> chuẩn về chuỗi để Arrow ghi được
+                out = df.reset_index(drop=True)
+                for col in out.columns[out.dtypes == object]:
+                    out[col] = out[col].where(out[col].isna(), out[col].astype(str))
+                out.to_feather(tmp_data, compression="uncompressed")
+                with open(tmp_meta, "w", encoding="utf-8") as f:
+                    json.dump({
+                        "format_version": FORMAT_VERSION,
+                        "table": self.table,
+                        "watermark": watermark,
+                        "rows": len(out),
+                        "saved_at": pd.Timestamp.now(tz="UTC").isoformat(),
+                    }, f)
+                # Dữ liệu trước, meta sau: meta luôn trỏ tới một file dữ liệu đã ghi xong
+                os.replace(tmp_data, self.data_path)
+                os.replace(tmp_meta, self.meta_path)
+            except Exception as e:
+                self.stats["error"] = str(e)
+                return False
+            self.last_saved = time.monotonic()
+            self.stats.update(saved_rows=len(out), save_ms=round((time.perf_counter() - t0) * 1000, 1), error=None)
+            return True
+
+    def clear(self):
+        """ Xóa snapshot trên đĩa (dùng khi reset engine) """
+        for path in (self.data_path, self.meta_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
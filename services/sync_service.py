@@ -0,0 +1,175 @@
+import threading
+import time
+import pandas as pd
+import streamlit as st
+from core.database import fetch_dataframe
+from core.metrics import span
+from services.snapshot_store import SnapshotStore
+
+# --- CẤU HÌNH ĐỒNG BỘ THEO BẢNG ---
+# columns: chỉ lấy các cột mà các tab thực sự dùng (column projection)
+REPAIR_COLUMNS = ", ".join([
+    "id", "machine_id", "branch", "origin_branch", "status",
+    "customer_name", "issue_reason", "compensation", "note",
+    "confirmed_date", "created_at", "updated_at",
+    "receiver_name", "returner_name", "received_at_warehouse", "returned_at_branch",
+])
+
+# ts_columns: các cột thời gian dùng làm watermark (dòng nào mới hơn watermark sẽ được kéo về)
+SYNC_TABLES = {
+    "repair_cases": {"columns": REPAIR_COLUMNS, "ts_columns": ("updated_at", "created_at")},
+    "machines": {"columns": "id, machine_code, created_at", "ts_columns": ("created_at",)},
+}
+
+
+def _format_watermark(ts):
+    """ Định dạng watermark theo UTC, không dùng dấu '+' để an toàn khi đưa vào URL PostgREST """
+    return ts.tz_convert("UTC").strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class DeltaSync:
+    """
+    Giữ snapshot cục bộ của một bảng Supabase.
+    Lần đầu kéo toàn bộ, các lần sau chỉ kéo những dòng có updated_at/created_at
+    mới hơn watermark rồi upsert (theo khóa) vào snapshot.
+    Nếu có store (SnapshotStore), snapshot + watermark được khôi phục từ đĩa khi khởi tạo
+    và ghi lại sau các lần sync có thay đổi, nên cold start chỉ phải kéo delta.
+    Lưu ý: bản ghi bị xóa phía server không được phát hiện qua delta.
+    """
+
+    def __init__(self, table, columns="*", key="id", ts_columns=("updated_at", "created_at"), client=None, store=None):
+        self.table = table
+        self.columns = columns
+        self.key = key
+        self.ts_columns = tuple(ts_columns)
+        self.client = client
+        self.store = store
+        self.snapshot = pd.DataFrame()
+        self.watermark = None
+        self.stats = {
+            "table": table,
+            "mode": None,
+            "rows_fetched": 0,
+            "rows_changed": 0,
+            "rows_total": 0,
+            "elapsed_ms": 0.0,
+            "watermark": None,
+            "synced_at": None,
+        }
+        self._lock = threading.RLock()
+        self.restore()
+
+    def restore(self):
+        """ Nạp snapshot + watermark đã lưu trên đĩa (nếu có) """
+        if self.store is None:
+            return False
+        df, watermark = self.store.load()
+        if df is None or watermark is None:
+            return False
+        with self._lock:
+            self.snapshot, self.watermark = df, watermark
+            self.stats.update(mode="disk", rows_total=len(df), watermark=watermark)
+        return True
+
+    def persist(self, force=False):
+        """ Ghi snapshot + watermark hiện tại xuống đĩa (giãn cách theo save_interval của store) """
+        if self.store is None:
+            return False
+        with self._lock:
+            return self.store.save(self.snapshot, self.watermark, force=force)
+
+    def _apply_watermark(self, query):
+        # Dùng gte thay vì gt để không bỏ sót dòng ghi cùng thời điểm; upsert theo khóa nên kéo trùng không sao
+        cond = ",".join(f"{c}.gte.{self.watermark}" for c in self.ts_columns)
+        return query.or_(cond)
+
+    def _fetch_delta(self):
+        # Kéo theo trang (keyset) để không vượt giới hạn dòng của PostgREST
+        return fetch_dataframe(
+            self.table,
+            columns=self.columns,
+            key=self.key,
+            apply_filters=self._apply_watermark if self.watermark is not None else None,
+            client=self.client,
+        )
+
+    def _next_watermark(self, delta):
+        cols = [c for c in self.ts_columns if c in delta.columns]
+        if not cols:
+            return self.watermark
+        stamps = [pd.to_datetime(delta[c], errors="coerce", utc=True).max() for c in cols]
+        stamps = [s for s in stamps if pd.notna(s)]
+        if not stamps:
+            return self.watermark
+        return _format_watermark(max(stamps))
+
+    def _changed_rows(self, delta):
+        """ Bỏ các dòng đã có trong snapshot với cùng khóa + cùng giá trị cột thời gian (kéo lại do gte) """
+        cols = [self.key] + [c for c in self.ts_columns if c in delta.columns and c in self.snapshot.columns]
+        if self.snapshot.empty or len(cols) == 1:
+            return delta
+        seen = delta[cols].merge(self.snapshot[cols], how="left", indicator=True)["_merge"].to_numpy() == "both"
+        return delta[~seen]
+
+    def apply_rows(self, rows, advance_watermark=True):
+        """
+        Upsert các dòng (list dict hoặc DataFrame) vào snapshot theo khóa, trả về số dòng thực sự thay đổi.
+        Không có dòng nào thay đổi -> snapshot giữ nguyên (cùng object) để các tầng trên biết dữ liệu không đổi.
+        Với dòng do chính process vừa ghi, truyền advance_watermark=False để không bỏ sót
+        các dòng của nơi khác có thời gian nằm giữa watermark cũ và dòng vừa ghi.
+        """
+        delta = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+        if delta.empty:
+            return 0
+        with self._lock:
+            delta = self._changed_rows(delta)
+            if delta.empty:
+                return 0
+            if self.snapshot.empty:
+                merged = delta
+            else:
+                merged = pd.concat([self.snapshot, delta], ignore_index=True)
+            self.snapshot = merged.drop_duplicates(subset=[self.key], keep="last").reset_index(drop=True)
+            if advance_watermark:
+                self.watermark = self._next_watermark(delta)
+        return len(delta)
+
+    def sync(self):
+        """ Đồng bộ delta và trả về snapshot hiện tại """
+        with self._lock, span(f"sync.{self.table}"):
+            t0 = time.perf_counter()
+            mode = "full" if self.watermark is None else "delta"
+            delta = self._fetch_delta()
+            changed = self.apply_rows(delta)
+            self.stats = {
+                "table": self.table,
+                "mode": mode,
+                "rows_fetched": len(delta),
+                "rows_changed": changed,
+                "rows_total": len(self.snapshot),
+                "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+                "watermark": self.watermark,
+                "synced_at": pd.Timestamp.now(tz="UTC").isoformat(),
+            }
+            if changed:
+                self.persist()
+            return self.snapshot
+
+    def reset(self):
+        """ Xóa snapshot và watermark, lần sync sau sẽ kéo lại toàn bộ """
+        with self._lock:
+            self.snapshot = pd.DataFrame()
+            self.watermark = None
+            if self.store is not None:
+                self.store.clear()
+
+
+@st.cache_resource
+def get_sync_engine(table):
+    """ Một engine đồng bộ dùng chung cho cả process (mọi session) theo từng bảng, có snapshot trên đĩa """
+    return DeltaSync(table, store=SnapshotStore(table), **SYNC_TABLES.get(table, {}))
+
+
+def get_sync_stats():
+    """ Thống kê lần đồng bộ gần nhất của các bảng """
+    return {t: get_sync_engine(t).stats for t in SYNC_TABLES}
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from core.dataset_cache import derived_dataset
+from services.repair_service import REPAIR_DATASET
+
+
+def _to_utc_naive(values):
+    """ Chuẩn cột/giá trị thời gian về UTC không múi giờ (giá trị không có múi giờ được giữ nguyên) """
+    s = pd.to_datetime(values, utc=True)
+    return s.dt.tz_localize(None) if isinstance(s, pd.Series) else s.tz_localize(None)
+
+
+def month_range(year, month=None):
+    """ Khoảng [đầu kỳ, đầu kỳ kế tiếp) của một năm hoặc một tháng """
+    start = pd.Timestamp(year=int(year), month=int(month or 1), day=1)
+    end = start + (pd.DateOffset(months=1) if month else pd.DateOffset(years=1))
+    return start, end
+
+
+class TimeIndex:
+    """
+    Chỉ mục thời gian trên dataset dùng chung (đã sắp xếp confirmed_dt giảm dần, mới nhất lên đầu).
+    - Lọc theo khoảng thời gian = hai lần tìm nhị phân rồi cắt iloc liên tục (không tạo bản sao).
+    - Chỉ mục ghép (chi nhánh, thời gian): vị trí dòng của từng chi nhánh, cũng theo thời gian giảm dần,
+      nên lọc chi nhánh + khoảng thời gian chỉ gom đúng các dòng khớp.
+    """
+
+    def __init__(self, df):
+        times = _to_utc_naive(df['confirmed_dt'])
+        if not times.is_monotonic_decreasing:
+            # Dataset chưa sắp xếp (vd. nạp từ nơi khác) -> sắp một lần cho version này
+            df = df.sort_values('confirmed_dt', ascending=False, kind='mergesort')
+            times = _to_utc_naive(df['confirmed_dt'])
+        self.df = df
+        # Mảng tăng dần (view đảo ngược, không sao chép) để dùng searchsorted
+        self._asc = times.to_numpy(dtype='datetime64[ns]')[::-1]
+        self._n = len(df)
+        branch = df['branch'].astype(str).where(df['branch'].notna()) if 'branch' in df.columns else None
+        self._has_null_branch = bool(branch.isna().any()) if branch is not None else False
+        self._branch_pos = {}
+        self._branch_asc = {}
+        if branch is not None:
+            desc = self._asc[::-1]
+            # groupby().indices giữ thứ tự dòng -> vị trí mỗi chi nhánh vẫn theo thời gian giảm dần
+            for b, pos in branch.groupby(branch, sort=False).indices.items():
+                self._branch_pos[b] = pos
+                self._branch_asc[b] = desc[pos][::-1]
+        self.branches = sorted(self._branch_pos)
+
+    def _range(self, asc, start, end):
+        """ Vị trí [lo, hi) trong mảng tăng dần ứng với khoảng [start, end) """
+        lo = 0 if start is None else np.searchsorted(asc, _to_utc_naive(start).to_datetime64(), side='left')
+        hi = len(asc) if end is None else np.searchsorted(asc, _to_utc_naive(end).to_datetime64(), side='left')
+        return lo, hi
+
+    def bounds(self):
+        """ (ngày nhỏ nhất, ngày lớn nhất) của dataset """
+        if not self._n:
+            return None, None
+        return self.df['confirmed_dt'].iloc[-1], self.df['confirmed_dt'].iloc[0]
+
+    def slice(self, start=None, end=None):
+        """ Các dòng có start <= confirmed_dt < end, là lát cắt liên tục của dataset dùng chung """
+        lo, hi = self._range(self._asc, start, end)
+        return self.df.iloc[self._n - hi:self._n - lo]
+
+    def select(self, start=None, end=None, branches=None):
+        """ Lọc khoảng thời gian + danh sách chi nhánh; chọn đủ mọi chi nhánh thì vẫn là lát cắt không sao chép """
+        if branches is None:
+            return self.slice(start, end)
+        wanted = {str(b) for b in branches}
+        if not self._has_null_branch and wanted.issuperset(self._branch_pos):
+            return self.slice(start, end)
+        parts = []
+        for b in wanted:
+            pos = self._branch_pos.get(b)
+            if pos is None:
+                continue
+            lo, hi = self._range(self._branch_asc[b], start, end)
+            parts.append(pos[len(pos) - hi:len(pos) - lo])
+        if not parts:
+            return self.df.iloc[0:0]
+        return self.df.iloc[np.sort(np.concatenate(parts))]
+
+
+def get_time_index(df):
+    """ Chỉ mục thời gian của dataset dùng chung, dựng lại khi version dữ liệu thay đổi """
+    return derived_dataset("time_index", REPAIR_DATASET, lambda: TimeIndex(df), source=df)
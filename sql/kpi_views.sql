@@ -0,0 +1,39 @@
+-- Sinh tự động bởi services/kpi_service.py (render_views('postgres')). Không sửa tay.
+CREATE OR REPLACE VIEW kpi_repair_base AS
+SELECT r.id,
+       r.branch,
+       COALESCE(m.machine_code, 'N/A') AS machine_display,
+       COALESCE(CAST(r.confirmed_date AS timestamp), CAST(r.created_at AS timestamp)) AS confirmed_dt,
+       COALESCE(CAST(r.compensation AS numeric), 0) AS cost
+FROM repair_cases r
+LEFT JOIN machines m ON m.id = r.machine_id
+WHERE COALESCE(CAST(r.confirmed_date AS timestamp), CAST(r.created_at AS timestamp)) IS NOT NULL;
+
+CREATE OR REPLACE VIEW kpi_overview AS
+SELECT COUNT(*) AS total_cases,
+       COALESCE(SUM(cost), 0) AS total_cost,
+       COUNT(DISTINCT machine_display) AS unique_machines,
+       (SELECT COUNT(*) FROM (
+            SELECT machine_display FROM kpi_repair_base GROUP BY machine_display HAVING COUNT(*) > 1
+        ) t) AS repeat_machines,
+       COUNT(DISTINCT branch) AS branch_count
+FROM kpi_repair_base;
+
+CREATE OR REPLACE VIEW kpi_monthly_trend AS
+SELECT CAST(EXTRACT(YEAR FROM confirmed_dt) AS integer) AS nam, CAST(EXTRACT(MONTH FROM confirmed_dt) AS integer) AS thang, COUNT(*) AS cases, SUM(cost) AS cost,
+       CAST(EXTRACT(YEAR FROM confirmed_dt) AS integer) * 100 + CAST(EXTRACT(MONTH FROM confirmed_dt) AS integer) AS row_key
+FROM kpi_repair_base
+GROUP BY CAST(EXTRACT(YEAR FROM confirmed_dt) AS integer), CAST(EXTRACT(MONTH FROM confirmed_dt) AS integer);
+
+CREATE OR REPLACE VIEW kpi_branch_summary AS
+SELECT branch, COUNT(*) AS total_cases, SUM(cost) AS total_cost, AVG(cost) AS avg_cost
+FROM kpi_repair_base
+WHERE branch IS NOT NULL
+GROUP BY branch;
+
+CREATE OR REPLACE VIEW kpi_machine_branch AS
+SELECT machine_display, branch, COUNT(*) AS cases, SUM(cost) AS cost, MAX(confirmed_dt) AS last_case,
+       machine_display || '|' || branch AS row_key
+FROM kpi_repair_base
+WHERE branch IS NOT NULL
+GROUP BY machine_display, branch;
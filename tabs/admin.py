@@ -1,9 +1,13 @@
+import re
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 from datetime import datetime
-from core.database import supabase
-from services.repair_service import insert_new_repair, update_repair_tracking, STATUS_OPTIONS
+from core.dataset_cache import invalidate_dataset
+from services.aggregates import get_cube, filter_cube, rollup
+from services.import_service import import_repairs
+from services.machine_index import get_machine_index
+from services.repair_service import insert_new_repair, update_repair_tracking, update_repair_tracking_batch, get_audit_logs, STATUS_OPTIONS, REPAIR_DATASET
 
 def render_status_management(df):
     """
@@ -24,13 +28,20 @@ def render_status_management(df):
         st.success("✅ Hệ thống sạch sẽ! Tất cả thiết bị đã được hoàn trả chi nhánh.")
         return
 
+    mode = st.radio("Chế độ cập nhật", ["Từng máy", "Hàng loạt (cả lô / xe hàng)"], horizontal=True, key="status_mode")
+    if mode == "Từng máy":
+        _render_single_update(active_cases)
+    else:
+        _render_batch_update(active_cases)
+
+def _render_single_update(active_cases):
     # Giao diện chọn thiết bị thông minh
     col_sel, col_info = st.columns([1, 1.5])
     
     with col_sel:
         selected_code = st.selectbox(
             "🔍 Tìm mã máy / Quét mã:", 
-            active_cases['machine_display'].unique(),
+            active_cases['machine_display'].unique().tolist(),
             help="Hệ thống tự động lọc các máy đang nằm tại kho tổng hoặc NCC"
         )
         
@@ -74,9 +85,94 @@ def render_status_management(df):
                     res = update_repair_tracking(case_info['id'], new_st, staff, note)
                     if res:
                         st.toast(f"✅ Đã cập nhật máy {selected_code} thành công!")
-                        st.cache_data.clear()
                         st.rerun()
 
+def _parse_codes(text):
+    """ Danh sách mã máy dán/quét vào (ngăn cách bởi xuống dòng, dấu phẩy, chấm phẩy hoặc khoảng trắng) """
+    return list(dict.fromkeys(c.strip().upper() for c in re.split(r"[\s,;]+", text or "") if c.strip()))
+
+def _render_batch_update(active_cases):
+    """ Chuyển trạng thái cho nhiều máy trong một lần ghi (update theo lô, audit qua writer nền) """
+    codes_all = active_cases['machine_display'].astype(str)
+
+    # Kết quả lần cập nhật trước (đặt trước khi vẽ widget): chỉ giữ lại các mã còn ca chưa cập nhật được
+    pending = st.session_state.pop("batch_pending", None)
+    if pending is not None:
+        st.session_state["batch_codes"] = pending["codes"]
+        st.session_state["batch_scan"] = "\n".join(pending["scan"])
+        for level, msg in pending["messages"]:
+            getattr(st, level)(msg)
+
+    c_pick, c_scan = st.columns([1, 1])
+    with c_pick:
+        status_filter = st.selectbox(
+            "Lọc theo trạng thái hiện tại:", ["Tất cả"] + STATUS_OPTIONS[:-1], key="batch_status_filter"
+        )
+        pool = active_cases if status_filter == "Tất cả" else active_cases[active_cases['status'] == status_filter]
+        options = sorted(pool['machine_display'].astype(str).unique())
+        # Mã đã chọn không còn trong danh sách (đổi bộ lọc, ca vừa được cập nhật) -> bỏ khỏi lựa chọn
+        if "batch_codes" in st.session_state:
+            st.session_state["batch_codes"] = [c for c in st.session_state["batch_codes"] if c in options]
+        picked = st.multiselect("🔍 Chọn mã máy:", options, key="batch_codes")
+    with c_scan:
+        scanned = _parse_codes(st.text_area(
+            "📷 Hoặc quét / dán danh sách mã máy:", key="batch_scan", height=120,
+            placeholder="Mỗi dòng một mã (máy quét mã vạch tự xuống dòng)",
+        ))
+
+    codes = list(dict.fromkeys(picked + scanned))
+    if not codes:
+        st.info("Chọn hoặc quét ít nhất một mã máy để cập nhật hàng loạt.")
+        return
+
+    # Một máy có thể có nhiều ca đang mở -> cập nhật tất cả các ca đang mở của máy đó
+    selected = active_cases[codes_all.isin(codes)]
+    if status_filter != "Tất cả":
+        selected = selected[selected['status'] == status_filter]
+    unknown = sorted(set(codes) - set(selected['machine_display'].astype(str)))
+    if unknown:
+        st.warning(f"⚠️ {len(unknown)} mã không có ca đang xử lý (phù hợp bộ lọc): {', '.join(unknown)}")
+    if selected.empty:
+        return
+
+    preview_cols = [c for c in ['machine_display', 'status', 'origin_branch', 'customer_name', 'receiver_name'] if c in selected.columns]
+    st.caption(f"{len(selected)} ca / {selected['machine_display'].nunique()} máy sẽ được cập nhật")
+    st.dataframe(selected[preview_cols], use_container_width=True, hide_index=True)
+
+    with st.form("f_batch_status"):
+        f_st, f_staff = st.columns([1, 1])
+        new_st = f_st.selectbox("Trạng thái mới:", STATUS_OPTIONS, index=1)
+        staff = f_staff.text_input("Nhân viên thực hiện:", placeholder="Tên thợ / Điều phối...")
+        note = st.text_area("Ghi chú chung cho cả lô:", placeholder="Ví dụ: Xe hàng từ CN Đà Nẵng ngày ...")
+        submitted = st.form_submit_button(f"💾 Cập nhật {len(selected)} ca", type="primary", use_container_width=True)
+
+    if submitted:
+        if not staff:
+            st.warning("⚠️ Vui lòng nhập tên nhân viên để đảm bảo tính Audit Log!")
+            return
+        actor = (st.session_state.get("user_info") or {}).get("username", "admin@system")
+        previous = dict(zip(selected['id'].astype(str), selected['status'].astype(str)))
+        with st.spinner(f"Đang cập nhật {len(selected)} ca..."):
+            report = update_repair_tracking_batch(
+                selected['id'].tolist(), new_st, staff, note, actor=actor, previous=previous
+            )
+        if report and report['updated']:
+            # Các ca đã cập nhật đã được ghi (dataset đã invalidate): tải lại bảng và chỉ giữ các máy còn ca lỗi/thiếu
+            missing = set(report['missing'])
+            keep = set(selected.loc[selected['id'].astype(str).isin(missing), 'machine_display'].astype(str))
+            messages = [("toast", f"✅ Đã cập nhật {report['updated']} ca sang '{new_st}'!")]
+            if missing:
+                messages.append(("warning", f"⚠️ {len(missing)} ca không được cập nhật (có thể đã bị xóa/đổi hoặc lỗi kết nối), "
+                                            f"các máy tương ứng vẫn được chọn để thử lại."))
+            if report['error'] is not None:
+                messages.append(("error", f"❌ Lỗi cập nhật hàng loạt: {report['error']}"))
+            st.session_state["batch_pending"] = {
+                "codes": [c for c in picked if c in keep],
+                "scan": [c for c in scanned if c in keep],
+                "messages": messages,
+            }
+            st.rerun()
+
 def render_admin_panel(df_db):
     st.title("📥 Quản Trị & Điều Hành Hệ Thống")
 
@@ -98,8 +194,30 @@ def render_admin_panel(df_db):
                 df_up = pd.read_csv(up_file)
                 st.dataframe(df_up.head(5), use_container_width=True)
                 if st.button("🚀 Thực hiện Batch Import", use_container_width=True):
-                    st.warning("Tính năng đang kiểm tra cấu trúc file...")
-                    st.cache_data.clear()
+                    progress = st.progress(0.0, text="Đang kiểm tra cấu trúc file...")
+                    actor = (st.session_state.get("user_info") or {}).get("username", "admin@system")
+                    try:
+                        report = import_repairs(
+                            df_up,
+                            actor=actor,
+                            on_progress=lambda done, total: progress.progress(
+                                done / total if total else 1.0, text=f"Đã ghi {done}/{total} dòng"
+                            ),
+                        )
+                    except ValueError as e:
+                        st.error(f"❌ {e}")
+                    else:
+                        invalidate_dataset(REPAIR_DATASET)
+                        st.success(
+                            f"✅ Đã import {report['inserted']}/{report['valid_rows']} dòng hợp lệ "
+                            f"trong {report['elapsed_s']}s ({report['rows_per_s']} dòng/s)"
+                        )
+                        if report['invalid_rows']:
+                            st.warning(f"⚠️ Bỏ qua {report['invalid_rows']} dòng không hợp lệ:")
+                            st.dataframe(report['errors'], use_container_width=True, hide_index=True)
+                        if report['failed_chunks']:
+                            st.error(f"❌ {len(report['failed_chunks'])}/{report['chunks']} lô ghi thất bại:")
+                            st.dataframe(pd.DataFrame(report['failed_chunks']), use_container_width=True, hide_index=True)
 
         with c_man:
             st.subheader("✍️ Nhập ca đơn lẻ")
@@ -122,8 +240,7 @@ def render_admin_panel(df_db):
                         with st.spinner("Đang khởi tạo ca sửa chữa..."):
                             m_code = m_code_raw.strip().upper()
                             # 1. Xử lý logic Máy (Machines)
-                            res_m = supabase.table("machines").select("id").eq("machine_code", m_code).execute()
-                            m_uuid = res_m.data[0]['id'] if res_m.data else supabase.table("machines").insert({"machine_code": m_code}).execute().data[0]['id']
+                            m_uuid = get_machine_index().get_or_create(m_code)
 
                             # 2. Tạo record hoàn chỉnh
                             new_record = {
@@ -140,7 +257,6 @@ def render_admin_panel(df_db):
                             
                             if insert_new_repair(new_record):
                                 st.success(f"✅ Đã khởi tạo thành công ca sửa chữa cho máy {m_code}!")
-                                st.cache_data.clear()
                                 st.rerun()
 
     # --- SUB-TAB 2: ĐỐI SOÁT ---
@@ -153,15 +269,18 @@ def render_admin_panel(df_db):
         if df_db.empty:
             st.info("Chưa có dữ liệu vùng miền.")
         else:
-            sel_b = st.selectbox("Chọn chi nhánh:", sorted(df_db["branch"].unique()))
-            df_b = df_db[df_db["branch"] == sel_b]
+            cube = get_cube(df_db)
+            sel_b = st.selectbox("Chọn chi nhánh:", sorted(cube["branch"].dropna().unique()))
+            cube_b = filter_cube(cube, branches=[sel_b])
             
             v1, v2 = st.columns([1, 1])
             with v1:
-                summary = df_b.groupby("machine_display").agg(
-                    ca=("id", "count"),
-                    phi=("CHI_PHÍ", "sum")
-                ).sort_values("ca", ascending=False).reset_index()
+                summary = (
+                    rollup(cube_b, "machine_display")
+                    .rename(columns={"cases": "ca", "cost": "phi"})[["machine_display", "ca", "phi"]]
+                    .sort_values("ca", ascending=False)
+                    .reset_index(drop=True)
+                )
                 st.write(f"Báo cáo chi tiết: {sel_b}")
                 st.dataframe(summary, use_container_width=True, hide_index=True)
             with v2:
@@ -172,11 +291,13 @@ def render_admin_panel(df_db):
     # --- SUB-TAB 4: AUDIT LOG ---
     with ad_sub4:
         st.subheader("📜 Nhật ký hệ thống (Audit Logs)")
-        try:
-            res_audit = supabase.table("audit_logs").select("*").order("created_at", desc=True).limit(30).execute()
-            if res_audit.data:
-                st.dataframe(pd.DataFrame(res_audit.data), use_container_width=True)
-            else:
-                st.info("Nhật ký đang trống.")
-        except:
-            st.caption("Yêu cầu bảng 'audit_logs' để kích hoạt tính năng này.")
+        # Chỉ truy vấn khi người dùng mở nhật ký (st.tabs vẫn chạy code của tab ẩn)
+        if st.toggle("Hiển thị nhật ký", key="show_audit_logs"):
+            try:
+                df_audit = get_audit_logs(limit=30)
+                if not df_audit.empty:
+                    st.dataframe(df_audit, use_container_width=True)
+                else:
+                    st.info("Nhật ký đang trống.")
+            except:
+                st.caption("Yêu cầu bảng 'audit_logs' để kích hoạt tính năng này.")
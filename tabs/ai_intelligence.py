@@ -1,6 +1,13 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+from services.aggregates import get_cube, rollup
+from services.forecast import get_branch_forecasts
+from services.risk import get_machine_risk, HIGH_RISK, MEDIUM_RISK
+
+FORECAST_METHODS = {"holt": "Làm trơn hàm mũ (Holt)", "seasonal_naive": "Cùng kỳ năm trước"}
 
 def render_ai_intelligence(df_db):
     st.title("🧠 AI Decision Intelligence")
@@ -11,6 +18,9 @@ def render_ai_intelligence(df_db):
         st.warning("⚠️ Hệ thống AI cần tối thiểu 10 ca sửa chữa để xây dựng mô hình phân tích chính xác.")
         return
 
+    # Các phân tích bên dưới đọc từ cube tổng hợp thay vì groupby lại toàn bộ dữ liệu
+    cube = get_cube(df_db)
+
     # Khởi tạo Tabs bên trong
     ai_risk, ai_root, ai_action, ai_forecast = st.tabs([
         "🚨 RỦI RO", "🔍 NGUYÊN NHÂN GỐC", "🧩 KHUYẾN NGHỊ", "📈 DỰ BÁO"
@@ -19,18 +29,16 @@ def render_ai_intelligence(df_db):
     # 1. AI Phân tích rủi ro
     with ai_risk:
         st.subheader("🚨 Phân tích mức độ rủi ro Chi nhánh")
-        risk_branch = df_db.groupby('branch').agg(
-            total_cases=('id', 'count'),
-            total_cost=('CHI_PHÍ', 'sum'),
-            avg_cost=('CHI_PHÍ', 'mean')
-        ).reset_index()
+        risk_branch = rollup(cube, 'branch').rename(
+            columns={'cases': 'total_cases', 'cost': 'total_cost'}
+        )[['branch', 'total_cases', 'total_cost', 'avg_cost']]
 
         cost_mean = risk_branch['avg_cost'].mean()
         cost_std = risk_branch['avg_cost'].std()
         
         # Gán nhãn rủi ro bằng logic thống kê
-        risk_branch['risk_level'] = risk_branch['avg_cost'].apply(
-            lambda x: "CAO" if x > cost_mean + (0.5 * cost_std) else "BÌNH THƯỜNG"
+        risk_branch['risk_level'] = np.where(
+            risk_branch['avg_cost'] > cost_mean + (0.5 * cost_std), "CAO", "BÌNH THƯỜNG"
         )
         
         # Trực quan hóa rủi ro
@@ -44,24 +52,10 @@ def render_ai_intelligence(df_db):
     # 2. AI Nguyên nhân gốc
     with ai_root:
         st.subheader("🔍 Phân tích nguyên nhân gốc (Root Cause)")
-        machine_stats = df_db.groupby(['machine_display', 'branch']).agg(
-            total_cases=('id', 'count'),
-            total_cost=('CHI_PHÍ', 'sum'),
-            avg_cost=('CHI_PHÍ', 'mean')
-        ).reset_index()
-
-        # Chuẩn hóa score để tính Risk
-        machine_stats['freq_score'] = machine_stats['total_cases'] / machine_stats['total_cases'].max()
-        machine_stats['cost_score'] = machine_stats['total_cost'] / machine_stats['total_cost'].max()
-        machine_stats['risk_score'] = (0.6 * machine_stats['freq_score'] + 0.4 * machine_stats['cost_score']).round(2)
-
-        def explain_root(row):
-            if row['freq_score'] > 0.7 and row['cost_score'] > 0.7: return "⚠️ Thiết bị lỗi lặp lại + chi phí cao"
-            if row['freq_score'] > 0.7: return "🔄 Tần suất hỏng bất thường"
-            if row['cost_score'] > 0.7: return "💰 Chi phí thay thế phụ tùng đắt đỏ"
-            return "✅ Vận hành ổn định"
-
-        machine_stats['Giải thích'] = machine_stats.apply(explain_root, axis=1)
+        # Điểm rủi ro + giải thích tính vector hóa, cache theo version dữ liệu (services.risk)
+        machine_stats = get_machine_risk(df_db).rename(
+            columns={'cases': 'total_cases', 'cost': 'total_cost', 'explanation': 'Giải thích'}
+        )
         
         st.dataframe(
             machine_stats.sort_values('risk_score', ascending=False)
@@ -72,45 +66,56 @@ def render_ai_intelligence(df_db):
     # 3. AI Khuyến nghị
     with ai_action:
         st.subheader("🧩 Khuyến nghị hành động dành cho Quản lý")
-        recommendations = []
-        for _, r in machine_stats.iterrows():
-            if r['risk_score'] >= 0.75:
-                recommendations.append({
-                    "Đối tượng": r['machine_display'], 
-                    "Chi nhánh": r['branch'], 
-                    "Khuyến nghị": "🚩 THAY THẾ MỚI", 
-                    "Lý do": "Vượt ngưỡng rủi ro kinh tế"
-                })
-            elif r['risk_score'] >= 0.50:
-                recommendations.append({
-                    "Đối tượng": r['machine_display'], 
-                    "Chi nhánh": r['branch'], 
-                    "Khuyến nghị": "🔧 BẢO TRÌ CHUYÊN SÂU", 
-                    "Lý do": "Dấu hiệu xuống cấp nhanh"
-                })
+        actionable = machine_stats[machine_stats['risk_score'] >= MEDIUM_RISK]
+        is_high = actionable['risk_score'] >= HIGH_RISK
+        recommendations = pd.DataFrame({
+            "Đối tượng": actionable['machine_display'],
+            "Chi nhánh": actionable['branch'],
+            "Khuyến nghị": np.where(is_high, "🚩 THAY THẾ MỚI", "🔧 BẢO TRÌ CHUYÊN SÂU"),
+            "Lý do": np.where(is_high, "Vượt ngưỡng rủi ro kinh tế", "Dấu hiệu xuống cấp nhanh"),
+        })
         
-        if recommendations:
-            st.table(pd.DataFrame(recommendations))
+        if not recommendations.empty:
+            st.table(recommendations.reset_index(drop=True))
         else:
             st.success("✅ Không có thiết bị nào cần can thiệp khẩn cấp.")
 
     # 4. AI Dự báo
     with ai_forecast:
         st.subheader("📈 Dự báo chi phí vận hành tháng tới")
-        forecast_results = []
-        for b in df_db['branch'].unique():
-            df_b = df_db[df_db['branch'] == b]
-            # Gom nhóm theo tháng/năm
-            monthly = df_b.groupby(['NĂM', 'THÁNG'])['CHI_PHÍ'].sum()
-            if len(monthly) >= 2:
-                # Dự báo đơn giản: (Tháng cuối * 0.7) + (Trung bình * 0.3)
-                forecast_value = (monthly.iloc[-1] * 0.7) + (monthly.mean() * 0.3)
-                forecast_results.append({"branch": b, "val": forecast_value})
+        # Mô hình của mọi chi nhánh được fit một lần cho mỗi version dữ liệu (services.forecast)
+        forecasts = get_branch_forecasts(df_db)
         
-        if forecast_results:
-            cols = st.columns(len(forecast_results))
-            for i, r in enumerate(forecast_results):
-                with cols[i]:
-                    st.metric(f"Dự báo: {r['branch']}", f"{r['val']:,.0f} đ")
+        if not forecasts.empty:
+            next_month = forecasts[forecasts['step'] == 1]
+            st.dataframe(
+                next_month.assign(method=next_month['method'].map(FORECAST_METHODS))
+                [['branch', 'forecast', 'lower', 'upper', 'last_actual', 'method']],
+                column_config={
+                    "branch": "Chi nhánh",
+                    "forecast": st.column_config.NumberColumn("Dự báo", format="%d đ"),
+                    "lower": st.column_config.NumberColumn("Cận dưới (95%)", format="%d đ"),
+                    "upper": st.column_config.NumberColumn("Cận trên (95%)", format="%d đ"),
+                    "last_actual": st.column_config.NumberColumn("Tháng gần nhất", format="%d đ"),
+                    "method": "Phương pháp",
+                },
+                use_container_width=True, hide_index=True
+            )
+
+            b_pick = st.selectbox("Xem chi tiết chi nhánh", next_month['branch'].tolist(), key="forecast_branch")
+            hist = rollup(cube[cube['branch'] == b_pick], ['NĂM', 'THÁNG'])
+            fc = forecasts[forecasts['branch'] == b_pick]
+            hist_x = hist['THÁNG'].astype(str) + "/" + hist['NĂM'].astype(str)
+            fc_x = fc['THÁNG'].astype(str) + "/" + fc['NĂM'].astype(str)
+
+            fig_fc = go.Figure()
+            fig_fc.add_trace(go.Scatter(x=hist_x, y=hist['cost'], name='Thực tế', line=dict(color='#1f77b4')))
+            fig_fc.add_trace(go.Scatter(x=fc_x, y=fc['upper'], line=dict(width=0), showlegend=False, hoverinfo='skip'))
+            fig_fc.add_trace(go.Scatter(x=fc_x, y=fc['lower'], name='Khoảng tin cậy 95%', fill='tonexty',
+                                        line=dict(width=0), fillcolor='rgba(239,85,59,0.2)'))
+            fig_fc.add_trace(go.Scatter(x=fc_x, y=fc['forecast'], name='Dự báo', line=dict(color='#EF553B', dash='dash')))
+            fig_fc.update_layout(yaxis=dict(title='Chi phí (đ)'), legend=dict(orientation='h', y=1.1),
+                                 margin=dict(l=20, r=20, t=40, b=20))
+            st.plotly_chart(fig_fc, use_container_width=True)
         else:
             st.info("Chưa đủ dữ liệu lịch sử theo tháng để AI thực hiện dự báo.")
@@ -1,5 +1,55 @@
+import math
 import streamlit as st
 import pandas as pd
+from core.dataset_cache import memoize_by_version
+from services.aggregates import get_cube
+from services.anomaly import get_anomalies, Z_THRESHOLD
+from services.repair_service import REPAIR_DATASET
+
+# --- CẤU HÌNH DANH SÁCH CẢNH BÁO ---
+PAGE_SIZES = [10, 20, 50, 100]
+SLA_SORTS = {"Số ngày tồn": "sla_by_days", "Chi phí": "sla_by_cost"}
+SLA_COLUMNS = ['machine_display', 'ngay_ton', 'status', 'origin_branch', 'customer_name', 'issue_reason', 'CHI_PHÍ', 'id']
+ANOMALY_COLUMNS = ['machine_display', 'branch', 'CHI_PHÍ', 'baseline', 'ratio', 'z_score', 'issue_reason', 'note']
+SLA_DAYS = 7
+# Mốc thời gian tính số ngày tồn được làm tròn theo giờ và đưa vào khóa memo:
+# dữ liệu không đổi thì danh sách SLA vẫn được tính lại mỗi giờ (ca vừa quá 7 ngày sẽ xuất hiện)
+SLA_REFRESH = "h"
+
+def sla_as_of():
+    return pd.Timestamp.now(tz='UTC').floor(SLA_REFRESH)
+
+@memoize_by_version(REPAIR_DATASET)
+def compute_alerts(df_db, now=None):
+    # 1. Tính số ngày tồn (SLA) tại mốc `now` (mặc định: giờ hiện tại, làm tròn theo SLA_REFRESH)
+    # df_db là DataFrame dùng chung giữa các session -> dùng assign() để không ghi đè lên bản gốc
+    now = sla_as_of() if now is None else now
+    df_alert = df_db.assign(ngay_ton=(now - pd.to_datetime(df_db['created_at'], utc=True)).dt.days)
+    
+    # 2. Lọc các ca chậm tiến độ (Ví dụ > 7 ngày và chưa trả máy)
+    sla_violation = df_alert[(df_alert['status'] != "6. Đã trả chi nhánh") & (df_alert['ngay_ton'] > SLA_DAYS)]
+    
+    # 3. Máy lỗi lặp lại (chi phí bất thường do services.anomaly chấm điểm tăng dần)
+    cube = get_cube(df_db)
+    machine_counts = cube.groupby('machine_display', observed=True)['cases'].sum()
+    return {
+        'sla_violation': sla_violation,
+        # Sắp xếp sẵn theo từng tiêu chí để mỗi lần đổi trang chỉ cần cắt iloc
+        'sla_by_days': sla_violation.sort_values(['ngay_ton', 'CHI_PHÍ'], ascending=False),
+        'sla_by_cost': sla_violation.sort_values(['CHI_PHÍ', 'ngay_ton'], ascending=False),
+        'machine_counts': machine_counts,
+        'repeat_issues': int((machine_counts > 2).sum()),
+    }
+
+def _page_window(total, key):
+    """ Điều khiển phân trang, trả về (start, end) của cửa sổ đang xem """
+    c_size, c_page, c_info = st.columns([1, 1, 2])
+    size = c_size.selectbox("Số dòng / trang", PAGE_SIZES, index=1, key=f"{key}_page_size")
+    pages = max(1, math.ceil(total / size))
+    page = c_page.number_input("Trang", min_value=1, max_value=pages, value=1, step=1, key=f"{key}_page")
+    c_info.caption(f"Trang {page}/{pages} · {total} ca")
+    start = (int(page) - 1) * size
+    return start, start + size
 
 def render_alerts(df_db):
     st.markdown("""
@@ -25,17 +75,13 @@ def render_alerts(df_db):
         return
 
     # --- TÍNH TOÁN LOGIC (BACKEND) ---
-    # 1. Tính số ngày tồn (SLA)
-    now = pd.Timestamp.now(tz='UTC')
-    df_db['created_at_dt'] = pd.to_datetime(df_db['created_at'])
-    df_db['ngay_ton'] = (now - df_db['created_at_dt']).dt.days
-    
-    # 2. Lọc các ca chậm tiến độ (Ví dụ > 7 ngày và chưa trả máy)
-    sla_violation = df_db[(df_db['status'] != "6. Đã trả chi nhánh") & (df_db['ngay_ton'] > 7)]
-    
-    # 3. Lọc chi phí cao và máy lỗi lặp lại
-    high_cost_cases = df_db[df_db['CHI_PHÍ'] > 5000000]
-    repeat_issues = df_db.groupby('machine_display').filter(lambda x: len(x) > 2)['machine_display'].nunique()
+    # Memo theo dataset + mốc giờ: chỉ tính lại khi dữ liệu thay đổi hoặc sang giờ mới
+    alerts = compute_alerts(df_db, sla_as_of())
+    sla_violation = alerts['sla_violation']
+    # Chi phí bất thường so với baseline của chính máy/chi nhánh (đã xếp hạng theo z-score)
+    anomalies = get_anomalies(df_db)
+    machine_counts = alerts['machine_counts']
+    repeat_issues = alerts['repeat_issues']
 
     # --- CHỈ SỐ NHANH ---
     st.subheader("Chỉ số rủi ro vận hành")
@@ -43,7 +89,7 @@ def render_alerts(df_db):
     with m1:
         st.markdown(f"<div class='apple-card'><p style='color:gray;'>Chậm tiến độ</p><h2 class='critical-text'>{len(sla_violation)}</h2><p>Ca quá 7 ngày</p></div>", unsafe_allow_html=True)
     with m2:
-        st.markdown(f"<div class='apple-card'><p style='color:gray;'>Chi phí cao</p><h2 class='warning-text'>{len(high_cost_cases)}</h2><p>Ca > 5 Triệu</p></div>", unsafe_allow_html=True)
+        st.markdown(f"<div class='apple-card'><p style='color:gray;'>Chi phí bất thường</p><h2 class='warning-text'>{len(anomalies)}</h2><p>Ca vượt baseline máy/chi nhánh</p></div>", unsafe_allow_html=True)
     with m3:
         st.markdown(f"<div class='apple-card'><p style='color:gray;'>Lặp lỗi</p><h2 class='warning-text'>{repeat_issues}</h2><p>Máy hỏng > 2 lần</p></div>", unsafe_allow_html=True)
 
@@ -51,36 +97,66 @@ def render_alerts(df_db):
     st.divider()
     st.subheader("⚠️ Cảnh báo tồn kho quá hạn (SLA)")
     if not sla_violation.empty:
-        for _, row in sla_violation.iterrows():
-            with st.expander(f"🕒 {row['machine_display']} - Đã ngâm {row['ngay_ton']} ngày"):
-                c1, c2 = st.columns(2)
-                c1.write(f"**Trạng thái hiện tại:** {row['status']}")
-                c1.write(f"**Chi nhánh gốc:** {row['origin_branch']}")
-                c2.write(f"**Khách hàng:** {row['customer_name']}")
-                c2.write(f"**Lý do:** {row['issue_reason']}")
-                if st.button("Hối thúc xử lý", key=f"sla_{row['id']}"):
-                    st.toast(f"Đã gửi yêu cầu ưu tiên cho máy {row['machine_display']}")
+        sort_by = st.radio("Sắp xếp theo", list(SLA_SORTS), horizontal=True, key="sla_sort")
+        start, end = _page_window(len(sla_violation), key="sla")
+        # Danh sách đã được sắp xếp sẵn (memo theo version), chỉ cắt đúng cửa sổ đang xem
+        window = alerts[SLA_SORTS[sort_by]].iloc[start:end]
+
+        picked = st.data_editor(
+            window[SLA_COLUMNS].assign(chon=False),
+            column_config={
+                "chon": st.column_config.CheckboxColumn("Chọn"),
+                "machine_display": "Mã máy",
+                "ngay_ton": st.column_config.NumberColumn("Số ngày tồn", format="%d ngày"),
+                "status": "Trạng thái hiện tại",
+                "origin_branch": "Chi nhánh gốc",
+                "customer_name": "Khách hàng",
+                "issue_reason": "Lý do",
+                "CHI_PHÍ": st.column_config.NumberColumn("Chi phí", format="%d đ"),
+                "id": None,
+            },
+            disabled=SLA_COLUMNS,
+            hide_index=True,
+            use_container_width=True,
+            key=f"sla_editor_{sort_by}_{start}"
+        )
+        selected = picked[picked['chon']]
+
+        # Hối thúc hàng loạt: một nút cho tất cả các ca đã chọn thay vì một nút mỗi ca
+        if st.button(f"⚡ Hối thúc xử lý ({len(selected)} ca đã chọn)", disabled=selected.empty):
+            codes = ", ".join(selected['machine_display'].astype(str).unique())
+            st.toast(f"Đã gửi yêu cầu ưu tiên cho {len(selected)} ca: {codes}")
     else:
         st.success("Không có ca nào bị chậm tiến độ.")
 
     # --- PHẦN 2: CHI PHÍ BẤT THƯỜNG (CỦA BẠN) ---
     st.divider()
     st.subheader("💰 Chi phí bất thường (Anomaly Detection)")
-    mean_cost = df_db['CHI_PHÍ'].mean()
-    anomalies = df_db[df_db['CHI_PHÍ'] > mean_cost * 2]
-    
+    st.caption(f"So với trung vị chi phí của cùng máy/chi nhánh (robust z-score > {Z_THRESHOLD})")
+
     if not anomalies.empty:
-        for _, row in anomalies.iterrows():
-            with st.expander(f"🔴 {row['machine_display']} - {row['CHI_PHÍ']:,.0f}đ (Gấp {row['CHI_PHÍ']/mean_cost:.1f} lần TB)"):
-                st.write(f"**Lý do hỏng:** {row['issue_reason']}")
-                st.write(f"**Ghi chú:** {row['note'] if row['note'] else 'Không có'}")
+        start, end = _page_window(len(anomalies), key="anomaly")
+        st.dataframe(
+            anomalies.iloc[start:end][ANOMALY_COLUMNS],
+            column_config={
+                "machine_display": "Mã máy",
+                "branch": "Chi nhánh",
+                "CHI_PHÍ": st.column_config.NumberColumn("Chi phí", format="%d đ"),
+                "baseline": st.column_config.NumberColumn("Trung vị nhóm", format="%d đ"),
+                "ratio": st.column_config.NumberColumn("Gấp (lần trung vị)", format="%.1f"),
+                "z_score": st.column_config.NumberColumn("Điểm bất thường", format="%.1f"),
+                "issue_reason": "Lý do hỏng",
+                "note": "Ghi chú",
+            },
+            hide_index=True,
+            use_container_width=True
+        )
     else:
         st.info("Chưa ghi nhận chi phí bất thường.")
 
     # --- PHẦN 3: THEO DÕI THIẾT BỊ RỦI RO (CỦA BẠN) ---
     st.divider()
     st.subheader("🛠️ Theo dõi thiết bị hỏng lặp lại")
-    machine_counts = df_db['machine_display'].value_counts()
     risky_machines = machine_counts[machine_counts >= 2].index.tolist()
 
     if risky_machines:
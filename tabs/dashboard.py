@@ -1,6 +1,50 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+from core.dataset_cache import dataset_version
+from core.result_cache import get_result_cache
+from services.aggregates import get_cube, build_cube, filter_cube, rollup, machine_rollup
+from services.repair_service import REPAIR_DATASET
+from services.risk import recency_as_of, score_machines
+from services.time_index import get_time_index, month_range
+
+def compute_view(cube, t_index, f_mode, year, month, t_start, t_end, branches, now=None):
+    """
+    Các chỉ số của dashboard cho một tổ hợp bộ lọc (KPI, xu hướng, xếp hạng rủi ro, nhiệt theo chi nhánh).
+    now: mốc tính recent_score (services.risk.recency_as_of), cũng là một phần khóa cache kết quả.
+    """
+    if f_mode == "Tháng / Năm":
+        cube_view = filter_cube(cube, year=year, month=month)
+    elif t_start is not None:
+        # Khoảng ngày không khớp độ mịn tháng của cube -> dựng cube nhỏ cho phần đã lọc
+        cube_view = build_cube(t_index.slice(t_start, t_end))
+    else:
+        cube_view = cube
+    if branches is not None:
+        cube_view = filter_cube(cube_view, branches=list(branches))
+
+    cases_by_branch = cube_view.groupby('branch', observed=True)['cases'].sum()
+    cases_by_machine = cube_view.groupby('machine_display', observed=True)['cases'].sum()
+
+    trend = rollup(cube_view, ['NĂM', 'THÁNG']).rename(columns={'cases': 'so_ca', 'cost': 'chi_phi'})
+    trend = trend.sort_values(['NĂM', 'THÁNG'])
+    trend['Tháng/Năm'] = trend['THÁNG'].astype(str) + "/" + trend['NĂM'].astype(str)
+
+    # Điểm rủi ro dùng chung công thức/trọng số với các tab khác (services.risk)
+    risk_df = score_machines(
+        machine_rollup(cube_view).drop(columns=['cost_max', 'avg_cost']), now=now
+    ).rename(columns={'cases': 'so_ca', 'cost': 'tong_chi_phi', 'risk_label': 'mức_rủi_ro'})
+
+    return {
+        'total_cost': cube_view['cost'].sum(),
+        'total_cases': int(cube_view['cases'].sum()),
+        # Xử lý trường hợp không có dữ liệu để tránh lỗi idxmax()
+        'hot_branch': cases_by_branch.idxmax() if not cases_by_branch.empty else "N/A",
+        'risky_machine': cases_by_machine.idxmax() if not cases_by_machine.empty else "N/A",
+        'trend': trend,
+        'risk_top': risk_df.sort_values('risk_score', ascending=False).head(10),
+        'heat': risk_df.groupby('branch', observed=True)['risk_score'].mean().reset_index(),
+    }
 
 def render_dashboard(df):
     # 1. KIỂM TRA DỮ LIỆU ĐẦU VÀO
@@ -20,41 +64,41 @@ def render_dashboard(df):
             st.error("❌ Dữ liệu lỗi: Thiếu cột 'NĂM'. Vui lòng kiểm tra lại hàm xử lý dữ liệu.")
             return # Thoát hàm sớm để không chạy dòng 22 gây lỗi sập app
 
+        # Cube tổng hợp dựng một lần cho mỗi version dữ liệu, các bộ lọc chỉ cắt trên cube
+        cube = get_cube(df)
+        # Chỉ mục thời gian: lọc ngày/tháng bằng tìm nhị phân, không quét mask trên toàn bộ dữ liệu
+        t_index = get_time_index(df)
+
         # ... (các phần code còn lại giữ nguyên)
         f_mode = st.radio("Chế độ lọc thời gian", ["Tháng / Năm", "Khoảng ngày"])
 
         if f_mode == "Tháng / Năm":
             # Lấy danh sách Năm và Tháng từ dữ liệu
-            y_list = sorted(df['NĂM'].dropna().unique().astype(int), reverse=True)
+            y_list = sorted(cube['NĂM'].dropna().unique().astype(int), reverse=True)
             sel_y = st.selectbox("Năm", y_list)
 
-            m_list = sorted(df[df['NĂM'] == sel_y]['THÁNG'].dropna().unique().astype(int))
+            m_list = sorted(cube[cube['NĂM'] == sel_y]['THÁNG'].dropna().unique().astype(int))
             sel_m = st.selectbox("Tháng", ["Tất cả"] + list(m_list))
 
-            df_view = df[df['NĂM'] == sel_y].copy()
-            if sel_m != "Tất cả":
-                df_view = df_view[df_view['THÁNG'] == sel_m]
+            sel_m = None if sel_m == "Tất cả" else int(sel_m)
+            t_start, t_end = month_range(sel_y, sel_m)
         else:
             # Lọc theo khoảng ngày
-            min_date = df['confirmed_dt'].min().date()
-            max_date = df['confirmed_dt'].max().date()
-            d_range = st.date_input("Chọn khoảng ngày", [min_date, max_date])
-            
-            if isinstance(d_range, list) and len(d_range) == 2:
-                df_view = df[
-                    (df['confirmed_dt'].dt.date >= d_range[0]) &
-                    (df['confirmed_dt'].dt.date <= d_range[1])
-                ].copy()
+            min_dt, max_dt = t_index.bounds()
+            d_range = st.date_input("Chọn khoảng ngày", [min_dt.date(), max_dt.date()])
+            sel_y, sel_m = None, None
+
+            if isinstance(d_range, (list, tuple)) and len(d_range) == 2:
+                # Hết ngày cuối: cận trên là 0h ngày kế tiếp (khoảng nửa mở)
+                t_start, t_end = pd.Timestamp(d_range[0]), pd.Timestamp(d_range[1]) + pd.Timedelta(days=1)
             else:
-                df_view = df.copy()
+                t_start, t_end = None, None
 
         st.divider()
 
         # --- BỘ LỌC CHI NHÁNH (Fixed logic) ---
-        if 'branch' in df.columns:
-            available_branches = sorted([str(x) for x in df['branch'].dropna().unique()])
-        else:
-            available_branches = []
+        available_branches = t_index.branches
+        sel_branch = None
 
         if available_branches:
             sel_branch = st.multiselect(
@@ -63,10 +107,27 @@ def render_dashboard(df):
                 default=available_branches,
                 help="Chọn một hoặc nhiều chi nhánh để xem báo cáo"
             )
-            df_view = df_view[df_view['branch'].isin(sel_branch)]
         else:
             st.warning("⚠️ Không tìm thấy cột Chi nhánh.")
 
+        # Lát cắt (thời gian, chi nhánh) qua chỉ mục ghép; chọn đủ chi nhánh thì không sao chép dữ liệu
+        df_view = t_index.select(t_start, t_end, branches=sel_branch)
+
+        # Kết quả theo (version dữ liệu, mốc giờ recency, bộ lọc) trong cache LRU dùng chung: đổi qua lại các bộ lọc cũ là tức thì
+        branches_key = tuple(sorted(sel_branch)) if sel_branch is not None else None
+        # Version của đúng frame đang hiển thị; frame đã cũ (None) thì tính trực tiếp, không ghi vào cache
+        version = dataset_version(REPAIR_DATASET, df)
+        view_cache = get_result_cache("dashboard")
+        now = recency_as_of()
+        build_view = lambda: compute_view(cube, t_index, f_mode, sel_y, sel_m, t_start, t_end, branches_key, now)
+        if version is None:
+            view = build_view()
+        else:
+            key = (version, now, f_mode, sel_y, sel_m, t_start, t_end, branches_key)
+            view = view_cache.get_or_compute(key, build_view)
+        vc = view_cache.stats()
+        st.caption(f"⚡ Cache bộ lọc: {vc['hits']} hit / {vc['misses']} miss · {vc['entries']} mục")
+
     # 3. KIỂM TRA SAU KHI LỌC
     if df_view.empty:
         st.warning("⚠️ Không có dữ liệu phù hợp với bộ lọc bạn chọn. Vui lòng điều chỉnh lại thời gian hoặc chi nhánh.")
@@ -77,35 +138,19 @@ def render_dashboard(df):
     st.markdown("### 🚀 Chỉ số tổng quan")
     k1, k2, k3, k4 = st.columns(4)
     
-    # Tính toán các giá trị KPI
-    total_cost = df_view['CHI_PHÍ'].sum()
-    total_cases = len(df_view)
-    
-    # Xử lý trường hợp không có dữ liệu để tránh lỗi idxmax()
-    hot_branch = df_view['branch'].value_counts().idxmax() if not df_view['branch'].empty else "N/A"
-    risky_machine = df_view['machine_display'].value_counts().idxmax() if not df_view['machine_display'].empty else "N/A"
-
-    k1.metric("💰 Tổng chi phí", f"{total_cost:,.0f} đ")
-    k2.metric("🛠️ Tổng số ca", f"{total_cases} ca")
-    k3.metric("🏢 Chi nhánh HOT", hot_branch)
-    k4.metric("⚠️ Máy rủi ro nhất", risky_machine)
+    # Các giá trị KPI (từ cube, qua cache kết quả)
+    k1.metric("💰 Tổng chi phí", f"{view['total_cost']:,.0f} đ")
+    k2.metric("🛠️ Tổng số ca", f"{view['total_cases']} ca")
+    k3.metric("🏢 Chi nhánh HOT", view['hot_branch'])
+    k4.metric("⚠️ Máy rủi ro nhất", view['risky_machine'])
 
     st.divider()
 
     # 5. ---------- TREND ANALYSIS ----------
     st.subheader("📈 Xu hướng sự cố theo thời gian")
-    trend = (
-        df_view.groupby(['NĂM', 'THÁNG'])
-        .agg(so_ca=('id', 'count'), chi_phi=('CHI_PHÍ', 'sum'))
-        .reset_index()
-    )
-    # Sắp xếp và tạo label
-    trend = trend.sort_values(['NĂM', 'THÁNG'])
-    trend['Tháng/Năm'] = trend['THÁNG'].astype(str) + "/" + trend['NĂM'].astype(str)
-    
     # Biểu đồ kết hợp (Line + Area)
     fig_trend = px.area(
-        trend, x='Tháng/Năm', y='so_ca', 
+        view['trend'], x='Tháng/Năm', y='so_ca', 
         markers=True, 
         title="Biểu đồ tần suất sự cố",
         labels={'so_ca': 'Số ca', 'Tháng/Năm': 'Thời gian'},
@@ -120,39 +165,9 @@ def render_dashboard(df):
 
     with c_left:
         st.subheader("⚠️ Xếp hạng rủi ro thiết bị")
-        today = pd.Timestamp.now()
-        risk_df = (
-            df_view.groupby('machine_display')
-            .agg(
-                so_ca=('id', 'count'),
-                tong_chi_phi=('CHI_PHÍ', 'sum'),
-                last_case=('confirmed_dt', 'max'),
-                branch=('branch', 'first')
-            )
-            .reset_index()
-        )
-
-        # Tính toán Risk Score
-        if not risk_df.empty:
-            max_ca = risk_df['so_ca'].max() if risk_df['so_ca'].max() != 0 else 1
-            max_cost = risk_df['tong_chi_phi'].max() if risk_df['tong_chi_phi'].max() != 0 else 1
-            
-            risk_df['freq_score'] = risk_df['so_ca'] / max_ca
-            risk_df['cost_score'] = risk_df['tong_chi_phi'] / max_cost
-            risk_df['recent_score'] = ((today - risk_df['last_case']).dt.days <= 30).astype(int)
-            
-            # Trọng số Score
-            risk_df['risk_score'] = (0.5 * risk_df['freq_score'] + 0.4 * risk_df['cost_score'] + 0.1 * risk_df['recent_score']).round(2)
-
-            def risk_label(v):
-                if v >= 0.75: return "🔴 Cao"
-                elif v >= 0.5: return "🟠 Trung bình"
-                return "🟢 Thấp"
-
-            risk_df['mức_rủi_ro'] = risk_df['risk_score'].apply(risk_label)
-            
+        if not view['risk_top'].empty:
             st.dataframe(
-                risk_df.sort_values('risk_score', ascending=False).head(10), 
+                view['risk_top'], 
                 column_config={
                     "machine_display": "Mã thiết bị",
                     "so_ca": "Số ca",
@@ -166,9 +181,8 @@ def render_dashboard(df):
 
     with c_right:
         st.subheader("🔥 Rủi ro theo Chi nhánh")
-        heat = risk_df.groupby('branch')['risk_score'].mean().reset_index()
         fig_heat = px.bar(
-            heat, x='risk_score', y='branch', 
+            view['heat'], x='risk_score', y='branch', 
             orientation='h',
             color='risk_score', color_continuous_scale='Reds',
             labels={'risk_score': 'Điểm rủi ro TB'}
@@ -182,7 +196,7 @@ def render_dashboard(df):
     # Filter selection
     sel_machine = st.selectbox("Chọn mã máy để tra cứu lịch sử:", sorted(df_view['machine_display'].unique()))
     
-    df_machine = df_view[df_view['machine_display'] == sel_machine].copy()
+    df_machine = df_view[df_view['machine_display'] == sel_machine]
     
     # Hiển thị thông tin máy
     m_col1, m_col2 = st.columns(2)
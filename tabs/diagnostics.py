@@ -0,0 +1,47 @@
+import streamlit as st
+import pandas as pd
+from core.database import supabase
+from core.metrics import RECORDER
+from core.result_cache import get_result_cache
+from services.audit_writer import get_audit_writer
+
+ADMIN_ROLES = ("Admin",)
+
+def render_diagnostics(user_info):
+    """ Bảng chẩn đoán hiệu năng, chỉ hiển thị cho Admin """
+    if not user_info or user_info.get('role') not in ADMIN_ROLES:
+        return
+
+    with st.expander("🩺 Chẩn đoán hiệu năng"):
+        st.caption("Thời gian theo stage (mẫu gần nhất của cả process)")
+        st.dataframe(RECORDER.summary(), use_container_width=True, hide_index=True)
+
+        spans = RECORDER.rerun_spans()
+        if spans:
+            st.caption("Các bước của lần tải trang này")
+            df_spans = pd.DataFrame(spans)
+            df_spans['stage'] = ["  " * d + s for d, s in zip(df_spans['depth'], df_spans['stage'])]
+            st.dataframe(df_spans[['stage', 'ms']], use_container_width=True, hide_index=True)
+
+        db = supabase.stats
+        vc = get_result_cache("dashboard").stats()
+        if supabase.kind == "sqlite":
+            st.caption(
+                f"💾 SQLite cục bộ ({supabase.path}): {db['calls']} lệnh, {db['failures']} lỗi, "
+                f"{db['rows_read']} dòng đọc, {db['rows_written']} dòng ghi"
+            )
+        else:
+            st.caption(
+                f"🔌 Supabase: {db['calls']} lệnh, {db['retries']} thử lại, {db['failures']} lỗi, "
+                f"{db['stale_served']} trả dữ liệu cũ · mạch: {supabase.breaker.state}"
+            )
+        st.caption(f"⚡ Cache bộ lọc: {vc['hit_rate']}% hit · {vc['entries']} mục · {vc['bytes'] / 1e6:.1f} MB")
+        au = get_audit_writer().snapshot()
+        st.caption(
+            f"📝 Audit nền: {au['depth']} chờ ghi · {au['written']} đã ghi ({au['flushes']} lô, "
+            f"lô gần nhất {au['last_flush_ms']} ms) · {au['spilled']} tràn đĩa, {au['spill_files']} file chờ gửi lại · "
+            f"{au['dead_lettered']} bị từ chối ({au['dead_letter_files']} file dead letter)"
+        )
+
+        if st.button("Xóa số liệu đo", key="diag_reset"):
+            RECORDER.reset()
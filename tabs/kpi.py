@@ -2,6 +2,8 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from services.kpi_service import get_kpis
+from services.duckdb_engine import analytics_engine
 
 def render_kpi_dashboard(df_db):
     st.title("🎯 Performance Management – KPI Dashboard")
@@ -11,6 +13,12 @@ def render_kpi_dashboard(df_db):
         st.warning("⚠️ Chưa có dữ liệu để tính toán KPI")
         return
 
+    # Chỉ số tính từ cube tổng hợp (pandas/DuckDB) hoặc đọc từ view kpi_* phía server (KPI_MODE = "sql"),
+    # memo theo version dữ liệu
+    kpis, mode = get_kpis(df_db)
+    overview = kpis['overview']
+    st.caption(f"Nguồn KPI: {'view SQL (Supabase)' if mode == 'sql' else f'{analytics_engine()} (cục bộ)'}")
+
     # --- KHỞI TẠO CÁC SUB-TABS TRONG KPI ---
     k_tab1, k_tab2, k_tab3 = st.tabs(["📊 Tổng quan Hệ thống", "🏢 Hiệu suất Chi nhánh", "⚠️ Phân tích Rủi ro"])
 
@@ -19,23 +27,15 @@ def render_kpi_dashboard(df_db):
     # ---------------------------------------------------------
     with k_tab1:
         k1, k2, k3, k4 = st.columns(4)
-        total_cases = len(df_db)
-        avg_cost_val = df_db['CHI_PHÍ'].mean()
-        
-        unique_m = df_db['machine_display'].nunique()
-        repeat_m = (df_db.groupby('machine_display').size() > 1).sum()
-        repeat_rate = (repeat_m / unique_m) * 100 if unique_m > 0 else 0
+        avg_cost_val = overview['avg_cost']
 
-        k1.metric("🛠️ Tổng số ca", f"{total_cases} ca")
+        k1.metric("🛠️ Tổng số ca", f"{overview['total_cases']} ca")
         k2.metric("💰 Chi phí TB / ca", f"{avg_cost_val:,.0f} đ")
-        k3.metric("♻️ Tỷ lệ máy lặp lỗi", f"{repeat_rate:.1f}%")
-        k4.metric("🏢 Số chi nhánh", df_db['branch'].nunique())
+        k3.metric("♻️ Tỷ lệ máy lặp lỗi", f"{overview['repeat_rate']:.1f}%")
+        k4.metric("🏢 Số chi nhánh", overview['branch_count'])
 
         st.subheader("📈 Diễn biến vận hành")
-        trend = df_db.groupby(['NĂM', 'THÁNG']).agg(
-            cases=('id', 'count'),
-            cost=('CHI_PHÍ', 'sum')
-        ).reset_index()
+        trend = kpis['trend'].copy()
         trend['period'] = trend['THÁNG'].astype(str) + "/" + trend['NĂM'].astype(str)
         
         fig_trend = go.Figure()
@@ -55,11 +55,7 @@ def render_kpi_dashboard(df_db):
     # ---------------------------------------------------------
     with k_tab2:
         st.subheader("🏢 So sánh chi phí trung bình")
-        branch_kpi = df_db.groupby('branch').agg(
-            total_cases=('id', 'count'),
-            total_cost=('CHI_PHÍ', 'sum'),
-            avg_cost=('CHI_PHÍ', 'mean')
-        ).reset_index()
+        branch_kpi = kpis['branch']
 
         col_b1, col_b2 = st.columns([6, 4])
         with col_b1:
@@ -90,16 +86,10 @@ def render_kpi_dashboard(df_db):
     # ---------------------------------------------------------
     with k_tab3:
         st.subheader("🚨 Top 10 Thiết bị rủi ro cao")
-        machine_kpi = df_db.groupby(['machine_display', 'branch']).agg(
-            cases=('id', 'count'),
-            cost=('CHI_PHÍ', 'sum')
-        ).reset_index()
+        machine_kpi = kpis['machine_risk']
 
         if not machine_kpi.empty:
-            max_c = machine_kpi['cases'].max() if machine_kpi['cases'].max() > 0 else 1
-            max_s = machine_kpi['cost'].max() if machine_kpi['cost'].max() > 0 else 1
-            
-            machine_kpi['risk_score'] = (0.6 * (machine_kpi['cases']/max_c) + 0.4 * (machine_kpi['cost']/max_s)).round(2)
-            
-            top_risk = machine_kpi.sort_values('risk_score', ascending=False).head(10)
+            top_risk = machine_kpi.nlargest(10, 'risk_score')[
+                ['machine_display', 'branch', 'cases', 'cost', 'risk_score', 'risk_label']
+            ]
             st.table(top_risk)
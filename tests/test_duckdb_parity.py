@@ -0,0 +1,25 @@
+import pytest
+from bench.synthetic import generate
+from services.repair_service import build_repair_frame, compact_repair_frame
+
+pytest.importorskip("duckdb")
+from services.duckdb_engine import check_parity  # noqa: E402
+
+
+def _dataset(n_cases):
+    tables = generate(n_cases)
+    df, _ = compact_repair_frame(build_repair_frame(tables["repair_cases"], tables["machines"]))
+    return df
+
+
+@pytest.mark.parametrize("n_cases", [10_000, 100_000])
+def test_duckdb_matches_pandas(n_cases):
+    assert check_parity(_dataset(n_cases)) == []
+
+
+def test_duckdb_matches_pandas_with_missing_values():
+    df = _dataset(10_000).copy()
+    # Chi nhánh thiếu và chi phí lẻ: NULL trong khóa nhóm và tổng số thực
+    df.loc[df.index[::50], "branch"] = None
+    df["CHI_PHÍ"] = df["CHI_PHÍ"] + 0.25
+    assert check_parity(df) == []
@@ -0,0 +1,45 @@
+import pandas as pd
+from core.storage import SQLiteBackend
+from services.import_service import import_repairs
+from services.machine_index import MachineIndex
+from services.sync_service import SYNC_TABLES, DeltaSync
+
+
+class _Audit:
+    def __init__(self):
+        self.events = []
+
+    def log(self, action, table_name, actor, payload=None, source=None):
+        self.events.append((action, payload))
+
+
+def _csv(ids, codes):
+    return pd.DataFrame({
+        "id": ids,
+        "machine_code": codes,
+        "branch": "Hà Nội",
+        "customer_name": "Khách",
+        "confirmed_date": "2024-05-01",
+        "issue_reason": "Hỏng nguồn",
+        "compensation": 100_000,
+    })
+
+
+def test_import_chunk_with_and_without_ids():
+    db = SQLiteBackend(":memory:")
+    index = MachineIndex(DeltaSync("machines", client=db, **SYNC_TABLES["machines"]))
+    first = import_repairs(_csv([None, None], ["M1", "M2"]), client=db, machine_index=index, audit=_Audit())
+    assert first["inserted"] == 2 and not first["failed_chunks"]
+    existing = db.table("repair_cases").select("id").execute().data
+
+    # Một chunk lẫn dòng nhập lại (có id) và dòng mới (không có id)
+    audit = _Audit()
+    report = import_repairs(
+        _csv([existing[0]["id"], None, None], ["M1", "M3", "M3"]),
+        client=db, machine_index=index, audit=audit,
+    )
+    assert not report["failed_chunks"]
+    assert report["inserted"] == 3
+    assert len(db.table("repair_cases").select("id").execute().data) == 4
+    assert len(audit.events) == 3
+    assert all(payload.get("id") for _, payload in audit.events)
@@ -0,0 +1,26 @@
+import functools
+import pytest
+from bench.synthetic import generate
+from core.database import fetch_dataframe
+from services import kpi_service
+from services.repair_service import build_repair_frame
+
+
+@pytest.fixture(scope="module")
+def tables():
+    return generate(20_000)
+
+
+def test_sql_kpis_match_pandas(tables):
+    df = build_repair_frame(tables["repair_cases"], tables["machines"])
+    assert kpi_service.check_parity(tables["repair_cases"], tables["machines"], df) == []
+
+
+def test_sql_kpis_read_views_across_pages(tables, monkeypatch):
+    # Trang nhỏ để kpi_machine_branch (~600 dòng) phải đọc qua nhiều trang như khi vượt max-rows của PostgREST
+    monkeypatch.setattr(kpi_service, "fetch_dataframe", functools.partial(fetch_dataframe, page_size=50))
+    df = build_repair_frame(tables["repair_cases"], tables["machines"])
+    local = kpi_service.LocalPostgrest(tables["repair_cases"], tables["machines"])
+    paged = kpi_service.sql_kpis(local)
+    assert len(paged["machine"]) > 50
+    assert kpi_service.compare_kpis(kpi_service.pandas_kpis(df), paged) == []